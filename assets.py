@@ -0,0 +1,143 @@
+"""
+Dashboard pages and static files for the mock server, loaded on first use.
+
+Nothing under web_interface/ is read or compressed at import, so importing
+mock_server and starting a headless service stay cheap. Each file is read
+and compressed once (gzip, plus brotli when installed), the first time it
+is requested, and kept for the life of the process.
+
+Files are served as /static/<name>. url(name) appends the content hash
+(?v=...): a request for the current hash may be cached for a year, since
+any change to the file changes its URL, while unversioned requests are
+revalidated with the strong ETag. HTML pages refer to other files as
+{{static:<name>}}, which is replaced with url(name) when the page loads.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import threading
+
+try:
+    import brotli  # Optional: pip install brotli
+except ImportError:
+    brotli = None
+
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'web_interface')
+STATIC_PREFIX = '/static/'
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'             # Always revalidate; a matching ETag costs only a 304
+
+_NAME = re.compile(r'[A-Za-z0-9][\w.-]*')   # A file directly in the directory, no dotfiles
+_STATIC_REF = re.compile(r'\{\{static:([\w.-]+)\}\}')
+_CONTENT_TYPES = {
+    '.html': 'text/html; charset=utf-8',
+    '.css': 'text/css; charset=utf-8',
+    '.js': 'text/javascript; charset=utf-8',
+    '.svg': 'image/svg+xml',
+    '.json': 'application/json',
+}
+
+
+class PrecompressedAsset:
+    # A static response body that is encoded and compressed once.
+    # Each encoding gets its own strong ETag derived from a hash of the source,
+    # so any change to the page busts every cached copy.
+
+    def __init__(self, content, content_type):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        self.content_type = content_type
+        self.version = hashlib.sha256(content).hexdigest()[:16]
+        self.variants = {'identity': content}
+        self.variants['gzip'] = gzip.compress(content, compresslevel=9, mtime=0)
+        if brotli is not None:
+            self.variants['br'] = brotli.compress(content, quality=11)
+        self.etags = {
+            encoding: f'"{self.version}"' if encoding == 'identity' else f'"{self.version}-{encoding}"'
+            for encoding in self.variants
+        }
+
+    def select_encoding(self, accept_encoding):
+        accepted = parse_accept_encoding(accept_encoding)
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accepted.get(encoding, accepted.get('*', 0)) > 0:
+                return encoding
+        return 'identity'
+
+    def matches(self, if_none_match):
+        # Weak comparison (RFC 9110 13.1.2); any encoding of the current
+        # version is still fresh for the client.
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag == '*':
+                return True
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag.strip('"').split('-', 1)[0] == self.version:
+                return True
+        return False
+
+
+class AssetStore:
+    def __init__(self, directory=ASSET_DIR):
+        self.directory = directory
+        self.loads = 0
+        self._assets = {}
+        # Reentrant: loading a page resolves the versions of the files it uses
+        self._lock = threading.RLock()
+
+    def get(self, name):
+        # PrecompressedAsset for a file in the directory, or None
+        asset = self._assets.get(name)
+        if asset is None and _NAME.fullmatch(name):
+            with self._lock:
+                asset = self._assets.get(name)
+                if asset is None:
+                    asset = self._load(name)
+                    if asset is not None:
+                        self._assets = {**self._assets, name: asset}
+        return asset
+
+    def url(self, name):
+        asset = self.get(name)
+        if asset is None:
+            raise KeyError(f"no static file {name!r} in {self.directory}")
+        return f"{STATIC_PREFIX}{name}?v={asset.version}"
+
+    def _load(self, name):
+        try:
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                content = f.read()
+        except (FileNotFoundError, IsADirectoryError):
+            return None
+        ext = os.path.splitext(name)[1]
+        content_type = _CONTENT_TYPES.get(ext) or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if ext == '.html':
+            content = _STATIC_REF.sub(lambda m: self.url(m.group(1)), content.decode('utf-8'))
+        self.loads += 1
+        return PrecompressedAsset(content, content_type)
+
+
+def parse_accept_encoding(accept_encoding):
+    # {coding: q} from an Accept-Encoding header
+    accepted = {}
+    for item in (accept_encoding or '').split(','):
+        name, _, params = item.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted
+
+
+def accepts_gzip(accept_encoding):
+    accepted = parse_accept_encoding(accept_encoding)
+    return accepted.get('gzip', accepted.get('*', 0)) > 0
@@ -0,0 +1,97 @@
+"""
+Bulk export benchmark.
+
+Fills a temporary reading log with N sites sampled at 1 Hz, then streams
+GET /export over it as CSV, as the columnar format and as daily
+aggregates. Reports throughput, bytes per reading and the server's peak
+RSS growth, which should stay flat however long the range is.
+
+    python benchmarks/export_range.py
+    python benchmarks/export_range.py --sites 10 --days 30
+"""
+import argparse
+import http.client
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np  # noqa: E402
+
+import mock_server  # noqa: E402
+
+
+def fill(log, sites, days, seed=1):
+    rng = np.random.default_rng(seed)
+    start = time.time() - days * 86400
+    per_day = 86400
+    for day in range(days):
+        t = start + day * per_day + np.arange(per_day, dtype=np.float64)
+        for site in range(sites):
+            moisture = rng.uniform(20, 60, per_day).round()
+            voltage = rng.uniform(2.5, 2.7, per_day)
+            status = rng.random(per_day) < 0.95
+            log.append_many(f"pit{site}", t.tolist(), moisture.tolist(), voltage.tolist(), status.tolist())
+    log.sync()
+    return sites * days * per_day
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def fetch(host, port, path, gzip=False):
+    conn = http.client.HTTPConnection(host, port)
+    started = time.perf_counter()
+    conn.request("GET", path, headers={"Accept-Encoding": "gzip"} if gzip else {})
+    response = conn.getresponse()
+    assert response.status == 200, response.status
+    size = 0
+    for data in iter(lambda: response.read1(1 << 20), b''):
+        size += len(data)
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return size, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sites", type=int, default=4)
+    parser.add_argument("--days", type=int, default=7)
+    args = parser.parse_args(argv)
+
+    data_dir = tempfile.mkdtemp(prefix="earthing-export-")
+    log = mock_server.open_reading_log(data_dir)
+    readings = fill(log, args.sites, args.days)
+    httpd = mock_server.make_server(0, host="127.0.0.1")
+    host, port = httpd.server_address
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    print(f"{readings} readings, {args.sites} sites, {args.days} days, "
+          f"{readings * 24 / 2 ** 20:.0f} MiB of log, {peak_rss_mb():.0f} MiB peak RSS before export")
+    print(f"{'export':<28} {'bytes/rdg':>10} {'rdg/s':>12} {'RSS +MiB':>9}")
+    try:
+        for name, path, gzip in (
+            ("csv", "/export?format=csv", False),
+            ("csv gzip", "/export?format=csv", True),
+            ("columnar", "/export?format=columnar", False),
+            ("columnar, one site", "/export?format=columnar&site=pit0", False),
+            ("columnar, faults only", "/export?format=columnar&fault=1", False),
+            ("daily aggregates", "/export?agg=daily", False),
+        ):
+            before = peak_rss_mb()
+            size, elapsed = fetch(host, port, path, gzip)
+            print(f"{name:<28} {size / readings:>10.2f} {readings / elapsed:>12.0f} {peak_rss_mb() - before:>9.1f}")
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        mock_server.reading_log.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Gateway fan-in benchmark.
+
+Spawns the built-in device simulator with N virtual ESP32 nodes and
+measures how long one gateway poll round over all of them takes.
+
+    python benchmarks/gateway_fanin.py                  # 100, 1000 and 5000 devices
+    python benchmarks/gateway_fanin.py --devices 2000 --latency 0.05 --offline 0.02
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from gateway import MAX_IN_FLIGHT, DeviceSimulator, Gateway, raise_fd_limit  # noqa: E402
+
+
+async def measure(gw, rounds):
+    semaphore = asyncio.Semaphore(gw.max_in_flight)
+    # First round opens the keep-alive connections; report it separately
+    started = time.perf_counter()
+    await gw.poll_round(semaphore)
+    connect = time.perf_counter() - started
+    durations = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        await gw.poll_round(semaphore)
+        durations.append(time.perf_counter() - started)
+    for device in gw.devices.values():
+        device.close()
+    return connect, durations
+
+
+def run(count, rounds, latency, offline, in_flight, timeout):
+    simulator = DeviceSimulator(count, latency=latency, offline_rate=offline, seed=1).start()
+    gw = Gateway(interval=0, timeout=timeout, max_in_flight=in_flight)
+    for site_id, url in simulator.urls():
+        gw.register(site_id, url)
+    connect, durations = asyncio.run(measure(gw, rounds))
+    simulator.stop()
+    durations.sort()
+    mean = sum(durations) / len(durations)
+    return {
+        "devices": count,
+        "connect_s": connect,
+        "round_ms": mean * 1000,
+        "worst_ms": durations[-1] * 1000,
+        "polls_per_s": count / mean,
+        "errors": gw.poll_errors,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, nargs="+", default=[100, 1000, 5000])
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated device response delay (s)")
+    parser.add_argument("--offline", type=float, default=0.0, help="fraction of devices that never answer")
+    parser.add_argument("--in-flight", type=int, default=MAX_IN_FLIGHT)
+    parser.add_argument("--timeout", type=float, default=2.0)
+    args = parser.parse_args(argv)
+
+    raise_fd_limit()
+    print(f"{'devices':>8} {'connect s':>10} {'round ms':>10} {'worst ms':>10} {'polls/s':>10} {'errors':>7}")
+    for count in args.devices:
+        r = run(count, args.rounds, args.latency, args.offline, args.in_flight, args.timeout)
+        print(f"{r['devices']:>8} {r['connect_s']:>10.2f} {r['round_ms']:>10.1f} {r['worst_ms']:>10.1f} "
+              f"{r['polls_per_s']:>10.0f} {r['errors']:>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Binary vs JSON ingestion benchmark.
+
+Builds the same buffered readings as ingest_protocol binary frames and as
+the JSON equivalent, then compares payload size, decode+validate
+throughput in-process, and end-to-end POST /ingest throughput into a
+temporary reading log.
+
+    python benchmarks/ingest_formats.py
+    python benchmarks/ingest_formats.py --readings 200000 --batch 100 3600
+"""
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import ingest_protocol  # noqa: E402
+import mock_server  # noqa: E402
+
+
+def make_readings(count, seed=1):
+    rnd = random.Random(seed)
+    start = time.time() - count
+    return [(start + i, rnd.randint(20, 60), round(rnd.uniform(2.5, 2.7), 3), rnd.random() < 0.9)
+            for i in range(count)]
+
+
+def binary_body(site, readings):
+    return ingest_protocol.encode_frame(site, readings)
+
+
+def json_body(site, readings):
+    return json.dumps({"site": site, "readings": [
+        {"t": t, "moisture": m, "voltage": v, "earthingGood": g} for t, m, v, g in readings
+    ]}).encode("utf-8")
+
+
+def rate(fn, count, repeat=3):
+    best = math.inf
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return count / best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readings", type=int, default=100000)
+    parser.add_argument("--batch", type=int, nargs="+", default=[60, 3600],
+                        help="readings per upload (60 = one minute offline at 1 Hz)")
+    args = parser.parse_args(argv)
+
+    readings = make_readings(args.readings)
+    data_dir = tempfile.mkdtemp(prefix="earthing-ingest-")
+    mock_server.open_reading_log(data_dir)
+    httpd = mock_server.make_server(0, host="127.0.0.1")
+    host, port = httpd.server_address
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    print(f"{'batch':>6} {'format':<7} {'bytes/rdg':>10} {'decode rdg/s':>14} {'POST rdg/s':>12}")
+    try:
+        for batch in args.batch:
+            chunks = [readings[i:i + batch] for i in range(0, len(readings), batch)]
+            for name, encode, decode, ctype in (
+                ("binary", binary_body, ingest_protocol.decode, "application/octet-stream"),
+                ("json", json_body, ingest_protocol.decode_json, "application/json"),
+            ):
+                bodies = [encode("bench", chunk) for chunk in chunks]
+                size = sum(len(b) for b in bodies) / len(readings)
+                decode_rate = rate(lambda: [decode(b) for b in bodies], len(readings))
+                conn = http.client.HTTPConnection(host, port)
+
+                def post_all():
+                    for body in bodies:
+                        conn.request("POST", "/ingest", body, {"Content-Type": ctype})
+                        response = conn.getresponse()
+                        response.read()
+                        assert response.status == 200, response.status
+
+                post_rate = rate(post_all, len(readings), repeat=1)
+                conn.close()
+                print(f"{batch:>6} {name:<7} {size:>10.1f} {decode_rate:>14.0f} {post_rate:>12.0f}")
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        mock_server.reading_log.close()
+
+
+if __name__ == "__main__":
+    main()
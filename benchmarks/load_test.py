@@ -0,0 +1,120 @@
+"""
+Load test for the mock server.
+
+Spawns N concurrent pollers that hit a route over persistent HTTP/1.1
+connections and reports p50/p99 latency and requests/sec.
+
+    python benchmarks/load_test.py                      # in-process server, 1/10/100 pollers
+    python benchmarks/load_test.py --engine single      # compare with the old single-threaded server
+    python benchmarks/load_test.py --no-metrics         # measure the cost of request instrumentation
+    python benchmarks/load_test.py --url http://192.168.4.1 --concurrency 1 10
+"""
+import argparse
+import http.client
+import os
+import sys
+import threading
+import time
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import mock_server  # noqa: E402
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def poller(host, port, path, deadline, interval, latencies, errors):
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+            if response.getheader("Connection", "").lower() == "close":
+                conn.close()
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(repr(e))
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=10)
+            continue
+        latencies.append(time.perf_counter() - start)
+        if interval:
+            remaining = interval - (time.perf_counter() - start)
+            if remaining > 0:
+                time.sleep(remaining)
+    conn.close()
+
+
+def run_level(host, port, path, concurrency, duration, interval):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=poller, args=(host, port, path, deadline, interval, latencies, errors),
+                         daemon=True)
+        for _ in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(duration + 30)
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="target an already running server instead of starting one")
+    parser.add_argument("--path", default="/data")
+    parser.add_argument("--engine", choices=mock_server.ENGINES, default="threaded")
+    parser.add_argument("--workers", type=int, default=mock_server.DEFAULT_WORKERS)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per concurrency level")
+    parser.add_argument("--interval", type=float, default=0.0,
+                        help="seconds between polls per client (0 = as fast as possible, 1 = dashboard rate)")
+    parser.add_argument("--no-metrics", action="store_true", help="disable per-request instrumentation")
+    args = parser.parse_args(argv)
+
+    httpd = None
+    if args.url:
+        target = urlparse(args.url)
+        host, port = target.hostname, target.port or 80
+    else:
+        if args.no_metrics:
+            mock_server.request_metrics = None
+        httpd = mock_server.make_server(0, args.engine, args.workers, host="127.0.0.1")
+        host, port = httpd.server_address
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    print(f"Target http://{host}:{port}{args.path}  duration={args.duration}s interval={args.interval}s")
+    print(f"{'clients':>8} {'requests':>9} {'errors':>7} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    try:
+        for concurrency in args.concurrency:
+            r = run_level(host, port, args.path, concurrency, args.duration, args.interval)
+            print(f"{r['concurrency']:>8} {r['requests']:>9} {r['errors']:>7} "
+                  f"{r['rps']:>10.1f} {r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f}")
+    finally:
+        if httpd is not None:
+            httpd.shutdown()
+            httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
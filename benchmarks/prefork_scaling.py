@@ -0,0 +1,104 @@
+"""
+Pre-fork scaling benchmark.
+
+Starts mock_server.py as a subprocess, first as the single-process threaded
+server and then with --processes 1, 2, ... up to the CPU count, and
+drives each with load from several client processes (one client process
+would be GIL-bound before the server is). Reports requests/sec, latency
+and speedup over the threaded server.
+
+    python benchmarks/prefork_scaling.py
+    python benchmarks/prefork_scaling.py --processes 1 2 4 8 --clients 4 --concurrency 16
+    python benchmarks/prefork_scaling.py --path /sites
+
+Requests/sec only scales while there are idle cores: with C cores, N
+workers and the client processes share them.
+"""
+import argparse
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from load_test import percentile, poller
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+def start_server(processes):
+    command = [sys.executable, "-u", os.path.join(ROOT, "mock_server.py"), "--port", "0", "--no-browser"]
+    if processes:
+        command += ["--processes", str(processes)]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    line = server.stdout.readline()
+    if "running at" not in line:
+        server.kill()
+        raise RuntimeError(f"server did not start: {line}{server.stdout.read()}")
+    # "Mock Server running at http://localhost:PORT (...)"
+    port = int(line.split("http://localhost:")[1].split()[0])
+    threading.Thread(target=server.stdout.read, daemon=True).start()
+    return server, port
+
+
+def client(port, path, concurrency, duration):
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    threads = [threading.Thread(target=poller, args=("127.0.0.1", port, path, deadline, 0, latencies, errors))
+               for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, len(errors)
+
+
+def run(processes, args):
+    server, port = start_server(processes)
+    try:
+        # Warm up connections and let every worker finish starting
+        client(port, args.path, 1, 0.5)
+        with multiprocessing.Pool(args.clients) as pool:
+            started = time.perf_counter()
+            results = pool.starmap(client, [(port, args.path, args.concurrency, args.duration)] * args.clients)
+            elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait(10)
+    latencies = sorted(latency for result in results for latency in result[0])
+    return {
+        "requests": len(latencies),
+        "errors": sum(result[1] for result in results),
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+
+
+def main(argv=None):
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--processes", type=int, nargs="+",
+                        default=sorted({1, *range(2, cpus + 1, max(1, cpus // 4))} | {cpus}),
+                        help="worker process counts to measure (default: 1 .. CPU count)")
+    parser.add_argument("--path", default="/data")
+    parser.add_argument("--clients", type=int, default=max(2, cpus // 2), help="load generator processes")
+    parser.add_argument("--concurrency", type=int, default=8, help="connections per client process")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per run")
+    args = parser.parse_args(argv)
+
+    print(f"{cpus} CPUs, {args.clients} client processes x {args.concurrency} connections, "
+          f"GET {args.path} for {args.duration}s")
+    print(f"{'server':>10} {'requests':>9} {'errors':>7} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'speedup':>8}")
+    baseline = None
+    for processes in [0] + args.processes:
+        r = run(processes, args)
+        baseline = baseline or r["rps"]
+        label = f"{processes} proc" if processes else "threaded"
+        print(f"{label:>10} {r['requests']:>9} {r['errors']:>7} {r['rps']:>10.1f} "
+              f"{r['p50_ms']:>9.2f} {r['p99_ms']:>9.2f} {r['rps'] / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+"""
+End-to-end benchmark and performance regression check.
+
+Starts the mock server in-process on a temporary reading log and times
+the hot paths of the monitoring pipeline:
+
+    data        GET /data latency over a keep-alive connection
+    dashboard   GET / (gzip) and its 304 revalidation
+    stream      time for one event to reach N /stream subscribers
+    ingest      POST /ingest binary upload throughput
+    rules       rule engine evaluation per sample
+    history     /history over 10M stored readings, and the in-memory ring buffer
+
+Results are written as JSON (--output). --save stores them as a baseline,
+and --compare checks a run against one. Any metric worse than the baseline
+by more than --tolerance is reported, and the exit status is 1. CI can
+therefore fail on a regression without hard-coding timings.
+
+    python benchmarks/regression.py --save benchmarks/baseline.json
+    python benchmarks/regression.py --compare benchmarks/baseline.json
+    python benchmarks/regression.py --quick --only data rules
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import selectors
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import ingest_protocol  # noqa: E402
+import mock_server  # noqa: E402
+from gateway import raise_fd_limit  # noqa: E402
+from history import ReadingHistory  # noqa: E402
+from rule_engine import RuleEngine  # noqa: E402
+from streaming import encode_event  # noqa: E402
+
+GROUPS = ("data", "dashboard", "stream", "ingest", "rules", "history")
+# Workload sizes; the baseline records them and --compare refuses a mismatch
+FULL = {"requests": 5000, "subscribers": 500, "fanouts": 50, "ingest_readings": 200000,
+        "ingest_batch": 3600, "rule_samples": 500000, "stored": 10_000_000, "queries": 5}
+QUICK = {"requests": 1000, "subscribers": 50, "fanouts": 20, "ingest_readings": 20000,
+         "ingest_batch": 3600, "rule_samples": 50000, "stored": 1_000_000, "queries": 3}
+TOLERANCE = 0.5           # Fractional slowdown allowed before a metric counts as a regression
+HISTORY_SITE = "bench-history"
+FILL_BATCH = 100000
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def lower_is_better(name):
+    # Latencies (_us, _ms, _ns) shrink when faster, rates (_per_s) grow
+    return not name.endswith("_per_s")
+
+
+def timed_requests(conn, n, method, path, body=None, headers=None, expect=200):
+    latencies = []
+    for _ in range(n):
+        started = time.perf_counter()
+        conn.request(method, path, body, headers or {})
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - started)
+        assert response.status == expect, (path, response.status)
+    latencies.sort()
+    return latencies
+
+
+def bench_data(port, sizes):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    timed_requests(conn, 100, "GET", "/data")        # Warm up
+    latencies = timed_requests(conn, sizes["requests"], "GET", "/data")
+    conn.close()
+    return {"p50_us": percentile(latencies, 50) * 1e6, "p99_us": percentile(latencies, 99) * 1e6,
+            "requests_per_s": len(latencies) / sum(latencies)}
+
+
+def bench_dashboard(port, sizes):
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    gzip_header = {"Accept-Encoding": "gzip"}
+    conn.request("GET", "/", headers=gzip_header)
+    response = conn.getresponse()
+    response.read()
+    etag = response.getheader("ETag")
+    n = sizes["requests"] // 5
+    full = timed_requests(conn, n, "GET", "/", headers=gzip_header)
+    revalidate = timed_requests(conn, n, "GET", "/", headers={**gzip_header, "If-None-Match": etag},
+                                expect=304)
+    conn.close()
+    return {"gzip_p50_us": percentile(full, 50) * 1e6, "not_modified_p50_us": percentile(revalidate, 50) * 1e6}
+
+
+def open_subscribers(port, count):
+    socks = []
+    for _ in range(count):
+        sock = socket.create_connection(("127.0.0.1", port))
+        sock.sendall(b"GET /stream HTTP/1.1\r\nHost: bench\r\n\r\n")
+        socks.append(sock)
+    deadline = time.monotonic() + 30
+    while len(mock_server.stream_hub) < count:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"only {len(mock_server.stream_hub)} of {count} subscribers registered")
+        time.sleep(0.01)
+    for sock in socks:
+        sock.setblocking(False)
+    return socks
+
+
+def bench_stream(port, sizes):
+    # One event published to the hub, timed until every subscriber has it
+    socks = open_subscribers(port, sizes["subscribers"])
+    selector = selectors.DefaultSelector()
+    for sock in socks:
+        selector.register(sock, selectors.EVENT_READ)
+    durations = []
+    try:
+        for i in range(sizes["fanouts"]):
+            marker = b'{"bench":%d}' % i
+            received = {sock: b"" for sock in socks}
+            waiting = set(socks)
+            started = time.perf_counter()
+            mock_server.stream_hub.publish(encode_event(marker, event="bench"), key="bench")
+            while waiting:
+                for key, _ in selector.select(timeout=10):
+                    sock = key.fileobj
+                    try:
+                        data = sock.recv(65536)
+                    except BlockingIOError:
+                        continue
+                    if not data:
+                        raise RuntimeError("stream subscriber disconnected")
+                    if sock in waiting:
+                        received[sock] += data
+                        if marker in received[sock]:
+                            waiting.discard(sock)
+            durations.append(time.perf_counter() - started)
+    finally:
+        selector.close()
+        for sock in socks:
+            sock.close()
+    durations.sort()
+    median = statistics.median(durations)
+    return {"fanout_p50_ms": median * 1000, "fanout_p99_ms": percentile(durations, 99) * 1000,
+            "deliveries_per_s": len(socks) / median}
+
+
+def bench_ingest(port, sizes):
+    count, batch = sizes["ingest_readings"], sizes["ingest_batch"]
+    rnd = random.Random(1)
+    start = time.time() - count
+    readings = [(start + i, rnd.randint(20, 60), round(rnd.uniform(2.5, 2.7), 3), rnd.random() < 0.9)
+                for i in range(count)]
+    bodies = [ingest_protocol.encode_frame("bench-ingest", readings[i:i + batch])
+              for i in range(0, count, batch)]
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    headers = {"Content-Type": "application/octet-stream"}
+    latencies = [timed_requests(conn, 1, "POST", "/ingest", body, headers)[0] for body in bodies]
+    conn.close()
+    return {"readings_per_s": count / sum(latencies), "upload_p50_ms": statistics.median(latencies) * 1000}
+
+
+def bench_rules(port, sizes):
+    n = sizes["rule_samples"]
+    rnd = random.Random(2)
+    start = time.time()
+    timestamps = [start + i for i in range(n)]
+    moisture = [rnd.uniform(15, 50) for _ in range(n)]
+    voltage = [rnd.uniform(2.5, 2.7) for _ in range(n)]
+    engine = RuleEngine()
+    started = time.perf_counter()
+    engine.feed_series("bench", timestamps, moisture, voltage)
+    series = time.perf_counter() - started
+    samples = [("bench-%d" % (i % 100), t, m, v) for i, (t, m, v) in enumerate(zip(timestamps, moisture, voltage))]
+    started = time.perf_counter()
+    engine.feed_many(samples)
+    many = time.perf_counter() - started
+    return {"feed_series_ns": series / n * 1e9, "feed_many_ns": many / n * 1e9}
+
+
+def fill_log(log, stored, end):
+    # stored readings at 1 Hz for HISTORY_SITE, ending at end
+    rnd = random.Random(3)
+    start = end - stored
+    for offset in range(0, stored, FILL_BATCH):
+        n = min(FILL_BATCH, stored - offset)
+        log.append_many(HISTORY_SITE, [start + offset + i for i in range(n)],
+                        [rnd.randint(20, 60) for _ in range(n)],
+                        [2.5 + rnd.random() * 0.2 for _ in range(n)],
+                        [rnd.random() < 0.95 for _ in range(n)])
+    log.sync()
+    return start
+
+
+def check_log_reopen():
+    # A log holding both in-order and late (backfill journal) readings must
+    # reopen, replay and answer queries like the one that wrote it
+    data_dir = tempfile.mkdtemp(prefix="earthing-regression-")
+    try:
+        now, site = time.time(), mock_server.LOCAL_SITE
+        log = mock_server.open_reading_log(data_dir)
+        log.append_many(site, [now - 60 + i for i in range(60)], [40] * 60, [2.58] * 60, [1] * 60)
+        log.append_many(site, [now - 600 + i for i in range(60)], [30] * 60, [2.57] * 60, [1] * 60)
+        expected = log.query(now - 3600, now, 0, site)
+        log.close()
+        log = mock_server.open_reading_log(data_dir)
+        reopened = log.query(now - 3600, now, 0, site)
+        log.close()
+        assert len(log) == 120 and reopened == expected, "reading log changed across close and reopen"
+    finally:
+        shutil.rmtree(data_dir)
+
+
+def median_ms(fn, repeat):
+    durations = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - started)
+    return statistics.median(durations) * 1000
+
+
+def bench_history(port, sizes, end):
+    start = end - sizes["stored"]
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+
+    def get(query):
+        return lambda: timed_requests(conn, 1, "GET", f"/history?site={HISTORY_SITE}&{query}")
+
+    results = {
+        "full_range_ms": median_ms(get(f"from={start}&to={end}"), sizes["queries"]),
+        "day_by_minute_ms": median_ms(get(f"from={end - 86400}&to={end}&step=60"), sizes["queries"]),
+        "hour_raw_ms": median_ms(get(f"from={end - 3600}&to={end}&step=0"), sizes["queries"]),
+    }
+    conn.close()
+    ring = ReadingHistory()
+    now = time.time()
+    for i in range(ring.capacity):
+        ring.append(now - ring.capacity + i, 40.0, 2.58, True)
+    results["ring_hour_by_minute_ms"] = median_ms(lambda: ring.query(now - 3600, now, 60), sizes["queries"] * 10)
+    return results
+
+
+def run(groups, sizes):
+    if "history" in groups:
+        check_log_reopen()
+    data_dir = tempfile.mkdtemp(prefix="earthing-regression-")
+    try:
+        return run_in(data_dir, groups, sizes)
+    finally:
+        shutil.rmtree(data_dir)     # ~240 MB of segments after a full run
+
+
+def run_in(data_dir, groups, sizes):
+    log = mock_server.open_reading_log(data_dir)
+    try:
+        # Stored history ends a day before the ingest benchmark's readings
+        history_end = float(int(time.time()) - sizes["ingest_readings"] - 86400)
+        fill_seconds = None
+        if "history" in groups:
+            started = time.perf_counter()
+            fill_log(log, sizes["stored"], history_end)
+            fill_seconds = time.perf_counter() - started
+        httpd = mock_server.make_server(0, host="127.0.0.1")
+        port = httpd.server_address[1]
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        metrics = {}
+        try:
+            for group in groups:
+                if group == "history":
+                    results = bench_history(port, sizes, history_end)
+                else:
+                    results = globals()[f"bench_{group}"](port, sizes)
+                for name, value in results.items():
+                    metrics[f"{group}.{name}"] = round(value, 3)
+                print(f"{group:<10} " + "  ".join(f"{name} {value:.1f}" for name, value in results.items()),
+                      flush=True)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+    finally:
+        mock_server.reading_log.close()
+    if fill_seconds is not None:
+        print(f"({sizes['stored']} readings stored in {fill_seconds:.1f} s)")
+    return metrics
+
+
+def compare(metrics, baseline, tolerance):
+    # Returns [(name, baseline, current, change)] for metrics past tolerance
+    regressions = []
+    for name, current in metrics.items():
+        reference = baseline["metrics"].get(name)
+        if not reference:
+            continue
+        if lower_is_better(name):
+            change = current / reference - 1
+        else:
+            change = reference / current - 1 if current else float("inf")
+        if change > tolerance:
+            regressions.append((name, reference, current, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--only", nargs="+", choices=GROUPS, default=list(GROUPS))
+    parser.add_argument("--quick", action="store_true", help="smaller workloads (1M stored readings)")
+    parser.add_argument("--output", metavar="FILE", help="write this run's results as JSON")
+    parser.add_argument("--save", metavar="FILE", help="write this run's results as the baseline")
+    parser.add_argument("--compare", metavar="FILE", help="exit 1 if any metric regressed against this baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="allowed slowdown as a fraction of the baseline (default 0.5)")
+    args = parser.parse_args(argv)
+
+    sizes = QUICK if args.quick else FULL
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline["sizes"] != sizes:
+            parser.error(f"{args.compare} was recorded with other workload sizes"
+                         f" (the {'--quick' if baseline['sizes'] == QUICK else 'full'} run?)")
+
+    raise_fd_limit()
+    metrics = run([g for g in GROUPS if g in args.only], sizes)
+    result = {
+        "recorded": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "machine": f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs",
+        "sizes": sizes,
+        "metrics": metrics,
+    }
+    for path in filter(None, (args.output, args.save)):
+        with open(path, "w") as f:
+            json.dump(result, f, indent=2)
+            f.write("\n")
+    if baseline is not None:
+        regressions = compare(metrics, baseline, args.tolerance)
+        for name, reference, current, change in regressions:
+            print(f"REGRESSION {name}: {reference:.1f} -> {current:.1f} ({change:+.0%} slower)", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions beyond {args.tolerance:.0%} against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+"""
+Deterministic scenario replay benchmark.
+
+Generates a seeded multi-site scenario (drift, diurnal cycle, spikes,
+dropouts, gradual faults), streams it into an in-process server through
+POST /ingest, then reports:
+
+    generation   samples/s produced by the vectorized simulator
+    ingest       readings/s through /ingest (reading log + fault detector)
+    alerting     faults detected vs ground truth, detection delay, false alarms
+    history      /history latency for one site over the whole run
+
+The same --seed gives the same series, so runs are comparable.
+
+    python benchmarks/scenario_replay.py
+    python benchmarks/scenario_replay.py --sites 500 --duration 86400 --speed 1000
+"""
+import argparse
+import http.client
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np  # noqa: E402
+
+import mock_server  # noqa: E402
+import scenario  # noqa: E402
+from rule_engine import BAD  # noqa: E402
+
+
+def best_ms(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return best * 1000
+
+
+def score(sim, truth, events, window):
+    # truth: (sites, samples) ground-truth fault mask. A BAD event is a
+    # false alarm unless the truth is faulted between `window` samples
+    # before it and one fault ramp after it (early warning while the
+    # signal degrades is fine). A fault is detected if the site is BAD at
+    # its onset or goes BAD later; the delay is measured from the onset.
+    index = {site: i for i, site in enumerate(sim.site_ids)}
+    ahead = int(sim.fault_ramp / sim.step)
+    timeline = {}
+    false_alarms = 0
+    for event in events:
+        if event.site not in index:
+            continue
+        row = index[event.site]
+        timeline.setdefault(row, []).append((event.timestamp, event.state))
+        if event.state == BAD:
+            k = int(round((event.timestamp - sim.start) / sim.step))
+            if not truth[row, max(0, k - window):k + ahead + 1].any():
+                false_alarms += 1
+    delays, missed = [], 0
+    for row in np.flatnonzero(truth.any(axis=1)):
+        onset = sim.start + np.argmax(truth[row]) * sim.step
+        history = timeline.get(row, [])
+        before = [state for t, state in history if t <= onset]
+        if before and before[-1] == BAD:
+            delays.append(0.0)
+            continue
+        after = [t for t, state in history if t > onset and state == BAD]
+        if after:
+            delays.append(after[0] - onset)
+        else:
+            missed += 1
+    return len(delays), missed, false_alarms, delays
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sites", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=6 * 3600, help="simulated seconds")
+    parser.add_argument("--speed", type=float, default=0.0, help="times real time (0 = max)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk", type=int, default=600)
+    args = parser.parse_args(argv)
+
+    lead = args.duration * (1 - 1 / args.speed) if args.speed > 0 else args.duration
+    sim = scenario.Scenario(args.sites, args.duration, seed=args.seed, chunk=args.chunk,
+                            start=time.time() - lead)
+
+    started = time.perf_counter()
+    samples = sum(c.moisture.size for c in sim.chunks())
+    gen_rate = samples / (time.perf_counter() - started)
+
+    data_dir = tempfile.mkdtemp(prefix="earthing-scenario-")
+    mock_server.open_reading_log(data_dir)
+    events = []
+    mock_server.rule_engine.listeners.append(events.append)
+    httpd = mock_server.make_server(0, host="127.0.0.1")
+    host, port = httpd.server_address
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+
+    truth = []
+    try:
+        stats = scenario.stream(sim, f"http://{host}:{port}", args.speed,
+                                on_chunk=lambda chunk: truth.append(chunk.fault))
+        truth = np.concatenate(truth, axis=1)
+        window = mock_server.rule_engine.default_thresholds.debounce_m
+        detected, missed, false_alarms, delays = score(sim, truth, events, window)
+
+        site = sim.site_ids[int(sim.fault_sites[0])] if len(sim.fault_sites) else sim.site_ids[0]
+        conn = http.client.HTTPConnection(host, port)
+
+        def history(query):
+            def run():
+                conn.request("GET", f"/history?site={site}&{query}")
+                response = conn.getresponse()
+                response.read()
+                assert response.status == 200, response.status
+            return run
+
+        full_ms = best_ms(history(f"from={sim.start}&step=60"))
+        hour_ms = best_ms(history("from=-3600&step=0"))
+        conn.close()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        mock_server.reading_log.close()
+
+    print(f"scenario     {args.sites} sites x {len(sim)} samples, seed {args.seed}, "
+          f"{len(sim.fault_sites)} injected faults")
+    print(f"generation   {gen_rate:>12.0f} samples/s")
+    print(f"ingest       {stats.readings / stats.elapsed:>12.0f} readings/s  "
+          f"({stats.readings} readings, {stats.bytes / 1e6:.1f} MB, {stats.posts} posts, "
+          f"max lag {stats.max_lag:.2f} s)")
+    delay_text = (f"delay p50 {np.median(delays):.0f} s, max {max(delays):.0f} s" if delays else "no detections")
+    print(f"alerting     {detected} detected, {missed} missed, {false_alarms} false alarms, {delay_text}")
+    print(f"history      {full_ms:>9.1f} ms full run at step=60, {hour_ms:.1f} ms last hour raw ({site})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Cold start and memory footprint benchmark.
+
+Starts `mock_server.py --no-browser --port 0` in fresh interpreters and
+measures the import time of mock_server, the time from spawn until the
+dashboard is served, and the server's resident memory once it has served
+the dashboard and its static files. Exits non-zero when the median start
+or the RSS is over budget, so it can gate CI.
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --runs 10 --budget-ms 300 --budget-rss 35
+"""
+import argparse
+import gzip
+import http.client
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SERVER = os.path.join(ROOT, "mock_server.py")
+BUDGET_MS = 500           # Spawn to first dashboard response
+BUDGET_RSS_MB = 40        # Resident set after serving the dashboard
+
+
+def import_time():
+    code = "import time; t = time.perf_counter(); import mock_server; print(time.perf_counter() - t)"
+    out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(out.stdout)
+
+
+def get(port, path):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+    conn.request("GET", path, headers={"Accept-Encoding": "gzip"})
+    response = conn.getresponse()
+    body = response.read()
+    conn.close()
+    return response.status, body
+
+
+def rss_mb(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return float("nan")
+
+
+def cold_start():
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, SERVER, "--no-browser", "--port", "0"],
+                            cwd=ROOT, stdout=subprocess.PIPE, text=True)
+    try:
+        port = None
+        for line in proc.stdout:
+            match = re.search(r"localhost:(\d+)", line)
+            if match:
+                port = int(match.group(1))
+                break
+        if port is None:
+            raise RuntimeError("server exited before listening")
+        status, page = get(port, "/")
+        ready = time.perf_counter() - started
+        assert status == 200, status
+        page = gzip.decompress(page) if page[:2] == b"\x1f\x8b" else page
+        for path in re.findall(rb'"(/static/[^"]+)"', page):
+            assert get(port, path.decode())[0] == 200, path
+        get(port, "/data")
+        return ready, rss_mb(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=BUDGET_MS, help="median spawn-to-dashboard budget")
+    parser.add_argument("--budget-rss", type=float, default=BUDGET_RSS_MB, help="RSS budget, MiB")
+    args = parser.parse_args(argv)
+
+    imports = [import_time() * 1000 for _ in range(args.runs)]
+    starts, rss = zip(*(cold_start() for _ in range(args.runs)))
+    start_ms = statistics.median(starts) * 1000
+    peak_rss = max(rss)
+    print(f"{'':<22} {'median':>8} {'worst':>8} {'budget':>8}")
+    print(f"{'import mock_server ms':<22} {statistics.median(imports):>8.1f} {max(imports):>8.1f} {'':>8}")
+    print(f"{'spawn to dashboard ms':<22} {start_ms:>8.1f} {max(starts) * 1000:>8.1f} {args.budget_ms:>8.0f}")
+    print(f"{'RSS MiB':<22} {statistics.median(rss):>8.1f} {peak_rss:>8.1f} {args.budget_rss:>8.0f}")
+    over = [name for name, value, budget in (("start", start_ms, args.budget_ms),
+                                             ("RSS", peak_rss, args.budget_rss)) if value > budget]
+    if over:
+        print(f"Over budget: {', '.join(over)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Store-and-forward uplink under rate limiting, outages and a restart.
+
+Runs uplink.Uplink against a local stand-in for the ThingSpeak bulk-update
+API that enforces a per-channel request interval (429 with Retry-After)
+and goes down on schedule: connections are dropped without an answer
+for the first half of an outage and answered with 503 for the second.
+Readings are replayed at an accelerated rate, and later in the run the
+uplink is closed and reopened on the same spool, like a restart.
+
+Verifies that every coalesced entry arrives exactly once, then reports
+requests, rate limiting, connection reuse and queue depth. Exits non-zero
+on duplicates, on missing entries, or on drops when --max-spool is left
+at the default:
+
+    python benchmarks/uplink_outage.py
+    python benchmarks/uplink_outage.py --sites 200 --outage 5 --max-spool 65536   # force drops
+
+Readings carry simulated 1 Hz timestamps, so they still coalesce into 15 s
+entries, but each channel sends every --interval seconds instead of every 15.
+"""
+import argparse
+import http.server
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import uplink  # noqa: E402
+
+BULK_RE = re.compile(r'^/channels/(\d+)/bulk_update\.json$')
+
+
+class StandIn(http.server.ThreadingHTTPServer):
+    # ThingSpeak-like bulk update endpoint with per-channel rate limiting
+    daemon_threads = True
+
+    def __init__(self, keys, interval):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.keys = keys                # channel -> write key
+        self.interval = interval
+        self.down = None                # None, "drop" or "503"
+        self.entries = {}               # channel -> [created_at, ...]
+        self.last_update = {}
+        self.requests = 0
+        self.rate_limited = 0
+        self.refused = 0
+        self.connections = 0
+        self.lock = threading.Lock()
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def reply(self, status, body=b'', headers=()):
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with server.lock:
+            server.requests += 1
+            if server.down is not None:
+                server.refused += 1
+                if server.down == "drop":
+                    self.close_connection = True
+                    return          # No response at all
+                self.reply(503, b'Service Unavailable')
+                return
+            match = BULK_RE.match(self.path)
+            if match is None:
+                self.reply(404)
+                return
+            channel = int(match.group(1))
+            try:
+                update = json.loads(body)
+            except ValueError:
+                self.reply(400)
+                return
+            if update.get("write_api_key") != server.keys.get(channel):
+                self.reply(401)
+                return
+            now = time.monotonic()
+            wait = server.last_update.get(channel, -1e9) + server.interval - now
+            if wait > 0:
+                server.rate_limited += 1
+                self.reply(429, b'{"status":"429"}', [('Retry-After', f'{wait:.3f}')])
+                return
+            server.last_update[channel] = now
+            server.entries.setdefault(channel, []).extend(u["created_at"] for u in update["updates"])
+        self.reply(202, b'{"success":true}', [('Content-Type', 'application/json')])
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sites", type=int, default=50)
+    parser.add_argument("--hours", type=float, default=2.0, help="simulated hours of 1 Hz readings per site")
+    parser.add_argument("--run", type=float, default=10.0, help="wall seconds to replay them in")
+    parser.add_argument("--interval", type=float, default=0.5, help="uplink seconds between bulk updates")
+    parser.add_argument("--server-interval", type=float, default=0.6,
+                        help="stand-in rate limit; above --interval so some requests get 429")
+    parser.add_argument("--outage", type=float, default=3.0, help="seconds the stand-in is down")
+    parser.add_argument("--max-spool", type=int, default=uplink.MAX_SPOOL_BYTES, help="spool bound in bytes")
+    args = parser.parse_args(argv)
+
+    samples = int(args.hours * 3600)
+    speed = samples / args.run
+    sites = {f"site{i:04d}": 100000 + i for i in range(args.sites)}
+    server = StandIn({channel: f"KEY{channel}" for channel in sites.values()}, args.server_interval)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+    channels = {site: {"channel": channel, "key": f"KEY{channel}"} for site, channel in sites.items()}
+    spool = tempfile.mkdtemp(prefix="earthing-uplink-")
+
+    def open_uplink():
+        return uplink.Uplink(url, channels, spool, resolution=uplink.RESOLUTION, min_interval=args.interval,
+                             max_spool_bytes=args.max_spool, backoff_base=0.2, backoff_max=2.0, poll=0.05).start()
+
+    link = open_uplink()
+    # Simulated series ending now, so buckets close as the replay passes them
+    start = time.time() - samples
+    start -= start % uplink.RESOLUTION
+    expected = {site: set() for site in sites}
+    outage_at = args.run * 0.2
+    restart_at = args.run * 0.6
+    max_depth = max_spool = 0
+    restarts = dropped_before = 0
+    began = time.monotonic()
+    sent = 0
+    while sent < samples:
+        elapsed = time.monotonic() - began
+        if outage_at <= elapsed < outage_at + args.outage:
+            server.down = "drop" if elapsed < outage_at + args.outage / 2 else "503"
+        else:
+            server.down = None
+        if elapsed >= restart_at and not restarts:
+            dropped_before = link.totals()["dropped"]
+            link.close()
+            link = open_uplink()
+            restarts += 1
+        target = min(samples, int(elapsed * speed))
+        for k in range(sent, target):
+            t = start + k
+            for i, site in enumerate(sites):
+                good = (k + i) % 997 > 20
+                link.add(site, t, 40.0 + (k % 7), 2.58 + 0.001 * (i % 5), good)
+                expected[site].add(uplink.created_at(t - t % uplink.RESOLUTION))
+        sent = target
+        max_depth = max(max_depth, link.depth())
+        max_spool = max(max_spool, link.spool_bytes())
+        time.sleep(0.02)
+    server.down = None
+    link.flush()
+    drain_started = time.monotonic()
+    while link.depth() and time.monotonic() - drain_started < 60:
+        time.sleep(0.05)
+    drain = time.monotonic() - drain_started
+    dropped = dropped_before + link.totals()["dropped"]
+    link.close()
+    server.shutdown()
+    shutil.rmtree(spool)
+
+    delivered = missing = duplicates = 0
+    for site, channel in sites.items():
+        got = server.entries.get(channel, [])
+        delivered += len(got)
+        duplicates += len(got) - len(set(got))
+        missing += len(expected[site] - set(got))
+    readings = samples * len(sites)
+    entries = sum(len(e) for e in expected.values())
+
+    print(f"replay      {len(sites)} sites x {samples} readings in {args.run:.0f} s, "
+          f"outage {args.outage:.1f} s at {outage_at:.1f} s, restart at {restart_at:.1f} s")
+    print(f"coalescing  {readings} readings -> {entries} entries ({readings / entries:.0f}:1)")
+    print(f"delivery    {delivered} delivered, {missing} missing, {duplicates} duplicates, "
+          f"{dropped} dropped by the spool bound, drained {drain:.1f} s after the replay")
+    print(f"requests    {server.requests} bulk updates ({readings / max(1, server.requests):.0f} readings each), "
+          f"{server.rate_limited} rate limited, {server.refused} refused during the outage")
+    print(f"connections {server.connections} accepted by the stand-in for {server.requests} requests")
+    print(f"queue       max depth {max_depth} entries, max spool {max_spool / 1024:.0f} KiB")
+    print(f"one reading per call would need {readings} requests, "
+          f"{readings * uplink.MIN_INTERVAL / len(sites) / 86400:.0f} days per site at one per 15 s")
+
+    # Drops (and the entries they lose) are only expected below the default spool bound
+    drops_allowed = args.max_spool < uplink.MAX_SPOOL_BYTES
+    failed = [name for name, bad in (("duplicates", duplicates),
+                                     ("dropped", dropped and not drops_allowed),
+                                     ("missing", missing > (dropped if drops_allowed else 0))) if bad]
+    if failed:
+        print(f"Failed: {', '.join(failed)}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Waveform ingestion benchmark.
+
+Synthesizes 500-sample ZMPT101B blocks (50 Hz sine, DC offset, noise) and
+measures how many blocks per second signal_quality processes, compared with
+a scalar per-sample loop like readACVoltage(), both in-process and through
+POST /waveform on the mock server.
+
+    python benchmarks/waveform_ingest.py
+    python benchmarks/waveform_ingest.py --blocks 20000 --batch 100 1000
+"""
+import argparse
+import http.client
+import math
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np  # noqa: E402
+
+import mock_server  # noqa: E402
+import signal_quality as sq  # noqa: E402
+
+
+def synth(blocks, samples, sample_rate, seed=1):
+    rng = np.random.default_rng(seed)
+    t = np.arange(samples) / sample_rate
+    phase = rng.uniform(0, 2 * np.pi, (blocks, 1))
+    amplitude = 2.58 / sq.SCALE * math.sqrt(2) / sq.ADC_VOLTS
+    x = sq.ADC_MIDPOINT + rng.normal(20, 5, (blocks, 1)) \
+        + amplitude * np.sin(2 * np.pi * 50 * t + phase) + rng.normal(0, 4, (blocks, samples))
+    return np.clip(x, 0, 4095).round().astype(np.uint16)
+
+
+def scalar_rms(block):
+    # Per-sample loop as in readACVoltage()
+    sum_squares = 0.0
+    for adc in block:
+        v = (adc - 2048) * (3.3 / 4095.0)
+        sum_squares += v * v
+    return math.sqrt(sum_squares / len(block)) * sq.VOLTAGE_CAL * 100
+
+
+def rate(fn, count, repeat=3):
+    best = math.inf
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - started)
+    return count / best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--blocks", type=int, default=10000)
+    parser.add_argument("--samples", type=int, default=500)
+    parser.add_argument("--sample-rate", type=float, default=sq.DEFAULT_SAMPLE_RATE)
+    parser.add_argument("--batch", type=int, nargs="+", default=[10, 100, 1000],
+                        help="blocks per HTTP upload")
+    args = parser.parse_args(argv)
+
+    samples = synth(args.blocks, args.samples, args.sample_rate)
+    moisture = np.full(args.blocks, 40.0)
+    timestamps = time.time() + np.arange(args.blocks, dtype=np.float64)
+    buf = sq.encode_blocks(samples, moisture, timestamps, args.sample_rate)
+
+    scalar_blocks = samples[:200].tolist()
+    print(f"{'path':<28} {'blocks/s':>12}")
+    print(f"{'scalar loop (firmware)':<28} {rate(lambda: [scalar_rms(b) for b in scalar_blocks], len(scalar_blocks)):>12.0f}")
+    print(f"{'numpy process()':<28} {rate(lambda: sq.process(buf), args.blocks):>12.0f}")
+
+    httpd = mock_server.make_server(0, host="127.0.0.1")
+    host, port = httpd.server_address
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    try:
+        for batch in args.batch:
+            uploads = [sq.encode_blocks(samples[i:i + batch], moisture[i:i + batch],
+                                        timestamps[i:i + batch], args.sample_rate)
+                       for i in range(0, args.blocks - batch + 1, batch)]
+            conn = http.client.HTTPConnection(host, port)
+
+            def post_all():
+                for body in uploads:
+                    conn.request("POST", "/waveform", body, {"Content-Type": "application/octet-stream"})
+                    response = conn.getresponse()
+                    response.read()
+                    assert response.status == 200, response.status
+
+            print(f"{f'POST /waveform x{batch}':<28} {rate(post_all, len(uploads) * batch, repeat=1):>12.0f}")
+            conn.close()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""
+Versioned, immutable control-plane configuration.
+
+The server's runtime settings live in one frozen Config snapshot:
+simulation mode, forced readings, fault detector thresholds and tick
+rates, each with a default and per-site overrides. ConfigStore.update()
+builds a new snapshot from the current one and swaps the reference
+(copy-on-write). Writers serialize on a lock; readers only load
+store.current and never lock. A snapshot is never modified, so a request
+or producer tick that read it sees one consistent version.
+
+Updates are partial, JSON-shaped dicts:
+
+    {"default": {"mode": "AUTO", "tick_rate": 1, "thresholds": {"volt_min": 2.55}},
+     "sites": {"pit1": {"thresholds": {"soil_threshold": 30}, "tick_rate": 0.2},
+               "pit2": null}}
+
+Site entries override the default field by field (thresholds key by key).
+A null field drops that override, and a null site drops all of them. An
+optional "version" makes the update conditional on the current version
+(optimistic concurrency). Listeners are called with every new snapshot,
+in version order.
+"""
+import collections
+import json
+import math
+import threading
+import types
+
+from ingest_protocol import SITE_ID_RE
+from rule_engine import DEFAULT_THRESHOLDS, make_thresholds
+
+MODES = ("AUTO", "GOOD", "BAD")
+MAX_TICK_RATE = 1000.0
+MIN_TICK_RATE = 1 / 86400       # One reading a day
+FIELDS = ("mode", "tick_rate", "moisture", "voltage", "thresholds")
+
+# moisture / voltage force the simulated reading when not None
+SiteConfig = collections.namedtuple("SiteConfig", FIELDS)
+
+DEFAULT_SITE = SiteConfig("AUTO", 1.0, None, None, DEFAULT_THRESHOLDS)
+
+
+class ConfigError(ValueError):
+    pass
+
+
+class VersionConflict(ConfigError):
+    pass
+
+
+class Config:
+    __slots__ = ("version", "default", "sites", "overrides", "payload")
+
+    def __init__(self, version, default, sites, overrides):
+        self.version = version
+        self.default = default
+        self.sites = types.MappingProxyType(sites)            # site -> resolved SiteConfig
+        self.overrides = types.MappingProxyType(overrides)    # site -> fields set for it
+        # Serialized once per version for GET /config and stream clients
+        self.payload = json.dumps(self.to_dict(), separators=(',', ':')).encode('utf-8')
+
+    def site(self, site_id):
+        return self.sites.get(site_id, self.default)
+
+    def to_dict(self):
+        return {
+            "version": self.version,
+            "default": _site_dict(self.default),
+            "sites": {site: dict(fields) for site, fields in self.overrides.items()},
+        }
+
+
+def _site_dict(site):
+    values = site._asdict()
+    values["thresholds"] = site.thresholds._asdict()
+    return values
+
+
+def _number(key, value, low, high):
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise ConfigError(f"{key} must be a number")
+    if not low <= value <= high:
+        raise ConfigError(f"{key} must be between {low} and {high}")
+    return value
+
+
+def _validate(values, where):
+    # Normalized copy of one default/site entry; None values are kept
+    if not isinstance(values, dict):
+        raise ConfigError(f"{where} must be an object")
+    out = {}
+    for key, value in values.items():
+        if key not in FIELDS:
+            raise ConfigError(f"{where}: unknown setting {key!r}")
+        if value is None:
+            out[key] = None
+        elif key == "mode":
+            if not isinstance(value, str) or value.upper() not in MODES:
+                raise ConfigError(f"{where}: mode must be one of {', '.join(MODES)}")
+            out[key] = value.upper()
+        elif key == "tick_rate":
+            if not MIN_TICK_RATE <= _number(key, value, 0, MAX_TICK_RATE):
+                raise ConfigError(f"{where}: tick_rate must be at least 1/86400 (one reading a day)")
+            out[key] = value
+        elif key == "moisture":
+            out[key] = _number(key, value, 0, 100)
+        elif key == "voltage":
+            out[key] = _number(key, value, 0, 1000)
+        else:
+            if not isinstance(value, dict):
+                raise ConfigError(f"{where}: thresholds must be an object")
+            out[key] = dict(value)
+    return out
+
+
+def _resolve(fields, base):
+    # SiteConfig from override fields on top of base; validates thresholds
+    values = base._asdict()
+    for key, value in fields.items():
+        if key == "thresholds":
+            try:
+                values[key] = make_thresholds(value, base.thresholds)
+            except ValueError as e:
+                raise ConfigError(str(e)) from None
+        else:
+            values[key] = value
+    return SiteConfig(**values)
+
+
+class ConfigStore:
+    def __init__(self, default=DEFAULT_SITE):
+        self.current = Config(0, default, {}, {})
+        self.listeners = []         # callable(config) after every swap
+        self._lock = threading.Lock()
+
+    def update(self, changes):
+        # Validates everything before swapping; raises ConfigError (or
+        # VersionConflict for a stale "version") and changes nothing
+        if not isinstance(changes, dict):
+            raise ConfigError("config update must be an object")
+        unknown = set(changes) - {"default", "sites", "version"}
+        if unknown:
+            raise ConfigError(f"unknown section {sorted(unknown)[0]!r}")
+        expected = changes.get("version")
+        if expected is not None and (isinstance(expected, bool) or not isinstance(expected, int)):
+            raise ConfigError("version must be an integer")
+        with self._lock:
+            config = self.current
+            if expected is not None and expected != config.version:
+                raise VersionConflict(f"config is at version {config.version}, not {expected}")
+
+            default = config.default
+            if changes.get("default") is not None:
+                fields = _validate(changes["default"], "default")
+                for key in ("mode", "tick_rate", "thresholds"):
+                    if key in fields and fields[key] is None:
+                        raise ConfigError(f"default: {key} cannot be null")
+                default = _resolve(fields, default)
+
+            overrides = dict(config.overrides)
+            sites = changes.get("sites") or {}
+            if not isinstance(sites, dict):
+                raise ConfigError("sites must be an object")
+            for site, values in sites.items():
+                if not isinstance(site, str) or not SITE_ID_RE.match(site):
+                    raise ConfigError(f"invalid site id {site!r}")
+                if values is None:
+                    overrides.pop(site, None)
+                    continue
+                fields = {**overrides.get(site, {})}
+                for key, value in _validate(values, f"sites.{site}").items():
+                    if value is None:
+                        fields.pop(key, None)
+                    elif key == "thresholds":
+                        fields[key] = {**fields.get(key, {}), **value}
+                    else:
+                        fields[key] = value
+                if fields:
+                    overrides[site] = fields
+                else:
+                    overrides.pop(site, None)
+
+            # Re-resolve every site, since a default change affects all of them
+            resolved = {site: _resolve(fields, default) for site, fields in overrides.items()}
+            new = Config(config.version + 1, default, resolved, overrides)
+            self.current = new
+            for listener in self.listeners:
+                listener(new)
+        return new
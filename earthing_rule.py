@@ -0,0 +1,19 @@
+"""
+Earthing GOOD/BAD rule shared by every Python path.
+
+The default band matches the dashboard thresholds: moisture >= 25 % and
+2.55 V <= voltage <= 2.61 V. Pass a site's rule_engine.Thresholds (from
+config_store.current.site(site).thresholds) to use its configured band
+instead. Works on plain numbers and element-wise on NumPy arrays.
+"""
+SOIL_THRESHOLD = 25     # Minimum moisture percent
+VOLT_MIN = 2.55         # Volts
+VOLT_MAX = 2.61
+
+
+def is_earthing_good(moisture, voltage, thresholds=None):
+    if thresholds is None:
+        soil, low, high = SOIL_THRESHOLD, VOLT_MIN, VOLT_MAX
+    else:
+        soil, low, high = thresholds.soil_threshold, thresholds.volt_min, thresholds.volt_max
+    return (moisture >= soil) & (voltage >= low) & (voltage <= high)
@@ -0,0 +1,385 @@
+"""
+Multi-site gateway: polls many ESP32 earthing nodes and serves them as one.
+
+Each registered device is an ESP32 running src/ESP32_Earthing_WebServer.ino
+(or anything else that answers GET <base>/data with the same JSON). The
+gateway polls every device concurrently from a single asyncio loop, keeping
+one keep-alive connection per device, with a per-device timeout and
+exponential backoff for nodes that stop answering.
+
+DeviceSimulator serves thousands of virtual devices from one port
+(http://host:port/dev/<n>) so the fan-in can be benchmarked without
+hardware.
+"""
+import asyncio
+import json
+import random
+import re
+import resource
+import threading
+import time
+import traceback
+from urllib.parse import urlparse
+
+POLL_INTERVAL = 1.0       # Seconds between poll rounds
+POLL_TIMEOUT = 2.0        # Per-device request timeout
+MAX_IN_FLIGHT = 512       # Concurrent device requests
+BACKOFF_BASE = 1.0        # First retry delay after a failure (seconds)
+BACKOFF_MAX = 60.0
+
+SITE_ID_RE = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+
+def raise_fd_limit():
+    # Each device keeps a socket open; lift the soft limit to the hard one
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
+
+class Device:
+    def __init__(self, site_id, url):
+        if not SITE_ID_RE.match(site_id):
+            raise ValueError(f"invalid site id {site_id!r}")
+        parsed = urlparse(url if '://' in url else 'http://' + url)
+        if parsed.scheme != 'http' or not parsed.hostname:
+            raise ValueError(f"unsupported device url {url!r}")
+        self.site_id = site_id
+        self.url = url
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.request = (f"GET {parsed.path.rstrip('/')}/data HTTP/1.1\r\n"
+                        f"Host: {parsed.netloc}\r\n"
+                        f"Connection: keep-alive\r\n\r\n").encode('ascii')
+        self.reader = None
+        self.writer = None
+        # Poll state, only touched from the gateway loop
+        self.reading = None       # Parsed JSON of the last good response
+        self.payload = None       # Raw bytes of the last good response
+        self.last_seen = None
+        self.failures = 0
+        self.error = None
+        self.next_attempt = 0.0
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    def summary(self, stale_after):
+        online = self.last_seen is not None and self.failures == 0 \
+            and time.time() - self.last_seen <= stale_after
+        entry = {
+            "id": self.site_id,
+            "url": self.url,
+            "online": online,
+            "lastSeen": self.last_seen,
+            "failures": self.failures,
+            "error": self.error,
+        }
+        if self.reading is not None:
+            entry.update(self.reading)
+        return entry
+
+
+class HTTPError(Exception):
+    pass
+
+
+def _reject_constant(name):
+    # NaN and Infinity are not JSON; /sites would pass them on as they are
+    raise ValueError(f"non-finite number {name}")
+
+
+async def _read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionResetError("connection closed by device")
+    parts = status_line.split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith(b'HTTP/'):
+        raise HTTPError(f"bad status line {status_line[:40]!r}")
+    status = int(parts[1])
+    length = None
+    keep_alive = parts[0] == b'HTTP/1.1'
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        if name == b'content-length':
+            length = int(value)
+        elif name == b'connection':
+            keep_alive = value.strip().lower() == b'keep-alive'
+    if length is None:
+        body = await reader.read()
+        keep_alive = False
+    else:
+        body = await reader.readexactly(length)
+    return status, body, keep_alive
+
+
+async def fetch(device, timeout=POLL_TIMEOUT):
+    # Returns the /data body, reusing the device's keep-alive connection.
+    # A connection the device closed while idle is retried once.
+    async def attempt(reused):
+        if device.writer is None:
+            device.reader, device.writer = await asyncio.open_connection(device.host, device.port)
+        try:
+            device.writer.write(device.request)
+            await device.writer.drain()
+            status, body, keep_alive = await _read_response(device.reader)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            device.close()
+            if reused:
+                return await attempt(False)
+            raise
+        if not keep_alive:
+            device.close()
+        if status != 200:
+            raise HTTPError(f"HTTP {status}")
+        return body
+
+    try:
+        return await asyncio.wait_for(attempt(device.writer is not None), timeout)
+    except BaseException:
+        device.close()
+        raise
+
+
+class Gateway:
+    def __init__(self, interval=POLL_INTERVAL, timeout=POLL_TIMEOUT, max_in_flight=MAX_IN_FLIGHT,
+                 backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX):
+        self.interval = interval
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        # Copy-on-write: register() swaps in a new dict so the poll loop can
+        # iterate without a lock
+        self.devices = {}
+        # Copy-on-write too: site -> seconds between polls, for sites that
+        # should be polled less often than every round
+        self.site_intervals = {}
+        self.rounds = 0
+        self.polls = 0
+        self.poll_errors = 0
+        self.callback_errors = 0
+        self.last_round_duration = 0.0
+        self.sites_payload = self._render([])
+        # Optional callable(site_id, timestamp, reading) for every good poll
+        self.on_reading = None
+        self._lock = threading.Lock()
+        self._loop = None
+        self._thread = None
+        self._running = False
+        self._round_done = threading.Condition()
+
+    def __len__(self):
+        return len(self.devices)
+
+    def register(self, site_id, url):
+        device = Device(site_id, url)
+        with self._lock:
+            if site_id in self.devices:
+                raise ValueError(f"site {site_id!r} already registered")
+            self.devices = {**self.devices, site_id: device}
+        return device
+
+    def unregister(self, site_id):
+        with self._lock:
+            devices = dict(self.devices)
+            device = devices.pop(site_id)
+            self.devices = devices
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(device.close)
+
+    def site_payload(self, site_id):
+        device = self.devices.get(site_id)
+        if device is None:
+            raise KeyError(site_id)
+        return device.payload
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=asyncio.run, args=(self._run(),),
+                                            name="earthing-gateway", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join(self.interval + self.timeout + 5)
+
+    def wait_round(self, timeout=None):
+        # Blocks until the next poll round completes (used by benchmarks)
+        with self._round_done:
+            current = self.rounds
+            return self._round_done.wait_for(lambda: self.rounds > current, timeout)
+
+    async def _run(self):
+        self._loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        try:
+            while self._running:
+                started = time.monotonic()
+                await self.poll_round(semaphore)
+                elapsed = time.monotonic() - started
+                await asyncio.sleep(max(0.0, self.interval - elapsed))
+        finally:
+            for device in self.devices.values():
+                device.close()
+
+    async def poll_round(self, semaphore=None):
+        semaphore = semaphore or asyncio.Semaphore(self.max_in_flight)
+        started = time.monotonic()
+        devices = list(self.devices.values())
+        due = [d for d in devices if d.next_attempt <= started]
+        await asyncio.gather(*(self._poll(d, semaphore) for d in due))
+        self.sites_payload = self._render(devices)
+        self.last_round_duration = time.monotonic() - started
+        with self._round_done:
+            self.rounds += 1
+            self._round_done.notify_all()
+
+    async def _poll(self, device, semaphore):
+        async with semaphore:
+            self.polls += 1
+            started = time.monotonic()
+            try:
+                body = await fetch(device, self.timeout)
+                reading = json.loads(body, parse_constant=_reject_constant)
+                if not isinstance(reading, dict):
+                    raise ValueError("expected a JSON object")
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                    HTTPError, ValueError) as e:
+                self.poll_errors += 1
+                device.failures += 1
+                device.error = str(e) or type(e).__name__
+                # Exponential backoff with jitter so dead nodes do not get
+                # hammered and recovering ones are not hit in lockstep
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (device.failures - 1))
+                device.next_attempt = time.monotonic() + delay * random.uniform(0.5, 1.0)
+                return
+            device.reading = reading
+            device.payload = body
+            device.last_seen = time.time()
+            device.failures = 0
+            device.error = None
+            # Half a round of slack so a site due every k rounds is not
+            # pushed to k + 1 by scheduling jitter
+            interval = self.site_intervals.get(device.site_id)
+            device.next_attempt = started + interval - self.interval / 2 if interval else 0.0
+            if self.on_reading is not None:
+                try:
+                    self.on_reading(device.site_id, device.last_seen, reading)
+                except Exception:
+                    # One site's bad reading must not end the round (and
+                    # with it the poll loop) for every other site
+                    self.callback_errors += 1
+                    traceback.print_exc()
+
+    def _render(self, devices):
+        stale_after = 3 * self.interval + self.timeout
+        sites = [d.summary(stale_after) for d in devices]
+        summary = {
+            "total": len(sites),
+            "online": sum(1 for s in sites if s["online"]),
+            "faults": sum(1 for s in sites if s.get("earthingGood") is False),
+        }
+        return json.dumps({"round": self.rounds, "summary": summary, "sites": sites},
+                          separators=(',', ':')).encode('utf-8')
+
+
+class DeviceSimulator:
+    # Serves GET /dev/<n>/data for count virtual ESP32 nodes on one port.
+    # Readings random-walk per device and use the firmware's earthing rule.
+    # failure_rate answers that fraction of requests with 503; offline_rate
+    # makes that fraction of devices never answer (exercises timeouts).
+
+    def __init__(self, count, latency=0.0, failure_rate=0.0, offline_rate=0.0, seed=None):
+        self.count = count
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._moisture = [self._random.uniform(30, 60) for _ in range(count)]
+        self._voltage = [self._random.uniform(2.55, 2.65) for _ in range(count)]
+        self._offline = set(self._random.sample(range(count), int(count * offline_rate)))
+        self._server = None
+        self._loop = None
+        self._thread = None
+        self.port = None
+
+    def urls(self, host='127.0.0.1'):
+        return [(f"sim-{n}", f"http://{host}:{self.port}/dev/{n}") for n in range(self.count)]
+
+    def _reading(self, n):
+        rnd = self._random
+        m = min(100.0, max(0.0, self._moisture[n] + rnd.uniform(-0.5, 0.5)))
+        v = min(3.3, max(0.0, self._voltage[n] + rnd.uniform(-0.005, 0.005)))
+        self._moisture[n], self._voltage[n] = m, v
+        moisture = int(m)
+        good = moisture >= 25 and 2.50 <= v <= 2.75
+        return (f'{{"moisture":{moisture},"voltage":{v:.2f},'
+                f'"earthingGood":{"true" if good else "false"}}}').encode('ascii')
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                self.requests += 1
+                parts = request_line.split()
+                path = parts[1].decode('ascii', 'replace') if len(parts) > 1 else ''
+                match = re.match(r'^/dev/(\d+)/data$', path)
+                n = int(match.group(1)) if match else -1
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                if n in self._offline:
+                    await asyncio.sleep(3600)
+                if not 0 <= n < self.count:
+                    status, body = b'404 Not Found', b''
+                elif self._random.random() < self.failure_rate:
+                    status, body = b'503 Service Unavailable', b''
+                else:
+                    status, body = b'200 OK', self._reading(n)
+                writer.write(b'HTTP/1.1 ' + status + b'\r\nContent-Type: application/json\r\n'
+                             b'Content-Length: ' + str(len(body)).encode('ascii') + b'\r\n\r\n' + body)
+                await writer.drain()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    def start(self, host='127.0.0.1', port=0):
+        ready = threading.Event()
+
+        async def serve():
+            self._loop = asyncio.get_running_loop()
+            self._server = await asyncio.start_server(self._handle, host, port, backlog=4096)
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            async with self._server:
+                try:
+                    await self._server.serve_forever()
+                except asyncio.CancelledError:
+                    pass  # stop() closed the server
+
+        self._thread = threading.Thread(target=asyncio.run, args=(serve(),),
+                                        name="earthing-simulator", daemon=True)
+        self._thread.start()
+        ready.wait(10)
+        return self
+
+    def stop(self):
+        if self._loop is not None and self._server is not None:
+            self._loop.call_soon_threadsafe(self._server.close)
+            self._thread.join(5)
@@ -0,0 +1,204 @@
+"""
+Fixed-memory time-series ring buffer for earthing readings.
+
+Columns are flat arrays (timestamp, moisture, voltage, status), so the
+buffer costs 17 bytes per reading regardless of how long the server runs.
+Timestamps are appended in order, which lets range queries binary-search
+instead of scanning.
+"""
+import math
+import threading
+import time
+from array import array
+
+DEFAULT_CAPACITY = 86400      # 24 h at the default 1 Hz tick rate
+MAX_POINTS = 2000             # Upper bound on rows returned by one query
+MIN_STEP = 0.001              # Smallest aggregation bucket, seconds
+
+
+class ReadingHistory:
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.timestamps = array('d', bytes(8 * capacity))
+        self.moisture = array('f', bytes(4 * capacity))
+        self.voltage = array('f', bytes(4 * capacity))
+        self.status = array('b', bytes(capacity))
+        self.count = 0
+        self._head = 0            # Physical index of the next write
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self.count
+
+    def append(self, timestamp, moisture, voltage, earthing_good):
+        with self._lock:
+            i = self._head
+            self.timestamps[i] = timestamp
+            self.moisture[i] = moisture
+            self.voltage[i] = voltage
+            self.status[i] = 1 if earthing_good else 0
+            self._head = (i + 1) % self.capacity
+            if self.count < self.capacity:
+                self.count += 1
+
+    def _physical(self, logical):
+        # Logical 0 is the oldest retained reading
+        return (self._head - self.count + logical) % self.capacity
+
+    def _bisect(self, t):
+        # First logical index whose timestamp is >= t
+        lo, hi = 0, self.count
+        ts = self.timestamps
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if ts[self._physical(mid)] < t:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, start=None, end=None, step=None, max_points=MAX_POINTS):
+        """Return readings with start <= timestamp <= end as columns.
+
+        step=0 returns raw readings. A positive step (seconds) aggregates
+        into buckets aligned to multiples of step with min/max/avg per
+        column. With no step, raw rows are returned if they fit in
+        max_points, otherwise the smallest step that fits is chosen.
+        """
+        with self._lock:
+            if self.count == 0:
+                return self._empty(start, end, step or 0)
+            first_t = self.timestamps[self._physical(0)]
+            last_t = self.timestamps[self._physical(self.count - 1)]
+            start = first_t if start is None else start
+            end = last_t if end is None else end
+            lo = self._bisect(start)
+            hi = self._bisect(math.nextafter(end, math.inf))
+            n = hi - lo
+            # Bucket alignment can add one partial bucket, hence max_points - 1
+            if step is None:
+                step = 0 if n <= max_points else (end - start) / max(1, max_points - 1)
+            elif step == 0 and n > max_points:
+                step = (end - start) / max(1, max_points - 1)
+            if step > 0:
+                return self._aggregate(lo, hi, start, end, step)
+            return self._raw(lo, hi, start, end)
+
+    def oldest(self):
+        with self._lock:
+            return self.timestamps[self._physical(0)] if self.count else None
+
+    def _rows(self, lo, hi):
+        ts, m, v, s = self.timestamps, self.moisture, self.voltage, self.status
+        for logical in range(lo, hi):
+            i = self._physical(logical)
+            yield ts[i], m[i], v[i], s[i]
+
+    def _raw(self, lo, hi, start, end):
+        return raw_columns(self._rows(lo, hi), start, end)
+
+    def _aggregate(self, lo, hi, start, end, step):
+        return aggregate_columns(self._rows(lo, hi), start, end, step)
+
+    def _empty(self, start, end, step):
+        if step:
+            return aggregate_columns((), start, end, step)
+        return raw_columns((), start, end)
+
+
+def raw_columns(rows, start, end):
+    # rows: iterable of (timestamp, moisture, voltage, status)
+    t, moisture, voltage, good = [], [], [], []
+    for ti, mi, vi, si in rows:
+        t.append(ti)
+        moisture.append(round(mi, 2))
+        voltage.append(round(vi, 4))
+        good.append(bool(si))
+    return {
+        "from": start,
+        "to": end,
+        "step": 0,
+        "t": t,
+        "moisture": moisture,
+        "voltage": voltage,
+        "earthingGood": good,
+    }
+
+
+def aggregate_columns(rows, start, end, step):
+    # rows: iterable of (timestamp, moisture, voltage, status) in time order,
+    # bucketed into multiples of step with min/max/avg per column
+    out_t, count = [], []
+    m_min, m_max, m_sum = [], [], []
+    v_min, v_max, v_sum = [], [], []
+    good = []
+    bucket = None
+    for ti, mi, vi, si in rows:
+        b = math.floor(ti / step)
+        if b != bucket:
+            bucket = b
+            out_t.append(b * step)
+            count.append(0)
+            m_min.append(mi)
+            m_max.append(mi)
+            m_sum.append(0.0)
+            v_min.append(vi)
+            v_max.append(vi)
+            v_sum.append(0.0)
+            good.append(0)
+        count[-1] += 1
+        m_sum[-1] += mi
+        v_sum[-1] += vi
+        good[-1] += si
+        if mi < m_min[-1]:
+            m_min[-1] = mi
+        elif mi > m_max[-1]:
+            m_max[-1] = mi
+        if vi < v_min[-1]:
+            v_min[-1] = vi
+        elif vi > v_max[-1]:
+            v_max[-1] = vi
+    return bucket_columns(start, end, step, out_t, count, m_min, m_max, m_sum, v_min, v_max, v_sum, good)
+
+
+def bucket_columns(start, end, step, out_t, count, m_min, m_max, m_sum, v_min, v_max, v_sum, good):
+    # Response shape for per-bucket totals (lists, one entry per bucket)
+    return {
+        "from": start,
+        "to": end,
+        "step": step,
+        "t": out_t,
+        "count": count,
+        "moisture": {
+            "min": [round(x, 2) for x in m_min],
+            "max": [round(x, 2) for x in m_max],
+            "avg": [round(x / c, 2) for x, c in zip(m_sum, count)],
+        },
+        "voltage": {
+            "min": [round(x, 4) for x in v_min],
+            "max": [round(x, 4) for x in v_max],
+            "avg": [round(x / c, 4) for x, c in zip(v_sum, count)],
+        },
+        # Fraction of readings in the bucket with earthing GOOD
+        "good": [round(g / c, 3) for g, c in zip(good, count)],
+    }
+
+
+def parse_time(value, now=None):
+    # Absolute unix seconds, or a negative offset relative to now
+    t = float(value)
+    if not math.isfinite(t):
+        raise ValueError(f"invalid time {value!r}")
+    if t < 0:
+        t += time.time() if now is None else now
+    return t
+
+
+def parse_step(value):
+    # Bucket width in seconds; 0 asks for raw readings
+    step = float(value)
+    if not (step == 0 or (math.isfinite(step) and step >= MIN_STEP)):
+        raise ValueError(f"step must be 0 (raw) or finite seconds >= {MIN_STEP}")
+    return step
@@ -0,0 +1,157 @@
+"""
+Compact batched upload format for POST /ingest.
+
+A body is one or more length-prefixed frames, so a device can concatenate
+everything it buffered while WiFi was down (for one or several sites):
+
+    frame    length u32 | header | site | records
+    header  magic b'EBAT' | version u8 | site_len u8 | reserved u16 | count u32
+    site     site_len bytes of ASCII site id
+    record   timestamp f64 | voltage_mv u16 | moisture u8 | flags u8
+
+flags bit 0 is the device's own earthingGood decision. Everything is
+little-endian. Records are parsed straight out of the request buffer with
+memoryview slices and struct.iter_unpack, then validated column-wise with
+min()/max() instead of per-record checks.
+
+The JSON equivalent ({"site": ..., "readings": [{"t", "moisture",
+"voltage", "earthingGood"}, ...]}) is accepted too, as the baseline the
+binary format is benchmarked against.
+"""
+import json
+import math
+import re
+import struct
+import time
+
+LENGTH = struct.Struct('<I')
+HEADER = struct.Struct('<4sBBHI')
+RECORD = struct.Struct('<dHBB')
+MAGIC = b'EBAT'
+VERSION = 1
+FLAG_GOOD = 0x01
+
+MAX_RECORDS = 1_000_000         # Per frame
+MIN_TIMESTAMP = 1_577_836_800   # 2020-01-01; anything older is a clock fault
+MAX_CLOCK_SKEW = 300            # Seconds a device clock may run ahead
+
+SITE_ID_RE = re.compile(r'^[A-Za-z0-9_.-]{1,64}$')
+
+
+class FormatError(ValueError):
+    pass
+
+
+class Batch:
+    # Columns of one site's readings, ready for ReadingLog.append_many
+    __slots__ = ("site", "timestamps", "moisture", "voltage", "status")
+
+    def __init__(self, site, timestamps, moisture, voltage, status):
+        self.site = site
+        self.timestamps = timestamps
+        self.moisture = moisture
+        self.voltage = voltage
+        self.status = status
+
+    def __len__(self):
+        return len(self.timestamps)
+
+
+def encode_frame(site, readings):
+    # readings: iterable of (timestamp, moisture, voltage, earthing_good)
+    site_bytes = site.encode('ascii')
+    records = [RECORD.pack(t, round(v * 1000), int(m), FLAG_GOOD if good else 0)
+               for t, m, v, good in readings]
+    frame = HEADER.pack(MAGIC, VERSION, len(site_bytes), 0, len(records)) + site_bytes + b''.join(records)
+    return LENGTH.pack(len(frame)) + frame
+
+
+def decode(body, now=None):
+    # Returns a list of Batch, one per frame. Raises FormatError on any
+    # malformed or out-of-range frame; nothing is partially accepted.
+    view = memoryview(body)
+    now = time.time() if now is None else now
+    batches = []
+    offset = 0
+    while offset < len(view):
+        if len(view) - offset < LENGTH.size:
+            raise FormatError("truncated frame length")
+        (length,) = LENGTH.unpack_from(view, offset)
+        offset += LENGTH.size
+        if length > len(view) - offset:
+            raise FormatError("frame length exceeds body")
+        batches.append(_decode_frame(view[offset:offset + length], now))
+        offset += length
+    if not batches:
+        raise FormatError("empty body")
+    return batches
+
+
+def _decode_frame(frame, now):
+    if len(frame) < HEADER.size:
+        raise FormatError("truncated frame header")
+    magic, version, site_len, _, count = HEADER.unpack_from(frame)
+    if magic != MAGIC:
+        raise FormatError("bad magic")
+    if version != VERSION:
+        raise FormatError(f"unsupported version {version}")
+    if count > MAX_RECORDS:
+        raise FormatError(f"too many records ({count})")
+    start = HEADER.size + site_len
+    if len(frame) != start + count * RECORD.size:
+        raise FormatError(f"frame holds {len(frame) - start} record bytes, header says {count} records")
+    site = bytes(frame[HEADER.size:start]).decode('ascii', 'replace')
+    if not SITE_ID_RE.match(site):
+        raise FormatError(f"invalid site id {site!r}")
+    if count == 0:
+        return Batch(site, (), (), (), ())
+    timestamps, voltage_mv, moisture, flags = zip(*RECORD.iter_unpack(frame[start:]))
+    validate(site, timestamps, moisture, now)
+    return Batch(site, timestamps, moisture,
+                 [mv / 1000 for mv in voltage_mv], [f & FLAG_GOOD for f in flags])
+
+
+def validate(site, timestamps, moisture, now):
+    # Range checks shared by every upload path (/ingest, /waveform).
+    # min()/max() are order-dependent with NaN, so check every value first.
+    if not all(map(math.isfinite, timestamps)):
+        raise FormatError(f"{site}: non-finite timestamp")
+    t_min, t_max = min(timestamps), max(timestamps)
+    if t_min < MIN_TIMESTAMP or t_max > now + MAX_CLOCK_SKEW:
+        raise FormatError(f"{site}: timestamp out of range ({t_min:.0f}..{t_max:.0f})")
+    if not all(map(math.isfinite, moisture)):
+        raise FormatError(f"{site}: non-finite moisture")
+    if min(moisture) < 0 or max(moisture) > 100:
+        raise FormatError(f"{site}: moisture outside 0..100%")
+
+
+def decode_json(body, now=None):
+    # Same validation for {"site": ..., "readings": [...]} (or a list of those)
+    now = time.time() if now is None else now
+    try:
+        doc = json.loads(body)
+        frames = doc if isinstance(doc, list) else [doc]
+        batches = []
+        for frame in frames:
+            site = frame["site"]
+            if not isinstance(site, str) or not SITE_ID_RE.match(site):
+                raise FormatError(f"invalid site id {site!r}")
+            readings = frame["readings"]
+            timestamps = [float(r["t"]) for r in readings]
+            moisture = [int(r["moisture"]) for r in readings]
+            voltage = [float(r["voltage"]) for r in readings]
+            status = [1 if r["earthingGood"] else 0 for r in readings]
+            if readings:
+                if not all(map(math.isfinite, voltage)):
+                    raise FormatError(f"{site}: non-finite voltage")
+                if min(voltage) < 0:
+                    raise FormatError(f"{site}: negative voltage")
+                validate(site, timestamps, moisture, now)
+            batches.append(Batch(site, timestamps, moisture, voltage, status))
+    except (KeyError, TypeError, ValueError, AttributeError, OverflowError) as e:
+        if isinstance(e, FormatError):
+            raise
+        raise FormatError(f"bad JSON batch: {e}") from None
+    if not batches:
+        raise FormatError("empty body")
+    return batches
@@ -0,0 +1,189 @@
+"""
+Request instrumentation in the Prometheus text exposition format.
+
+Every route gets a latency histogram with fixed bucket bounds, allocated
+up front. Recording a request costs one lock, one bisect and a few
+integer adds. Server state that is cheap to read
+(tick lag, buffer occupancy, subscribers) is not pushed on every change.
+The server collects it when /metrics is rendered.
+
+SamplingProfiler is an optional hook that runs every Nth request under
+cProfile and accumulates the stats, so the hot path can be inspected on a
+live server without profiling every request.
+"""
+import bisect
+import cProfile
+import io
+import itertools
+import pstats
+import threading
+
+# Seconds; /data is served from a cached payload, so most of the mass is
+# expected below 1 ms
+LATENCY_BUCKETS = (0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5)
+OTHER_ROUTE = "other"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    # Not thread-safe on its own; RequestMetrics holds its lock around observe()
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)   # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # bisect_left puts value == bound into that bucket, matching le=
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, labels=()):
+        out = []
+        cumulative = 0
+        for bound, n in zip(self.bounds, self.counts):
+            cumulative += n
+            out.append(("_bucket", labels + (("le", repr(bound)),), cumulative))
+        out.append(("_bucket", labels + (("le", "+Inf"),), self.count))
+        out.append(("_sum", labels, self.sum))
+        out.append(("_count", labels, self.count))
+        return out
+
+
+class RequestMetrics:
+    # Per-route counters for a fixed set of route labels. Unknown paths are
+    # folded into OTHER_ROUTE so label cardinality stays bounded.
+
+    def __init__(self, routes, buckets=LATENCY_BUCKETS):
+        self.routes = tuple(routes) + (OTHER_ROUTE,)
+        self.latency = {route: Histogram(buckets) for route in self.routes}
+        self.in_flight = dict.fromkeys(self.routes, 0)
+        self.bytes_in = dict.fromkeys(self.routes, 0)
+        self.bytes_out = dict.fromkeys(self.routes, 0)
+        self.responses = {route: {} for route in self.routes}   # route -> {status: count}
+        self._lock = threading.Lock()
+
+    def start(self, route):
+        with self._lock:
+            self.in_flight[route] += 1
+
+    def finish(self, route, status, seconds, bytes_in, bytes_out):
+        # status is None when the connection failed before a response went out
+        with self._lock:
+            self.in_flight[route] -= 1
+            self.latency[route].observe(seconds)
+            self.bytes_in[route] += bytes_in
+            self.bytes_out[route] += bytes_out
+            codes = self.responses[route]
+            codes[status] = codes.get(status, 0) + 1
+
+    def families(self):
+        with self._lock:
+            latency = [(route, h.samples((("route", route),))) for route, h in self.latency.items()]
+            in_flight = dict(self.in_flight)
+            bytes_in = dict(self.bytes_in)
+            bytes_out = dict(self.bytes_out)
+            responses = {route: dict(codes) for route, codes in self.responses.items()}
+        return [
+            ("earthing_http_request_duration_seconds", "histogram",
+             "Time from request line to response written",
+             [sample for _, samples in latency for sample in samples]),
+            ("earthing_http_requests_total", "counter", "Completed requests by status code",
+             [("", (("route", route), ("code", "none" if code is None else str(code))), n)
+              for route, codes in responses.items() for code, n in sorted(codes.items(), key=str)]),
+            ("earthing_http_requests_in_flight", "gauge", "Requests currently being handled",
+             [("", (("route", route),), n) for route, n in in_flight.items()]),
+            ("earthing_http_request_body_bytes_total", "counter", "Request body bytes read",
+             [("", (("route", route),), n) for route, n in bytes_in.items()]),
+            ("earthing_http_response_body_bytes_total", "counter", "Response body bytes written",
+             [("", (("route", route),), n) for route, n in bytes_out.items()]),
+        ]
+
+
+class SamplingProfiler:
+    # Profiles every `every`-th request. start() returns None for requests
+    # that are not sampled; pass whatever it returned to stop().
+
+    def __init__(self, every=100):
+        if every < 1:
+            raise ValueError("every must be >= 1")
+        self.every = every
+        self.samples = 0
+        self.skipped = 0
+        self._counter = itertools.count()
+        self._stats = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        if next(self._counter) % self.every:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is active (Python 3.12+ allows only one)
+            self.skipped += 1
+            return None
+        return profile
+
+    def stop(self, profile):
+        if profile is None:
+            return
+        profile.disable()
+        with self._lock:
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+            self.samples += 1
+
+    def report(self, sort="cumulative", limit=40):
+        out = io.StringIO()
+        with self._lock:
+            if self._stats is None:
+                return f"No samples yet (profiling 1 in {self.every} requests)\n"
+            out.write(f"{self.samples} sampled requests (1 in {self.every})\n")
+            self._stats.stream = out
+            self._stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+def gauge(name, help_text, value):
+    return (name, "gauge", help_text, [("", (), value)])
+
+
+def counter(name, help_text, value):
+    return (name, "counter", help_text, [("", (), value)])
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    if isinstance(value, int):
+        return str(int(value))      # Also turns bools into 0/1
+    if value != value:
+        return "NaN"
+    if value in (float("inf"), float("-inf")):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def render(families):
+    # families: iterable of (name, type, help, [(suffix, labels, value), ...])
+    lines = []
+    for name, kind, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for suffix, labels, value in samples:
+            if labels:
+                label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                lines.append(f"{name}{suffix}{{{label_text}}} {_number(value)}")
+            else:
+                lines.append(f"{name}{suffix} {_number(value)}")
+    return ("\n".join(lines) + "\n").encode("utf-8")
@@ -1,458 +1,1216 @@
+import argparse
+import http.client
 import http.server
+import itertools
+import math
+import os
+import signal
+import socket
 import socketserver
 import json
 import random
+import sys
+import threading
 import time
-import webbrowser
+import traceback
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlparse, parse_qs
 
+import ingest_protocol
+import metrics
+from assets import IMMUTABLE, REVALIDATE, STATIC_PREFIX, AssetStore, accepts_gzip
+from gateway import DeviceSimulator, Gateway, raise_fd_limit
+from history import ReadingHistory, parse_step, parse_time
+from reading_log import ReadingLog
+from config import ConfigError, ConfigStore, VersionConflict
+from rule_engine import BAD, RuleEngine, check
+from shared_table import SharedTable
+from streaming import StreamHub, encode_event
+from uplink import Uplink
+
 PORT = 8000
+DEFAULT_WORKERS = 128     # Each keep-alive dashboard pins one worker
+KEEPALIVE_TIMEOUT = 15    # Seconds an idle keep-alive connection is kept
+TICK_RATE = 1.0           # Readings generated per second for /data and /stream
+LOCAL_SITE = "local"      # Site name of the simulated reading in the reading log
+MAX_BODY = 16 * 1024 * 1024   # Largest accepted POST body
+PRODUCER_RETRY = 1.0      # Seconds the producer waits after a tick raised
+SHARED_POLL = 0.02        # Seconds between pre-fork workers' checks for new readings
+RELAY_CHUNK = 512 * 1024  # Bytes a pre-fork worker reads at a time from a streamed response
+EXPORT_GZIP_LEVEL = 1     # Streamed exports are CPU-bound above this; CSV still shrinks ~10x
+DASHBOARD_PAGE = "mock_dashboard.html"   # Served at /, from web_interface/
+
+
+def generate_reading(site):
+    # site: config.SiteConfig; logic based on its mode
+    if site.mode == "GOOD":
+        voltage = 2.58 + (random.random() * 0.02 - 0.01)
+        moisture = 45 + random.randint(-2, 2)
+    elif site.mode == "BAD":
+        # Create a fault (e.g., low voltage or dry soil)
+        voltage = 1.5 + (random.random() * 0.2) # Low voltage fault
+        moisture = 10 + random.randint(0, 5)    # Dry soil fault
+    else: # AUTO
+        # Vary voltage slightly around 2.58
+        voltage = 2.58 + (random.random() * 0.04 - 0.02)
+        moisture = 40 + random.randint(-5, 5)
+
+    if site.moisture is not None:
+        moisture = site.moisture
+    if site.voltage is not None:
+        voltage = site.voltage
+    return {
+        "moisture": moisture,
+        "voltage": voltage,
+    }
+
+
+class Snapshot:
+    # Immutable view of the latest reading. The producer builds a new one per
+    # tick and swaps the reference, so readers never take a lock.
+    __slots__ = ("seq", "timestamp", "reading", "payload")
+
+    def __init__(self, seq, timestamp, reading, payload):
+        self.seq = seq
+        self.timestamp = timestamp
+        self.reading = reading
+        self.payload = payload
+
+
+class ReadingProducer:
+    # Generates one reading per tick for every client. /data serves the
+    # pre-serialized payload and /stream subscribers get it pushed; identical
+    # consecutive readings are coalesced into the hub's idle heartbeat.
+
+    def __init__(self, hub, history, config_store, site=LOCAL_SITE):
+        self.hub = hub
+        self.history = history
+        self.config = config_store
+        self.site = site
+        self.log = None
+        self.interval = 1.0 / config_store.current.site(site).tick_rate
+        self.ticks = 0
+        self.lag = 0.0            # How late the last tick started, seconds
+        self.tick_duration = 0.0
+        self.resyncs = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wake = threading.Event()
+        self._last_payload = None
+        self.snapshot = None
+        self.listeners = []       # callable(snapshot) after every tick
+        self.tick()
+
+    def reschedule(self):
+        # Config changed: re-read the tick rate now instead of after the
+        # current (possibly long) sleep
+        self._wake.set()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="earthing-producer", daemon=True)
+                self._thread.start()
+
+    def tick(self):
+        # One config snapshot per tick, so mode and thresholds always match
+        site = self.config.current.site(self.site)
+        reading = generate_reading(site)
+        now = time.time()
+        # Per-sample checks stay in the payload for older dashboards; state
+        # is the debounced alarm from the rule engine
+        soil_good, volt_good = check(site.thresholds, reading["moisture"], reading["voltage"])
+        rule_engine.feed(self.site, now, reading["moisture"], reading["voltage"])
+        reading["earthingGood"] = soil_good and volt_good
+        reading["soilGood"] = soil_good
+        reading["voltGood"] = volt_good
+        reading["state"] = rule_engine.state(self.site)
+        payload = json.dumps(reading).encode('utf-8')
+        self.ticks += 1
+        self.snapshot = Snapshot(self.ticks, now, reading, payload)
+        self.history.append(now, reading["moisture"], reading["voltage"], reading["earthingGood"])
+        for listener in self.listeners:
+            listener(self.snapshot)
+        if self.log is not None:
+            self.log.append(now, self.site, reading["moisture"], reading["voltage"], reading["earthingGood"])
+        if payload != self._last_payload:
+            self._last_payload = payload
+            if len(self.hub):
+                self.hub.publish(encode_event(payload, self.ticks))
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while True:
+            started = time.monotonic()
+            self.lag = started - next_tick
+            try:
+                self.tick()
+                self.tick_duration = time.monotonic() - started
+                # A config change interrupts the sleep so a new rate applies now
+                while True:
+                    self.interval = 1.0 / self.config.current.site(self.site).tick_rate
+                    delay = next_tick + self.interval - time.monotonic()
+                    if delay <= 0 or not self._wake.wait(delay):
+                        break
+                    self._wake.clear()
+            except Exception:
+                # This is the only producer thread: report and carry on
+                # with the next tick rather than freeze /data and /stream
+                self.errors += 1
+                traceback.print_exc()
+                self._wake.wait(PRODUCER_RETRY)
+                self._wake.clear()
+                next_tick = time.monotonic()
+                continue
+            if delay > 0:
+                next_tick += self.interval
+            else:
+                # Fell behind (e.g. suspended); resync instead of bursting
+                self.resyncs += 1
+                next_tick = time.monotonic()
+
+
+stream_hub = StreamHub()
+rule_engine = RuleEngine()
+reading_history = ReadingHistory()
+config_store = ConfigStore()
+producer = ReadingProducer(stream_hub, reading_history, config_store)
+gateway = Gateway()
+reading_log = None        # Set by open_reading_log() when --data-dir is given
+shared_table = None       # SharedTable written for pre-fork workers (--processes)
+uplink = None             # Uplink to ThingSpeak when --uplink is given
+
+
+def apply_config(config):
+    # Runs once per new config version. Request handlers read
+    # config_store.current directly; these components cache derived state.
+    rule_engine.configure(config.default.thresholds,
+                          {site: c.thresholds for site, c in config.sites.items()})
+    gateway.site_intervals = {site: 1.0 / c.tick_rate for site, c in config.sites.items()
+                              if "tick_rate" in config.overrides[site]}
+    producer.reschedule()
+    stream_hub.publish(encode_event(config.payload, config.version, "config"), key="config")
+    if shared_table is not None:
+        shared_table.write_blob(config.payload)
+
+
+config_store.listeners.append(apply_config)
+
+
+def on_site_reading(site_id, timestamp, reading):
+    # Every good gateway poll: feed the site's detector and log it
+    if shared_table is not None:
+        shared_table.write(site_id, gateway.site_payload(site_id))
+    try:
+        moisture = float(reading["moisture"])
+        voltage = float(reading["voltage"])
+        earthing_good = bool(reading["earthingGood"])
+    except (KeyError, TypeError, ValueError, OverflowError):
+        return  # Device answered without the fields we use
+    if not (math.isfinite(moisture) and math.isfinite(voltage)):
+        return  # NaN/Infinity would reach the log and uplink, and /history JSON
+    rule_engine.feed(site_id, timestamp, moisture, voltage)
+    if reading_log is not None:
+        reading_log.append(timestamp, site_id, moisture, voltage, earthing_good)
+    if uplink is not None:
+        uplink.add(site_id, timestamp, moisture, voltage, earthing_good)
+
+
+gateway.on_reading = on_site_reading
+
+ROUTES = ("/", "/static/<name>", "/set_mode", "/config", "/data", "/stream", "/sites", "/sites/<id>/data",
+          "/alarms", "/history", "/export", "/waveform", "/ingest", "/uplink", "/metrics", "/metrics/profile")
+_ROUTE_SET = frozenset(ROUTES)
+request_metrics = metrics.RequestMetrics(ROUTES)   # None disables (--no-metrics)
+request_profiler = None   # metrics.SamplingProfiler when --profile-every is given
+
+
+def route_label(path):
+    path = path.partition('?')[0]
+    if path in _ROUTE_SET:
+        return path
+    if path.startswith('/sites/') and path.endswith('/data'):
+        return "/sites/<id>/data"
+    if path.startswith(STATIC_PREFIX):
+        return "/static/<name>"
+    return metrics.OTHER_ROUTE
+
+
+def server_families():
+    # Gauges read at scrape time rather than updated on every change
+    families = [
+        metrics.gauge("earthing_producer_tick_lag_seconds",
+                      "How late the last producer tick started", producer.lag),
+        metrics.gauge("earthing_producer_tick_duration_seconds",
+                      "Time spent in the last producer tick", producer.tick_duration),
+        metrics.gauge("earthing_producer_interval_seconds", "Target producer tick interval", producer.interval),
+        metrics.gauge("earthing_config_version", "Current config snapshot version", config_store.current.version),
+        metrics.counter("earthing_producer_ticks_total", "Readings produced", producer.ticks),
+        metrics.counter("earthing_producer_resyncs_total",
+                        "Times the producer fell a full interval behind", producer.resyncs),
+        metrics.counter("earthing_producer_errors_total", "Ticks that raised an exception", producer.errors),
+        metrics.gauge("earthing_history_readings", "Readings held in the ring buffer", len(reading_history)),
+        metrics.gauge("earthing_history_capacity", "Ring buffer capacity", reading_history.capacity),
+        metrics.gauge("earthing_stream_subscribers", "Connected /stream clients", len(stream_hub)),
+        metrics.gauge("earthing_stream_subscribers_max", "Stream subscriber limit", stream_hub.max_subscribers),
+        metrics.counter("earthing_stream_events_total", "Events published to /stream",
+                        stream_hub.events_published),
+        metrics.counter("earthing_stream_disconnects_total", "Stream clients dropped or closed",
+                        stream_hub.disconnects),
+        metrics.gauge("earthing_alarm_sites", "Sites tracked by the fault detector", len(rule_engine.detectors)),
+        metrics.gauge("earthing_alarm_sites_bad", "Sites currently in BAD state",
+                      sum(1 for d in list(rule_engine.detectors.values()) if d.state == BAD)),
+        metrics.counter("earthing_alarm_stale_samples_total",
+                        "Uploaded samples older than their site's last one, logged but not evaluated",
+                        rule_engine.stale),
+        metrics.gauge("earthing_gateway_devices", "Registered gateway devices", len(gateway)),
+        metrics.counter("earthing_gateway_rounds_total", "Gateway poll rounds", gateway.rounds),
+        metrics.counter("earthing_gateway_polls_total", "Device polls", gateway.polls),
+        metrics.counter("earthing_gateway_poll_errors_total", "Failed device polls", gateway.poll_errors),
+        metrics.counter("earthing_gateway_callback_errors_total", "Good polls whose reading handler raised",
+                        gateway.callback_errors),
+        metrics.gauge("earthing_gateway_round_seconds", "Duration of the last poll round",
+                      gateway.last_round_duration),
+    ]
+    if reading_log is not None:
+        families += [
+            metrics.counter("earthing_log_records_total", "Records appended to the reading log",
+                            reading_log.records_written),
+            metrics.counter("earthing_log_fsyncs_total", "Reading log fsyncs", reading_log.fsyncs),
+            metrics.gauge("earthing_log_segments", "Reading log segment files", len(reading_log.segments)),
+        ]
+    if request_profiler is not None:
+        families.append(metrics.counter("earthing_profiler_samples_total", "Requests profiled",
+                                        request_profiler.samples))
+    if uplink is not None:
+        totals = uplink.totals()
+        families += [
+            metrics.gauge("earthing_uplink_queue_depth", "Uplink entries not yet accepted by the endpoint",
+                          totals["depth"]),
+            metrics.gauge("earthing_uplink_spool_bytes", "Uplink spool size on disk", totals["spool_bytes"]),
+            metrics.counter("earthing_uplink_readings_total", "Readings offered to the uplink", totals["readings"]),
+            metrics.counter("earthing_uplink_invalid_total", "Non-finite readings the uplink skipped",
+                            totals["invalid"]),
+            metrics.counter("earthing_uplink_sent_total", "Coalesced entries accepted by the endpoint",
+                            totals["sent"]),
+            metrics.counter("earthing_uplink_requests_total", "Bulk update requests", totals["requests"]),
+            metrics.counter("earthing_uplink_errors_total", "Failed bulk update requests", totals["errors"]),
+            metrics.counter("earthing_uplink_rate_limited_total", "Bulk updates answered with 429",
+                            totals["rate_limited"]),
+            metrics.counter("earthing_uplink_dropped_total", "Entries dropped to keep the spool bounded",
+                            totals["dropped"] + totals["rejected"]),
+        ]
+    if shared_table is not None:
+        families += [
+            metrics.gauge("earthing_shared_table_sites", "Sites in the pre-fork reading table",
+                          len(shared_table.index)),
+            metrics.counter("earthing_shared_table_writes_total", "Reading table writes", shared_table.writes),
+            metrics.counter("earthing_shared_table_oversize_total",
+                            "Payloads too large for a table slot, served by the parent",
+                            shared_table.oversize),
+            metrics.counter("earthing_shared_table_unslotted_total",
+                            "Writes for sites without a table slot, served by the parent",
+                            shared_table.unslotted),
+        ]
+    return families
+
+
+static_assets = AssetStore()
 
-# Global simulation state
-sim_mode = "AUTO" # AUTO, GOOD, BAD
-forced_moisture = 40
-forced_voltage = 2.58
-
-# Extract HTML from the ESP32 code structure (simplified for python string)
-# Added Simulation Controls UI
-html_content = """
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>Earthing Monitor | ESP32 System</title>
-    <link rel="preconnect" href="https://fonts.googleapis.com">
-    <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
-    <link href="https://fonts.googleapis.com/css2?family=Outfit:wght@300;400;600;700&display=swap" rel="stylesheet">
-    <script src="https://cdn.jsdelivr.net/npm/chart.js"></script>
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0/css/all.min.css">
-    <style>
-        :root {
-            --bg-dark: #0f172a;
-            --bg-panel: rgba(30, 41, 59, 0.7);
-            --text-primary: #f8fafc;
-            --text-secondary: #94a3b8;
-            --accent-success: #10b981;
-            --accent-danger: #ef4444;
-            --accent-warning: #f59e0b;
-            --accent-primary: #3b82f6;
-            --glass-border: 1px solid rgba(255, 255, 255, 0.1);
-            --font-main: 'Outfit', sans-serif;
-        }
-        * { margin: 0; padding: 0; box-sizing: border-box; }
-        body {
-            font-family: var(--font-main);
-            background-color: var(--bg-dark);
-            background-image: 
-                radial-gradient(at 0% 0%, rgba(59, 130, 246, 0.15) 0px, transparent 50%),
-                radial-gradient(at 100% 0%, rgba(16, 185, 129, 0.1) 0px, transparent 50%);
-            color: var(--text-primary);
-            min-height: 100vh;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            padding: 20px;
-        }
-        .app-container { width: 100%; max-width: 1200px; display: flex; flex-direction: column; gap: 20px; }
-        .glass-panel {
-            background: var(--bg-panel);
-            backdrop-filter: blur(16px);
-            border: var(--glass-border);
-            border-radius: 20px;
-            box-shadow: 0 4px 30px rgba(0, 0, 0, 0.3);
-            padding: 20px;
-            transition: transform 0.3s ease, box-shadow 0.3s ease;
-        }
-        .header { display: flex; justify-content: space-between; align-items: center; padding: 15px 30px; flex-wrap: wrap; gap: 15px; }
-        .logo-area { display: flex; align-items: center; gap: 15px; }
-        .logo-icon { font-size: 2rem; color: var(--accent-primary); text-shadow: 0 0 10px var(--accent-primary); }
-        .logo-area h1 { font-size: 1.5rem; font-weight: 700; }
-        .subtitle { font-size: 0.8rem; color: var(--text-secondary); }
-        .system-status-badge { display: flex; align-items: center; gap: 8px; background: rgba(0,0,0,0.3); padding: 8px 16px; border-radius: 30px; font-size: 0.85rem; font-weight: 600; }
-        .status-dot { width: 10px; height: 10px; border-radius: 50%; background-color: var(--text-secondary); transition: all 0.3s ease; }
-        .dashboard-grid { display: grid; grid-template-columns: 1fr 1fr; gap: 20px; }
-        .status-hero { grid-column: 1 / -1; display: flex; align-items: center; justify-content: center; padding: 40px; text-align: center; }
-        .hero-content { display: flex; flex-direction: column; align-items: center; gap: 20px; }
-        .status-ring-container { width: 120px; height: 120px; }
-        .status-ring { width: 100%; height: 100%; border-radius: 50%; border: 8px solid rgba(255,255,255,0.05); display: flex; align-items: center; justify-content: center; font-size: 3.5rem; color: var(--text-secondary); transition: all 0.5s ease; }
-        .status-ring.safe { border-color: var(--accent-success); color: var(--accent-success); box-shadow: 0 0 30px rgba(16, 185, 129, 0.3); }
-        .status-ring.danger { border-color: var(--accent-danger); color: var(--accent-danger); box-shadow: 0 0 30px rgba(239, 68, 68, 0.3); animation: pulse-danger 2s infinite; }
-        @keyframes pulse-danger { 0% { box-shadow: 0 0 0 0 rgba(239, 68, 68, 0.4); } 70% { box-shadow: 0 0 0 20px rgba(239, 68, 68, 0); } 100% { box-shadow: 0 0 0 0 rgba(239, 68, 68, 0); } }
-        .status-text h2 { font-size: 2rem; margin-bottom: 5px; }
-        .status-label { font-size: 1.5rem !important; font-weight: 700; letter-spacing: 2px; }
-        .status-label.good { color: var(--accent-success) !important; text-shadow: 0 0 10px rgba(16, 185, 129, 0.5); }
-        .status-label.bad { color: var(--accent-danger) !important; text-shadow: 0 0 10px rgba(239, 68, 68, 0.5); animation: blink-text 1s infinite; }
-        @keyframes blink-text { 0%, 100% { opacity: 1; } 50% { opacity: 0.5; } }
-        .alert-indicators { display: flex; gap: 20px; margin-top: 15px; opacity: 0; transform: translateY(-10px); transition: all 0.3s ease; }
-        .alert-indicators.active { opacity: 1; transform: translateY(0); }
-        .indicator { display: flex; align-items: center; gap: 8px; padding: 8px 16px; border-radius: 20px; background: rgba(0,0,0,0.3); font-size: 0.85rem; font-weight: 600; color: var(--text-secondary); }
-        .indicator.red-led.on { background: rgba(239, 68, 68, 0.2); color: var(--accent-danger); border: 1px solid var(--accent-danger); }
-        .indicator.red-led.on i { animation: led-pulse 0.5s infinite; }
-        @keyframes led-pulse { 0%, 100% { opacity: 1; } 50% { opacity: 0.6; } }
-        .indicator.buzzer.on { background: rgba(245, 158, 11, 0.2); color: var(--accent-warning); border: 1px solid var(--accent-warning); }
-        .indicator.buzzer.on i { animation: buzzer-shake 0.2s infinite; }
-        @keyframes buzzer-shake { 0%, 100% { transform: translateX(0); } 25% { transform: translateX(-2px); } 75% { transform: translateX(2px); } }
-        .status-hero.alert-mode { background: linear-gradient(135deg, rgba(239, 68, 68, 0.1), rgba(30, 41, 59, 0.7)); }
-        .metrics-container { grid-column: 1 / 2; display: flex; flex-direction: column; gap: 20px; }
-        .metric-card { display: flex; flex-direction: column; gap: 15px; }
-        .metric-card.warning { border: 1px solid var(--accent-warning); box-shadow: 0 0 15px rgba(245, 158, 11, 0.2); }
-        .metric-card.danger { border: 1px solid var(--accent-danger); box-shadow: 0 0 15px rgba(239, 68, 68, 0.2); }
-        .card-header { display: flex; align-items: center; gap: 10px; color: var(--text-secondary); font-size: 0.9rem; text-transform: uppercase; letter-spacing: 1px; }
-        .card-value-area { display: flex; align-items: baseline; gap: 5px; }
-        .value { font-size: 3rem; font-weight: 700; }
-        .unit { font-size: 1.2rem; color: var(--text-secondary); }
-        .progress-bar-bg { width: 100%; height: 8px; background: rgba(255,255,255,0.1); border-radius: 4px; overflow: hidden; }
-        .progress-bar-fill { height: 100%; background: var(--accent-primary); border-radius: 4px; transition: width 0.5s ease-out, background-color 0.3s ease; }
-        .card-footer { font-size: 0.8rem; color: var(--text-secondary); margin-top: auto; }
-        .chart-section { grid-column: 2 / 3; display: flex; flex-direction: column; gap: 15px; }
-        .chart-container { flex-grow: 1; position: relative; width: 100%; min-height: 250px; }
-        .system-info { grid-column: 1 / -1; }
-        .system-info h3 { display: flex; align-items: center; gap: 10px; margin-bottom: 15px; font-size: 1rem; }
-        .system-info h3 i { color: var(--accent-primary); }
-        .info-grid { display: grid; grid-template-columns: repeat(auto-fit, minmax(150px, 1fr)); gap: 15px; }
-        .info-item { display: flex; flex-direction: column; gap: 5px; padding: 12px; background: rgba(0,0,0,0.2); border-radius: 10px; }
-        .info-label { font-size: 0.75rem; color: var(--text-secondary); text-transform: uppercase; }
-        .info-value { font-size: 1rem; font-weight: 600; color: var(--accent-primary); }
-        .app-footer { text-align: center; color: var(--text-secondary); font-size: 0.8rem; padding: 10px; }
-        
-        /* Sim Controls */
-        .sim-controls {
-            position: fixed;
-            bottom: 20px;
-            right: 20px;
-            background: rgba(15, 23, 42, 0.95);
-            border: 1px solid var(--accent-primary);
-            padding: 15px;
-            border-radius: 10px;
-            z-index: 9999;
-            box-shadow: 0 0 20px rgba(0,0,0,0.5);
-        }
-        .sim-controls h4 { margin-bottom: 10px; font-size: 0.9rem; color: var(--accent-primary); }
-        .sim-btn-group { display: flex; gap: 10px; flex-wrap: wrap; }
-        .sim-btn {
-            padding: 8px 12px;
-            border: none;
-            border-radius: 5px;
-            cursor: pointer;
-            font-weight: 600;
-            font-size: 0.8rem;
-            transition: all 0.2s;
-        }
-        .btn-good { background: rgba(16, 185, 129, 0.2); color: #10b981; border: 1px solid #10b981; }
-        .btn-good:hover { background: #10b981; color: #fff; }
-        .btn-bad { background: rgba(239, 68, 68, 0.2); color: #ef4444; border: 1px solid #ef4444; }
-        .btn-bad:hover { background: #ef4444; color: #fff; }
-        .btn-auto { background: rgba(59, 130, 246, 0.2); color: #3b82f6; border: 1px solid #3b82f6; }
-        .btn-auto:hover { background: #3b82f6; color: #fff; }
-        
-        @media (max-width: 768px) {
-            .dashboard-grid { grid-template-columns: 1fr; }
-            .metrics-container, .chart-section { grid-column: 1 / -1; }
-            .header { flex-direction: column; text-align: center; }
-        }
-    </style>
-</head>
-<body>
-    <div class="sim-controls">
-        <h4>🛠 Simulation Controls</h4>
-        <div class="sim-btn-group">
-            <button class="sim-btn btn-good" onclick="setMode('GOOD')">Force GOOD</button>
-            <button class="sim-btn btn-bad" onclick="setMode('BAD')">Force BAD</button>
-            <button class="sim-btn btn-auto" onclick="setMode('AUTO')">Auto Mode</button>
-        </div>
-    </div>
-
-    <div class="app-container">
-        <header class="glass-panel header">
-            <div class="logo-area">
-                <i class="fa-solid fa-bolt logo-icon"></i>
-                <div>
-                    <h1>EARTHING MONITOR</h1>
-                    <p class="subtitle">ESP32 Real-time Safety System (SIMULATION)</p>
-                </div>
-            </div>
-            <div class="system-status-badge">
-                <span class="status-dot"></span>
-                <span id="header-status-text">INITIALIZING</span>
-            </div>
-        </header>
-        <main class="dashboard-grid">
-            <section class="glass-panel status-hero" id="status-hero">
-                <div class="hero-content">
-                    <div class="status-ring-container">
-                        <div class="status-ring" id="main-status-ring">
-                            <i class="fa-solid fa-check-circle" id="main-status-icon"></i>
-                        </div>
-                    </div>
-                    <div class="status-text">
-                        <h2 id="main-status-title">STATUS:</h2>
-                        <p id="main-status-desc" class="status-label">EARTHING GOOD</p>
-                    </div>
-                    <div class="alert-indicators" id="alert-indicators">
-                        <div class="indicator red-led" id="red-led-indicator">
-                            <i class="fa-solid fa-circle"></i>
-                            <span>RED LED</span>
-                        </div>
-                        <div class="indicator buzzer" id="buzzer-indicator">
-                            <i class="fa-solid fa-volume-high"></i>
-                            <span>BUZZER</span>
-                        </div>
-                    </div>
-                </div>
-            </section>
-            <div class="metrics-container">
-                <div class="glass-panel metric-card" id="card-soil">
-                    <div class="card-header">
-                        <span class="card-icon"><i class="fa-solid fa-droplet"></i></span>
-                        <h3>Soil Moisture</h3>
-                    </div>
-                    <div class="card-value-area">
-                        <span class="value" id="val-soil">--</span>
-                        <span class="unit">%</span>
-                    </div>
-                    <div class="progress-bar-bg">
-                        <div class="progress-bar-fill" id="bar-soil" style="width: 0%"></div>
-                    </div>
-                    <p class="card-footer">Target: ≥25% for good earthing</p>
-                </div>
-                <div class="glass-panel metric-card" id="card-voltage">
-                    <div class="card-header">
-                        <span class="card-icon"><i class="fa-solid fa-plug"></i></span>
-                        <h3>AC Voltage (ZMPT101B)</h3>
-                    </div>
-                    <div class="card-value-area">
-                        <span class="value" id="val-voltage">--</span>
-                        <span class="unit">V</span>
-                    </div>
-                    <div class="progress-bar-bg">
-                        <div class="progress-bar-fill" id="bar-voltage" style="width: 0%"></div>
-                    </div>
-                    <p class="card-footer">Safe Range: 2.55V - 2.61V</p>
-                </div>
-            </div>
-            <section class="glass-panel chart-section">
-                <h3>Live Voltage History</h3>
-                <div class="chart-container">
-                    <canvas id="voltageChart"></canvas>
-                </div>
-            </section>
-            <section class="glass-panel system-info">
-                <h3><i class="fa-solid fa-microchip"></i> System Configuration</h3>
-                <div class="info-grid">
-                    <div class="info-item"><span class="info-label">Mode</span><span class="info-value">SIMULATION</span></div>
-                    <div class="info-item"><span class="info-label">Host</span><span class="info-value">LOCALHOST</span></div>
-                    <div class="info-item"><span class="info-label">Status</span><span class="info-value">RUNNING</span></div>
-                </div>
-            </section>
-        </main>
-        <footer class="app-footer">
-            <p>ESP32 Earthing Monitor • <span id="clock">00:00:00</span></p>
-        </footer>
-    </div>
-    <script>
-        async function setMode(mode) {
-            await fetch('/set_mode?mode=' + mode);
-        }
-
-        document.addEventListener('DOMContentLoaded', () => {
-            const valSoil = document.getElementById('val-soil');
-            const barSoil = document.getElementById('bar-soil');
-            const cardSoil = document.getElementById('card-soil');
-            const valVoltage = document.getElementById('val-voltage');
-            const barVoltage = document.getElementById('bar-voltage');
-            const cardVoltage = document.getElementById('card-voltage');
-            const statusHero = document.getElementById('status-hero');
-            const mainStatusRing = document.getElementById('main-status-ring');
-            const mainStatusIcon = document.getElementById('main-status-icon');
-            const mainStatusTitle = document.getElementById('main-status-title');
-            const mainStatusDesc = document.getElementById('main-status-desc');
-            const statusBadgeText = document.getElementById('header-status-text');
-            const statusDot = document.querySelector('.status-dot');
-            const redLedIndicator = document.getElementById('red-led-indicator');
-            const buzzerIndicator = document.getElementById('buzzer-indicator');
-            const alertIndicators = document.getElementById('alert-indicators');
-            const clockElement = document.getElementById('clock');
-
-            const ctx = document.getElementById('voltageChart').getContext('2d');
-            const voltageChart = new Chart(ctx, {
-                type: 'line',
-                data: {
-                    labels: Array(20).fill(''),
-                    datasets: [{
-                        label: 'AC Voltage (V)',
-                        data: Array(20).fill(0),
-                        borderColor: '#3b82f6',
-                        backgroundColor: 'rgba(59, 130, 246, 0.1)',
-                        borderWidth: 2,
-                        fill: true,
-                        tension: 0.4,
-                        pointRadius: 0
-                    }]
-                },
-                options: {
-                    responsive: true,
-                    maintainAspectRatio: false,
-                    scales: {
-                        y: { beginAtZero: false, suggestedMin: 2.4, suggestedMax: 2.8, grid: { color: 'rgba(255,255,255,0.05)' }, ticks: { color: '#94a3b8' } },
-                        x: { grid: { display: false } }
-                    },
-                    plugins: { legend: { display: false } },
-                    animation: false
-                }
-            });
-
-            const SOIL_THRESHOLD = 25;
-            const VOLT_MIN = 2.55;
-            const VOLT_MAX = 2.61;
-
-            function updateClock() {
-                clockElement.textContent = new Date().toLocaleTimeString();
-            }
-
-            function checkEarthingStatus(moisture, voltage) {
-                const soilGood = moisture >= SOIL_THRESHOLD;
-                const voltGood = voltage >= VOLT_MIN && voltage <= VOLT_MAX;
-                return { earthingGood: soilGood && voltGood, soilGood, voltGood };
-            }
-
-            async function fetchData() {
-                try {
-                    const response = await fetch('/data');
-                    if (!response.ok) throw new Error('Network error');
-                    const data = await response.json();
-                    const { earthingGood, soilGood, voltGood } = checkEarthingStatus(data.moisture, data.voltage);
-                    updateDashboard(data.moisture, data.voltage, earthingGood, soilGood, voltGood);
-                    statusBadgeText.textContent = 'CONNECTED';
-                    statusDot.style.backgroundColor = '#10b981';
-                } catch (error) {
-                    console.error('Fetch error:', error);
-                    statusBadgeText.textContent = 'DISCONNECTED';
-                    statusDot.style.backgroundColor = '#94a3b8';
-                }
-            }
-
-            function updateDashboard(moistureVal, voltageVal, earthingGood, isSoilGood, isVoltGood) {
-                const dispMoisture = Math.round(moistureVal);
-                const dispVoltage = voltageVal.toFixed(2);
-                valSoil.textContent = dispMoisture;
-                valVoltage.textContent = dispVoltage;
-                barSoil.style.width = dispMoisture + '%';
-                barVoltage.style.width = Math.min(100, Math.max(0, ((voltageVal - 2.0) / 1.0) * 100)) + '%';
-                updateStatusUI(earthingGood, isSoilGood, isVoltGood);
-                updateChart(voltageVal, earthingGood);
-            }
-
-            function updateStatusUI(earthingGood, soilGood, voltGood) {
-                if (earthingGood) {
-                    mainStatusRing.className = 'status-ring safe';
-                    mainStatusIcon.className = 'fa-solid fa-check-circle';
-                    mainStatusTitle.textContent = 'STATUS:';
-                    mainStatusDesc.textContent = 'EARTHING GOOD';
-                    mainStatusDesc.className = 'status-label good';
-                    alertIndicators.classList.remove('active');
-                    redLedIndicator.classList.remove('on');
-                    buzzerIndicator.classList.remove('on');
-                    statusHero.classList.remove('alert-mode');
-                } else {
-                    mainStatusRing.className = 'status-ring danger';
-                    mainStatusIcon.className = 'fa-solid fa-triangle-exclamation';
-                    mainStatusTitle.textContent = 'ALERT!';
-                    mainStatusDesc.textContent = 'EARTHING BAD';
-                    mainStatusDesc.className = 'status-label bad';
-                    alertIndicators.classList.add('active');
-                    redLedIndicator.classList.add('on');
-                    buzzerIndicator.classList.add('on');
-                    statusHero.classList.add('alert-mode');
-                }
-                valSoil.style.color = soilGood ? '#10b981' : '#f59e0b';
-                barSoil.style.backgroundColor = soilGood ? '#10b981' : '#f59e0b';
-                cardSoil.classList.toggle('warning', !soilGood);
-                valVoltage.style.color = voltGood ? '#10b981' : '#ef4444';
-                barVoltage.style.backgroundColor = voltGood ? '#10b981' : '#ef4444';
-                cardVoltage.classList.toggle('danger', !voltGood);
-            }
-
-            function updateChart(newVolt, earthingGood) {
-                const data = voltageChart.data.datasets[0].data;
-                data.shift();
-                data.push(newVolt);
-                voltageChart.data.datasets[0].borderColor = earthingGood ? '#10b981' : '#ef4444';
-                voltageChart.data.datasets[0].backgroundColor = earthingGood ? 'rgba(16,185,129,0.1)' : 'rgba(239,68,68,0.1)';
-                voltageChart.update();
-            }
-
-            setInterval(updateClock, 1000);
-            setInterval(fetchData, 1000);
-            updateClock();
-            fetchData();
-        });
-    </script>
-</body>
-</html>
-"""
 
 class EarthingMonitorHandler(http.server.BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps dashboard connections open between 1 Hz polls; every
+    # response must therefore carry a Content-Length or be chunked.
+    protocol_version = "HTTP/1.1"
+    # Idle keep-alive connections are dropped after this many seconds so they
+    # do not pin a worker forever.
+    timeout = KEEPALIVE_TIMEOUT
+    # Headers and body go out in separate writes; without TCP_NODELAY the
+    # body waits on the client's delayed ACK (~40 ms per request).
+    disable_nagle_algorithm = True
+
+    def handle_one_request(self):
+        # Per-request bookkeeping for /metrics; the clock starts in
+        # parse_request so idle keep-alive time is not counted
+        self.started = None
+        self.status = None
+        self.bytes_in = self.bytes_out = 0
+        self.profile = None
+        try:
+            super().handle_one_request()
+        finally:
+            if self.started is not None:
+                if self.profile is not None:
+                    self.profiler.stop(self.profile)
+                if self.metrics is not None:
+                    self.metrics.finish(self.route, self.status, time.perf_counter() - self.started,
+                                        self.bytes_in, self.bytes_out)
+
+    def parse_request(self):
+        self.started = time.perf_counter()
+        ok = super().parse_request()
+        self.route = route_label(self.path) if ok else metrics.OTHER_ROUTE
+        # Pinned per request so swapping the globals cannot unbalance gauges
+        self.metrics = request_metrics
+        self.profiler = request_profiler
+        if self.metrics is not None:
+            self.metrics.start(self.route)
+        if self.profiler is not None:
+            self.profile = self.profiler.start()
+        return ok
+
+    def send_response(self, code, message=None):
+        self.status = code
+        super().send_response(code, message)
+
+    def send_body(self, status, body=b"", content_type=None):
+        self.send_response(status)
+        if content_type:
+            self.send_header('Content-type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+            self.bytes_out += len(body)
+
+    def send_asset(self, asset, cache_control=REVALIDATE):
+        encoding = asset.select_encoding(self.headers.get('Accept-Encoding'))
+        if asset.matches(self.headers.get('If-None-Match')):
+            self.send_response(304)
+            self.send_header('ETag', asset.etags[encoding])
+            self.send_header('Cache-Control', cache_control)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-type', asset.content_type)
+        if encoding != 'identity':
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('ETag', asset.etags[encoding])
+        self.send_header('Cache-Control', cache_control)
+        self.send_header('Vary', 'Accept-Encoding')
+        body = asset.variants[encoding]
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+            self.bytes_out += len(body)
+
+    def send_static(self, parsed_path):
+        asset = static_assets.get(parsed_path.path[len(STATIC_PREFIX):])
+        if asset is None:
+            self.send_body(404)
+            return
+        # Only the URL of the current version can be cached for good
+        version = parse_qs(parsed_path.query).get('v', [None])[0]
+        self.send_asset(asset, IMMUTABLE if version == asset.version else REVALIDATE)
+
     def do_GET(self):
-        global sim_mode, forced_moisture, forced_voltage
-        
         parsed_path = urlparse(self.path)
         
         if parsed_path.path == '/':
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(html_content.encode('utf-8'))
+            self.send_asset(static_assets.get(DASHBOARD_PAGE))
+
+        elif parsed_path.path.startswith(STATIC_PREFIX):
+            self.send_static(parsed_path)
             
         elif parsed_path.path == '/set_mode':
+            # Dashboard buttons; shorthand for a POST /config site mode change
             query = parse_qs(parsed_path.query)
             if 'mode' in query:
-                sim_mode = query['mode'][0]
-            self.send_response(200)
-            self.end_headers()
+                site = query.get('site', [LOCAL_SITE])[0]
+                try:
+                    config_store.update({"sites": {site: {"mode": query['mode'][0]}}})
+                except ConfigError as e:
+                    self.send_body(400, str(e).encode('utf-8'), 'text/plain')
+                    return
+            self.send_body(200)
+
+        elif parsed_path.path == '/config':
+            self.send_body(200, config_store.current.payload, 'application/json')
             
         elif parsed_path.path == '/data':
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            
-            # Logic based on mode
-            if sim_mode == "GOOD":
-                voltage = 2.58 + (random.random() * 0.02 - 0.01)
-                moisture = 45 + random.randint(-2, 2)
-            elif sim_mode == "BAD":
-                # Create a fault (e.g., low voltage or dry soil)
-                voltage = 1.5 + (random.random() * 0.2) # Low voltage fault
-                moisture = 10 + random.randint(0, 5)    # Dry soil fault
-            else: # AUTO
-                # Vary voltage slightly around 2.58
-                voltage = 2.58 + (random.random() * 0.04 - 0.02)
-                moisture = 40 + random.randint(-5, 5)
-            
-            # Logic for status
-            earthing_good = (moisture >= 25) and (2.55 <= voltage <= 2.61)
-            
-            data = {
-                "moisture": moisture,
-                "voltage": voltage,
-                "earthingGood": earthing_good
-            }
-            self.wfile.write(json.dumps(data).encode('utf-8'))
+            # Every client sees the same precomputed reading
+            self.send_body(200, producer.snapshot.payload, 'application/json')
+
+        elif parsed_path.path == '/stream':
+            self.start_stream()
+
+        elif parsed_path.path == '/sites':
+            # Combined view of every registered device, rebuilt once per poll round
+            self.send_body(200, gateway.sites_payload, 'application/json')
+
+        elif parsed_path.path.startswith('/sites/') and parsed_path.path.endswith('/data'):
+            site_id = parsed_path.path[len('/sites/'):-len('/data')]
+            try:
+                payload = gateway.site_payload(site_id)
+            except KeyError:
+                self.send_body(404, b'Unknown site', 'text/plain')
+                return
+            if payload is None:
+                self.send_body(503, b'Site has not answered yet', 'text/plain')
+            else:
+                self.send_body(200, payload, 'application/json')
+
+        elif parsed_path.path == '/alarms':
+            # Debounced per-site states and recent state changes
+            self.send_body(200, json.dumps(rule_engine.snapshot()).encode('utf-8'), 'application/json')
+
+        elif parsed_path.path == '/uplink':
+            # Queue depth and last error per ThingSpeak channel
+            if uplink is None:
+                self.send_body(404, b'Start the server with --uplink FILE', 'text/plain')
+                return
+            self.send_body(200, json.dumps(uplink.status()).encode('utf-8'), 'application/json')
+
+        elif parsed_path.path == '/metrics':
+            families = server_families()
+            if request_metrics is not None:
+                families = request_metrics.families() + families
+            self.send_body(200, metrics.render(families), metrics.CONTENT_TYPE)
+
+        elif parsed_path.path == '/metrics/profile':
+            # ?sort=tottime|cumulative|ncalls
+            if request_profiler is None:
+                self.send_body(404, b'Start the server with --profile-every N', 'text/plain')
+                return
+            sort = parse_qs(parsed_path.query).get('sort', ['cumulative'])[0]
+            if sort not in ('cumulative', 'tottime', 'ncalls'):
+                self.send_body(400, b'sort must be cumulative, tottime or ncalls', 'text/plain')
+                return
+            self.send_body(200, request_profiler.report(sort).encode('utf-8'), 'text/plain; charset=utf-8')
+
+        elif parsed_path.path == '/history':
+            # /history?from=&to=&step=&site= ; times are unix seconds or
+            # negative offsets from now (from=-3600 is the last hour)
+            query = parse_qs(parsed_path.query)
+            try:
+                start = parse_time(query['from'][0]) if 'from' in query else None
+                end = parse_time(query['to'][0]) if 'to' in query else None
+                step = parse_step(query['step'][0]) if 'step' in query else None
+            except ValueError as e:
+                self.send_body(400, str(e).encode('utf-8'), 'text/plain')
+                return
+            site = query.get('site', [LOCAL_SITE])[0]
+            oldest = reading_history.oldest()
+            in_memory = site == LOCAL_SITE and (start is None or (oldest is not None and start >= oldest))
+            if in_memory or reading_log is None:
+                if site != LOCAL_SITE:
+                    self.send_body(404, b'Site history needs --data-dir', 'text/plain')
+                    return
+                result = reading_history.query(start, end, step)
+            else:
+                # Older than the ring buffer, or another site: scan the log
+                result = reading_log.query(start, end, step, site)
+            self.send_body(200, json.dumps(result, separators=(',', ':')).encode('utf-8'), 'application/json')
+
+        elif parsed_path.path == '/export':
+            self.handle_export(parse_qs(parsed_path.query))
         else:
-            self.send_response(404)
-            self.end_headers()
+            self.send_body(404)
+
+    def handle_export(self, query):
+        # /export?format=csv|columnar&site=&from=&to=&fault=1|0 streams raw
+        # readings; with agg=daily|hourly (format=json|csv, tz=hours east of
+        # UTC) it returns per-site min/max/mean and percent in fault instead
+        import export   # Loads numpy; imported on first use to keep startup lean
+        if export.np is None:
+            self.send_body(501, b'numpy is not installed', 'text/plain')
+            return
+        if reading_log is None:
+            self.send_body(404, b'Export needs --data-dir', 'text/plain')
+            return
+        agg = query.get('agg', [None])[0]
+        fmt = query.get('format', ['json' if agg else 'csv'])[0]
+        try:
+            start = parse_time(query['from'][0]) if 'from' in query else None
+            end = parse_time(query['to'][0]) if 'to' in query else None
+            fault = None
+            if 'fault' in query:
+                fault = {'1': True, 'true': True, '0': False, 'false': False}.get(query['fault'][0].lower())
+                if fault is None:
+                    raise ValueError("fault must be 1 or 0")
+            offset = float(query.get('tz', ['0'])[0]) * 3600
+            if not -14 * 3600 <= offset <= 14 * 3600:
+                raise ValueError("tz must be hours from UTC, -14 to 14")
+            if agg is not None and agg not in export.INTERVALS:
+                raise ValueError("agg must be daily or hourly")
+            if fmt not in (('json', 'csv') if agg else ('csv', 'columnar')):
+                raise ValueError("format must be json or csv with agg, csv or columnar without")
+        except ValueError as e:
+            self.send_body(400, str(e).encode('utf-8'), 'text/plain')
+            return
+        sites = [name for value in query.get('site', ()) for name in value.split(',') if name]
+        site_ids = [reading_log.site_ids[name] for name in sites if name in reading_log.site_ids] if sites else None
+        site_names = dict(reading_log.site_names)
+        chunks = export.select(export.record_chunks(reading_log, start, end), site_ids, fault)
+        if agg:
+            interval = export.INTERVALS[agg]
+            rows = export.aggregate_rows(*export.aggregate(chunks, interval, offset), site_names, interval, offset)
+            if fmt == 'json':
+                self.send_body(200, export.aggregate_json(rows, interval, offset), 'application/json')
+                return
+            body, content_type, name = export.aggregate_csv(rows), 'text/csv; charset=utf-8', f"earthing-{agg}.csv"
+        elif fmt == 'csv':
+            body, content_type, name = export.csv_chunks(chunks, site_names), 'text/csv; charset=utf-8', "earthing.csv"
+        else:
+            body, content_type, name = export.columnar_chunks(chunks, site_names), export.CONTENT_TYPE, "earthing.ecol"
+        self.send_chunked(200, body, content_type, [('Content-Disposition', f'attachment; filename="{name}"')])
+
+    def send_chunked(self, status, chunks, content_type, headers=()):
+        # Streams an iterable of bytes as it is produced, gzipped on the fly
+        # when the client accepts it. HTTP/1.0 clients get the body
+        # unframed and the connection closed.
+        compressor = None
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        for name, value in headers:
+            self.send_header(name, value)
+        if accepts_gzip(self.headers.get('Accept-Encoding')):
+            compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 31)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Vary', 'Accept-Encoding')
+        chunked = self.request_version == 'HTTP/1.1' and self.protocol_version == 'HTTP/1.1'
+        if chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.close_connection = True
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        complete = False
+        try:
+            for data in itertools.chain(chunks, [None]):
+                if compressor is not None:
+                    data = compressor.compress(data) if data is not None else compressor.flush()
+                if data:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data) if chunked else data)
+                    self.bytes_out += len(data)
+            if chunked:
+                self.wfile.write(b'0\r\n\r\n')
+            complete = True
+        except (BrokenPipeError, ConnectionResetError):
+            pass        # Client went away mid-export
+        finally:
+            if not complete:
+                # The body is cut short; only closing tells the client
+                self.close_connection = True
+
+    def read_body(self):
+        # Returns the request body, or None after sending an error response
+        length = self.headers.get('Content-Length')
+        if length is None or not length.isdigit():
+            self.close_connection = True
+            self.send_body(411, b'Content-Length required', 'text/plain')
+            return None
+        if int(length) > MAX_BODY:
+            self.close_connection = True
+            self.send_body(413, b'Request body too large', 'text/plain')
+            return None
+        body = self.rfile.read(int(length))
+        self.bytes_in += len(body)
+        self.body_read = True
+        return body
+
+    def do_POST(self):
+        self.body_read = False
+        self.handle_post()
+        if not self.body_read and not self.close_connection:
+            # Rejected before reading: drain the body, or it would be parsed
+            # as the next keep-alive request
+            length = self.headers.get('Content-Length', '0')
+            if length.isdigit() and int(length) <= MAX_BODY:
+                self.bytes_in += len(self.rfile.read(int(length)))
+            else:
+                self.close_connection = True
+
+    def handle_post(self):
+        parsed_path = urlparse(self.path)
+
+        if parsed_path.path == '/waveform':
+            # Raw ZMPT101B sample blocks, see signal_quality.py for the format
+            import signal_quality   # Loads numpy, like export
+            if signal_quality.np is None:
+                self.send_body(501, b'numpy is not installed', 'text/plain')
+                return
+            body = self.read_body()
+            if body is None:
+                return
+            site = parse_qs(parsed_path.query).get('site', [None])[0]
+            try:
+                if site is not None and not ingest_protocol.SITE_ID_RE.match(site):
+                    raise signal_quality.FormatError(f"invalid site id {site!r}")
+                # The site's configured band, as the fault detector uses
+                thresholds = config_store.current.site(site).thresholds
+                analysis = signal_quality.process(body, thresholds)
+                if site is not None and len(analysis["t"]):
+                    # Same timestamp and moisture checks as /ingest before anything is stored
+                    ingest_protocol.validate(site, analysis["t"].tolist(), analysis["moisture"].tolist(), time.time())
+            except (signal_quality.FormatError, ingest_protocol.FormatError) as e:
+                self.send_body(400, str(e).encode('utf-8'), 'text/plain')
+                return
+            if site is not None:
+                t, moisture = analysis["t"].tolist(), analysis["moisture"].tolist()
+                voltage = analysis["voltage"].tolist()
+                if reading_log is not None:
+                    reading_log.append_many(site, t, moisture, voltage, analysis["earthingGood"].tolist())
+                rule_engine.feed_series(site, t, moisture, voltage)
+            result = json.dumps(signal_quality.to_json(analysis), separators=(',', ':'))
+            self.send_body(200, result.encode('utf-8'), 'application/json')
+
+        elif parsed_path.path == '/config':
+            # Partial update, validated as a whole; see config.py
+            body = self.read_body()
+            if body is None:
+                return
+            try:
+                config = config_store.update(json.loads(body))
+            except VersionConflict as e:
+                self.send_body(409, str(e).encode('utf-8'), 'text/plain')
+                return
+            except (ConfigError, ValueError) as e:
+                self.send_body(400, str(e).encode('utf-8'), 'text/plain')
+                return
+            self.send_body(200, config.payload, 'application/json')
+
+        elif parsed_path.path == '/ingest':
+            # Batched device uploads: binary frames (ingest_protocol.py) or
+            # the equivalent JSON with Content-Type: application/json
+            if reading_log is None:
+                self.send_body(503, b'Ingest needs --data-dir', 'text/plain')
+                return
+            body = self.read_body()
+            if body is None:
+                return
+            try:
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    batches = ingest_protocol.decode_json(body)
+                else:
+                    batches = ingest_protocol.decode(body)
+            except ingest_protocol.FormatError as e:
+                self.send_body(400, str(e).encode('utf-8'), 'text/plain')
+                return
+            for batch in batches:
+                reading_log.append_many(batch.site, batch.timestamps, batch.moisture,
+                                        batch.voltage, batch.status)
+                rule_engine.feed_series(batch.site, batch.timestamps, batch.moisture, batch.voltage)
+            result = {"accepted": sum(len(b) for b in batches), "batches": len(batches)}
+            self.send_body(200, json.dumps(result).encode('utf-8'), 'application/json')
+        else:
+            self.send_body(404)
+
+    def start_stream(self):
+        if len(stream_hub) >= stream_hub.max_subscribers:
+            self.send_body(503, b'Too many stream subscribers', 'text/plain')
+            return
+        self.send_response(200)
+        self.send_header('Content-type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        # Hand the socket to the hub's writer thread and free this worker
+        self.server.detach_request(self.request)
+        if not stream_hub.subscribe(self.connection, b'retry: 2000\n\n'):
+            # Filled up since the check above; the socket is ours to close
+            self.connection.close()
+
+    do_HEAD = do_GET
 
     def log_message(self, format, *args):
         # Suppress logging to keep output clean
         pass
 
-if __name__ == "__main__":
-    Handler = EarthingMonitorHandler
-    with socketserver.TCPServer(("", PORT), Handler) as httpd:
-        print(f"Mock Server running at http://localhost:{PORT}")
-        print("Press Ctrl+C to stop")
-        webbrowser.open(f"http://localhost:{PORT}")
+
+class DetachableServerMixin:
+    # Lets a handler take ownership of its socket (e.g. for /stream) so the
+    # server does not close it when the request returns.
+
+    def detach_request(self, request):
+        self._detached.add(request)
+
+    def shutdown_request(self, request):
+        if request in self._detached:
+            self._detached.discard(request)
+            return
+        super().shutdown_request(request)
+
+
+class SingleThreadHTTPServer(DetachableServerMixin, socketserver.TCPServer):
+    allow_reuse_address = True
+
+    def __init__(self, server_address, handler_class):
+        self._detached = set()
+        super().__init__(server_address, handler_class)
+
+
+class SingleThreadHandler(EarthingMonitorHandler):
+    # HTTP/1.0 closes every connection after its response, so a polling
+    # dashboard cannot hold the only thread between polls
+    protocol_version = "HTTP/1.0"
+
+
+class BoundedThreadingHTTPServer(DetachableServerMixin, http.server.HTTPServer):
+    # Each connection is handled on a fixed-size worker pool. When every
+    # worker is busy the accept loop blocks, so further clients wait in the
+    # listen backlog instead of spawning unbounded threads.
+    request_queue_size = 256
+
+    def __init__(self, server_address, handler_class, max_workers=DEFAULT_WORKERS):
+        self._detached = set()
+        super().__init__(server_address, handler_class)
+        self._pool = ThreadPoolExecutor(max_workers=max_workers,
+                                        thread_name_prefix="earthing-worker")
+        self._slots = threading.BoundedSemaphore(max_workers)
+
+    def process_request(self, request, client_address):
+        self._slots.acquire()
+        try:
+            self._pool.submit(self._process_request_worker, request, client_address)
+        except RuntimeError:
+            # Pool already shut down
+            self._slots.release()
+            self.shutdown_request(request)
+
+    def _process_request_worker(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._slots.release()
+
+    def server_close(self):
+        super().server_close()
+        self._pool.shutdown(wait=False)
+
+
+ENGINES = ("threaded", "single")
+
+
+def make_server(port=PORT, engine="threaded", workers=DEFAULT_WORKERS, host=""):
+    producer.start()
+    if engine == "threaded":
+        return BoundedThreadingHTTPServer((host, port), EarthingMonitorHandler, max_workers=workers)
+    if engine == "single":
+        # Original behaviour: one request at a time, one request per connection
+        return SingleThreadHTTPServer((host, port), SingleThreadHandler)
+    raise ValueError(f"Unknown engine {engine!r}, expected one of {ENGINES}")
+
+
+class ReusePortHTTPServer(BoundedThreadingHTTPServer):
+    # Every pre-fork worker binds the same port; the kernel spreads new
+    # connections across their listen queues
+    allow_reuse_port = True
+
+
+class WorkerHandler(EarthingMonitorHandler):
+    # Pre-fork worker: the hot read routes are answered from the shared
+    # reading table, everything that reads or changes parent state (history,
+    # alarms, ingest, config updates) is forwarded to the parent's control
+    # server.
+    control_address = None
+    _control = threading.local()
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path in ('/', '/stream', '/metrics/profile') or path.startswith(STATIC_PREFIX):
+            super().do_GET()
+        elif path == '/data':
+            self.send_shared(LOCAL_SITE)
+        elif path.startswith('/sites/') and path.endswith('/data'):
+            self.send_shared(path[len('/sites/'):-len('/data')])
+        elif path == '/config':
+            payload = shared_table.read_blob()[1]
+            if payload is None:
+                self.forward()
+            else:
+                self.send_body(200, payload, 'application/json')
+        elif path == '/metrics':
+            families = worker_families()
+            if request_metrics is not None:
+                families = request_metrics.families() + families
+            self.send_body(200, metrics.render(families), metrics.CONTENT_TYPE)
+        else:
+            self.forward()
+
+    do_HEAD = do_GET
+
+    def handle_post(self):
+        self.forward()
+
+    def send_shared(self, site):
+        # Sites the table has no reading for (yet, or no slot at all, or a
+        # slot that stayed busy) get the parent's answer
+        payload = shared_table.read(site)[1]
+        if payload is None:
+            self.forward()
+        else:
+            self.send_body(200, payload, 'application/json')
+
+    def forward(self):
+        body = None
+        if self.command == 'POST':
+            body = self.read_body()
+            if body is None:
+                return
+        headers = {}
+        if self.headers.get('Content-Type'):
+            headers['Content-Type'] = self.headers['Content-Type']
+        method = 'GET' if self.command == 'HEAD' else self.command
+        # One keep-alive connection per worker thread. A request is sent
+        # again only when the parent had already closed the reused idle
+        # connection, so it cannot have seen the first one; after a timeout
+        # or any other failure it may have, and a POST must not run twice.
+        for attempt in range(2):
+            conn = getattr(self._control, 'conn', None)
+            reused = conn is not None
+            if conn is None:
+                conn = self._control.conn = http.client.HTTPConnection(*self.control_address, timeout=30)
+            try:
+                conn.request(method, self.path, body, headers)
+                response = conn.getresponse()
+                if not response.chunked:
+                    data = response.read()
+                break
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                self._control.conn = None
+                stale = isinstance(e, (BrokenPipeError, http.client.RemoteDisconnected))
+                if not (reused and stale):
+                    self.send_body(502, b'Control process unavailable', 'text/plain')
+                    return
+        if response.chunked:
+            self.relay(conn, response)
+        else:
+            self.send_body(response.status, data, response.getheader('Content-Type'))
+
+    def relay(self, conn, response):
+        # Streamed responses (/export) are passed on chunk by chunk rather
+        # than buffered; this worker does the gzip, not the parent
+        headers = [('Content-Disposition', response.getheader('Content-Disposition'))]
+        try:
+            self.send_chunked(response.status, iter(lambda: response.read1(RELAY_CHUNK), b''),
+                              response.getheader('Content-Type'), [h for h in headers if h[1]])
+        except (OSError, http.client.HTTPException):
+            self.close_connection = True
+        if not response.isclosed():
+            # Abandoned mid-body; the connection cannot be reused
+            conn.close()
+            self._control.conn = None
+
+
+def worker_families():
+    return [
+        metrics.gauge("earthing_worker_pid", "Pre-fork worker that answered this scrape", os.getpid()),
+        metrics.gauge("earthing_shared_table_sites", "Sites in the pre-fork reading table",
+                      len(shared_table.index)),
+        metrics.gauge("earthing_stream_subscribers", "Connected /stream clients", len(stream_hub)),
+        metrics.counter("earthing_stream_events_total", "Events published to /stream",
+                        stream_hub.events_published),
+        metrics.counter("earthing_stream_disconnects_total", "Stream clients dropped or closed",
+                        stream_hub.disconnects),
+    ]
+
+
+def watch_shared_table(table, hub, site=LOCAL_SITE, interval=SHARED_POLL):
+    # Worker-side replacement for the producer's publish: turn table
+    # changes into /stream events. Checking a sequence number costs no copy.
+    seen = config_seen = 0
+    last_payload = None
+    while True:
+        if table.seq(site) != seen:
+            seen, payload = table.read(site)
+            if payload is not None and payload != last_payload:
+                last_payload = payload
+                hub.publish(encode_event(payload, seen // 2))
+        if table.blob_seq() != config_seen:
+            config_seen, payload = table.read_blob()
+            if payload is not None:
+                version = json.loads(payload)["version"]
+                hub.publish(encode_event(payload, version, "config"), key="config")
+        time.sleep(interval)
+
+
+def run_worker(address, workers, control_address, inherited):
+    # Runs in a forked child. The parent's hub shares its wakeup socketpair
+    # with us, so workers get their own.
+    global stream_hub
+    for sock in inherited:
+        sock.close()
+    stream_hub = StreamHub()
+    WorkerHandler.control_address = control_address
+    httpd = ReusePortHTTPServer(address, WorkerHandler, max_workers=workers)
+
+    def stop(signum, frame):
+        threading.Thread(target=httpd.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    threading.Thread(target=watch_shared_table, args=(shared_table, stream_hub),
+                     name="earthing-table-watch", daemon=True).start()
+    httpd.serve_forever()
+    httpd.server_close()
+
+
+def fork_worker(*args):
+    pid = os.fork()
+    if pid:
+        return pid
+    status = 1
+    try:
+        run_worker(*args)
+        status = 0
+    except Exception:
+        traceback.print_exc()
+    finally:
+        # Never fall back into the parent's code
+        os._exit(status)
+
+
+def serve_prefork(processes, port=PORT, workers=DEFAULT_WORKERS, host="", on_ready=None):
+    # The parent owns the producer, gateway, rule engine and reading log and
+    # serves them on a private control port. Workers are forked before any
+    # of its threads start, so no lock can be inherited mid-update.
+    global shared_table
+    shared_table = SharedTable()
+    shared_table.write(producer.site, producer.snapshot.payload)
+    shared_table.write_blob(config_store.current.payload)
+    producer.listeners.append(lambda snapshot: shared_table.write(producer.site, snapshot.payload))
+
+    # Bound but never listening: holds the port (and resolves port 0) for
+    # the workers' SO_REUSEPORT listeners without taking connections itself
+    reserved = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    reserved.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    reserved.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    reserved.bind((host, port))
+    address = reserved.getsockname()
+    # Each worker thread keeps one keep-alive control connection, and each
+    # connection holds a control thread until it goes idle; one slot per
+    # worker thread in every process means a forward never waits for one
+    control = BoundedThreadingHTTPServer(("127.0.0.1", 0), EarthingMonitorHandler,
+                                         max_workers=processes * workers)
+    inherited = [reserved, control.socket]
+    pids = [fork_worker(address, workers, control.server_address, inherited) for _ in range(processes)]
+    # Unwind through the finally below so workers are not orphaned
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        producer.start()
+        threading.Thread(target=control.serve_forever, name="earthing-control", daemon=True).start()
+        if on_ready is not None:
+            on_ready(address[1])
+        while pids:
+            pid, status = os.wait()
+            pids.remove(pid)
+            print(f"Worker {pid} exited with status {os.waitstatus_to_exitcode(status)}", file=sys.stderr)
+    finally:
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in pids:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+        control.shutdown()
+        control.server_close()
+        reserved.close()
+        shared_table.close()
+        shared_table = None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Earthing monitor mock server")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--engine", choices=ENGINES, default="threaded",
+                        help="threaded: bounded worker pool (default), single: one request at a time")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="worker pool size for the threaded engine")
+    parser.add_argument("--tick-rate", type=float, default=TICK_RATE,
+                        help="readings generated per second (default 1)")
+    parser.add_argument("--history", type=int, default=reading_history.capacity,
+                        help="readings kept in memory for /history")
+    parser.add_argument("--data-dir", metavar="DIR",
+                        help="persist readings to an append-only log in DIR (replayed on restart)")
+    parser.add_argument("--config", metavar="FILE",
+                        help="JSON config (mode, tick rates, thresholds per site), as accepted by POST /config")
+    parser.add_argument("--thresholds", metavar="FILE",
+                        help="JSON with default and per-site fault detector thresholds")
+    parser.add_argument("--device", action="append", default=[], metavar="ID=URL",
+                        help="register an ESP32 node for /sites, e.g. pit1=http://192.168.4.1 (repeatable)")
+    parser.add_argument("--simulate", type=int, default=0, metavar="N",
+                        help="spawn N virtual devices and register them with the gateway")
+    parser.add_argument("--poll-interval", type=float, default=gateway.interval,
+                        help="seconds between gateway poll rounds")
+    parser.add_argument("--uplink", metavar="FILE",
+                        help="JSON with ThingSpeak channels per site; readings are spooled and bulk-uploaded")
+    parser.add_argument("--no-metrics", action="store_true",
+                        help="disable per-request instrumentation (/metrics keeps the server gauges)")
+    parser.add_argument("--profile-every", type=int, default=0, metavar="N",
+                        help="profile every Nth request with cProfile, report at /metrics/profile")
+    parser.add_argument("--processes", type=int, default=0, metavar="N",
+                        help="pre-fork N worker processes sharing the port with SO_REUSEPORT (Linux)")
+    parser.add_argument("--no-browser", action="store_true", help="do not open the dashboard in a browser")
+    return parser.parse_args(argv)
+
+
+def open_reading_log(directory, history_capacity=None):
+    global reading_log, reading_history
+    reading_log = ReadingLog(directory)
+    # Replay the tail of the log into a fresh ring buffer so /history
+    # survives a restart. Must run before the producer thread starts.
+    history = ReadingHistory(history_capacity or reading_history.capacity)
+    since = time.time() - history.capacity / config_store.current.site(LOCAL_SITE).tick_rate
+    for row in reading_log.rows(start=since, site=LOCAL_SITE):
+        history.append(*row)
+    reading_history = producer.history = history
+    producer.log = reading_log
+    return reading_log
+
+
+def load_config(path):
+    # Same shape as a POST /config body, see config.py
+    with open(path) as f:
+        return config_store.update(json.load(f))
+
+
+def load_thresholds(path):
+    # {"default": {...}, "sites": {"pit1": {...}}}, keys as in rule_engine.Thresholds
+    with open(path) as f:
+        thresholds = json.load(f)
+    return config_store.update({
+        "default": {"thresholds": thresholds.get("default") or {}},
+        "sites": {site: {"thresholds": values} for site, values in thresholds.get("sites", {}).items()},
+    })
+
+
+def uplink_snapshot(snapshot):
+    uplink.add(producer.site, snapshot.timestamp, snapshot.reading["moisture"], snapshot.reading["voltage"],
+               snapshot.reading["earthingGood"])
+
+
+def start_uplink(path):
+    # {"url": "https://api.thingspeak.com", "spool": "earthing-uplink",
+    #  "channels": {"local": {"channel": 123456, "key": "WRITE_API_KEY"}}}
+    # plus optional uplink.Uplink settings (resolution, min_interval, ...)
+    global uplink
+    with open(path) as f:
+        settings = json.load(f)
+    settings.setdefault("url", "https://api.thingspeak.com")
+    uplink = Uplink(directory=settings.pop("spool", "earthing-uplink"), **settings).start()
+    producer.listeners.append(uplink_snapshot)
+    return uplink
+
+
+def start_gateway(devices, simulate=0, interval=None):
+    if interval is not None:
+        gateway.interval = interval
+    for spec in devices:
+        site_id, sep, url = spec.partition('=')
+        if not sep:
+            raise ValueError(f"--device expects ID=URL, got {spec!r}")
+        gateway.register(site_id, url)
+    if simulate:
+        raise_fd_limit()
+        simulator = DeviceSimulator(simulate).start()
+        for site_id, url in simulator.urls():
+            gateway.register(site_id, url)
+    if len(gateway):
+        gateway.start()
+
+
+def open_browser(url):
+    # Never on the main thread: webbrowser can stall for seconds probing
+    # for a browser. Skipped where nobody could see the page.
+    if sys.platform.startswith('linux') and not (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY')):
+        return False
+
+    def launch():
+        import webbrowser
+        try:
+            webbrowser.open(url)
+        except Exception:
+            pass        # Best effort; the URL is printed anyway
+
+    threading.Thread(target=launch, name="earthing-browser", daemon=True).start()
+    return True
+
+
+def main(argv=None):
+    # Service entry point: python mock_server.py --no-browser under systemd
+    # or a container. SIGTERM stops it cleanly, flushing the reading log
+    # and the uplink spool.
+    global reading_history, request_metrics, request_profiler
+    args = parse_args(argv)
+    config_store.update({"default": {"tick_rate": args.tick_rate}})
+    if args.config:
+        load_config(args.config)
+    if args.thresholds:
+        load_thresholds(args.thresholds)
+    if args.data_dir:
+        open_reading_log(args.data_dir, args.history)
+    elif args.history != reading_history.capacity:
+        reading_history = producer.history = ReadingHistory(args.history)
+    if args.no_metrics:
+        request_metrics = None
+    if args.profile_every:
+        request_profiler = metrics.SamplingProfiler(args.profile_every)
+    if args.processes:
+        def ready(port):
+            # Runs after the fork: the gateway and device simulator threads
+            # belong to the parent only
+            if args.uplink:
+                start_uplink(args.uplink)
+            start_gateway(args.device, args.simulate, args.poll_interval)
+            print(f"Mock Server running at http://localhost:{port} ({args.processes} worker processes)")
+            if len(gateway):
+                print(f"Gateway polling {len(gateway)} device(s): http://localhost:{port}/sites")
+            print("Press Ctrl+C to stop", flush=True)
+            if not args.no_browser:
+                open_browser(f"http://localhost:{port}")
+
+        try:
+            serve_prefork(args.processes, args.port, args.workers, on_ready=ready)
+        except KeyboardInterrupt:
+            print("\nServer stopped.")
+        finally:
+            if uplink is not None:
+                uplink.close()
+            if reading_log is not None:
+                reading_log.close()
+        return
+    if args.uplink:
+        start_uplink(args.uplink)
+    start_gateway(args.device, args.simulate, args.poll_interval)
+    # Unwind through the finally below so the log and spool are flushed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    with make_server(args.port, args.engine, args.workers) as httpd:
+        port = httpd.server_address[1]    # --port 0 picks a free one
+        print(f"Mock Server running at http://localhost:{port} ({args.engine} engine)")
+        if len(gateway):
+            print(f"Gateway polling {len(gateway)} device(s): http://localhost:{port}/sites")
+        print("Press Ctrl+C to stop", flush=True)
+        if not args.no_browser:
+            open_browser(f"http://localhost:{port}")
         try:
             httpd.serve_forever()
         except KeyboardInterrupt:
             print("\nServer stopped.")
+        finally:
+            if uplink is not None:
+                uplink.close()
+            if reading_log is not None:
+                reading_log.close()
+
+
+if __name__ == "__main__":
+    main()
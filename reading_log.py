@@ -0,0 +1,557 @@
+"""
+Persistent append-only reading log.
+
+Readings are stored as fixed-width 24-byte little-endian records
+
+    timestamp f64 | site u32 | moisture f32 | voltage f32 | status u8 | pad[3]
+
+in numbered segment files under one directory. Writes go through a buffered
+file and are fsynced in batches; a segment is sealed and a new one started
+once it reaches a size or age limit. Site names are mapped to the u32 ids in
+sites.json.
+
+A batch older than what is already written (device backfill) goes to one
+journal, backfill.late, instead of the active segment. Readers see the
+journal sorted in memory. When the active segment rotates, or the journal
+reaches LATE_BYTES, the journal is sorted into a segment of its own, so the
+number of segments grows with the volume of late data, not with the number
+of late batches.
+
+Reads never go through the writer: segments are mmapped and scanned as raw
+memoryviews (struct.iter_unpack, or numpy.frombuffer with RECORD_DTYPE), so
+millions of records can be scanned without building Python objects for the
+ones outside the requested range. Each segment keeps a sparse in-memory
+index of every INDEX_STRIDE-th timestamp, read from the file on open. A
+segment is mapped on its first scan, and at most MAX_MAPS maps are kept.
+"""
+import bisect
+import collections
+import heapq
+import itertools
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from operator import itemgetter
+
+from history import MAX_POINTS, aggregate_columns, bucket_columns, raw_columns
+
+RECORD = struct.Struct('<dIffB3x')
+RECORD_SIZE = RECORD.size
+# Structured dtype for numpy.frombuffer over scan_blocks() output
+RECORD_DTYPE = [('t', '<f8'), ('site', '<u4'), ('moisture', '<f4'),
+                ('voltage', '<f4'), ('status', 'u1'), ('pad', 'V3')]
+
+HEADER = struct.Struct('<4sHHd')    # magic, version, record size, created
+MAGIC = b'ERLG'
+VERSION = 1
+
+SEGMENT_BYTES = 64 * 1024 * 1024    # Rotate at ~2.8M records
+SEGMENT_SECONDS = 86400             # ...or once a segment spans a day
+FSYNC_INTERVAL = 1.0                # Seconds between fsyncs
+FSYNC_BATCH = 4096                  # ...or after this many unsynced records
+INDEX_STRIDE = 4096                 # Records between sparse index entries
+AGGREGATE_ROWS = 1 << 20            # Records reduced per numpy pass in aggregated queries
+LATE_TOLERANCE = 1.0                # Older writes within this are clamped, beyond it go to the journal
+LATE_BYTES = 2 * 1024 * 1024        # Backfill journal size that triggers sorting it into a segment
+MAX_MAPS = 64                       # Segments kept mmapped between scans (each holds a descriptor)
+
+SEGMENT_RE = re.compile(r'^(\d{8})\.seg$')
+PENDING_RE = re.compile(r'^(\d{8})\.late$')  # Journal being sorted into that segment
+BACKFILL_NAME = 'backfill.late'
+
+
+class Segment:
+    def __init__(self, path, number):
+        self.path = path
+        self.number = number
+        self.count = 0
+        self.first_ts = None
+        self.last_ts = None
+        self.index_ts = []          # Timestamp of every INDEX_STRIDE-th record
+        self._map = None
+        self._mapped_count = 0
+
+    def load(self):
+        # Recover state from disk, dropping any torn trailing record
+        self.count = _record_count(self.path)
+        if self.count:
+            # Read through a temporary map; scans map the segment again
+            with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                self.index_ts = [RECORD.unpack_from(m, HEADER.size + i * RECORD_SIZE)[0]
+                                 for i in range(0, self.count, INDEX_STRIDE)]
+                self.last_ts = RECORD.unpack_from(m, HEADER.size + (self.count - 1) * RECORD_SIZE)[0]
+            self.first_ts = self.index_ts[0]
+        return self
+
+    def note_append(self, timestamp):
+        if self.count % INDEX_STRIDE == 0:
+            self.index_ts.append(timestamp)
+        if self.first_ts is None:
+            self.first_ts = timestamp
+        self.last_ts = timestamp
+        self.count += 1
+
+    def view(self, count=None):
+        # memoryview over the first count records (default: all on disk)
+        count = self.count if count is None else count
+        if count == 0:
+            return memoryview(b'')
+        if self._map is None or self._mapped_count < count:
+            # Older maps may still back a reader's view; they are released
+            # when the last view goes away
+            self._map = None
+            with open(self.path, 'rb') as f:
+                self._map = mmap.mmap(f.fileno(), HEADER.size + count * RECORD_SIZE,
+                                      access=mmap.ACCESS_READ)
+            self._mapped_count = count
+        return memoryview(self._map)[HEADER.size:HEADER.size + count * RECORD_SIZE]
+
+    def bisect(self, view, count, t):
+        # First record index with timestamp >= t: the sparse index narrows
+        # the search to one stride, then binary search inside the mmap
+        k = bisect.bisect_left(self.index_ts, t)
+        if k == 0:
+            return 0
+        lo = (k - 1) * INDEX_STRIDE
+        hi = min(count, k * INDEX_STRIDE) if k < len(self.index_ts) else count
+        return _bisect(view, lo, hi, t)
+
+    def close(self):
+        if self._map is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass  # A reader still holds a view; the map goes with it
+            self._map = None
+
+
+class Backfill:
+    # The journal of late batches, in arrival order. Readers get a sorted
+    # copy, rebuilt only after new records arrive.
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self.first_ts = None        # Earliest and latest timestamp held
+        self.last_ts = None
+        self._sorted = memoryview(b'')
+        self._sorted_count = 0
+
+    def load(self):
+        if os.path.exists(self.path):
+            self.count = _record_count(self.path)
+            if self.count:
+                stamps = [record[0] for record in RECORD.iter_unpack(_read_records(self.path, self.count))]
+                self.first_ts, self.last_ts = min(stamps), max(stamps)
+        return self
+
+    def note_append(self, rows):
+        # rows: one batch, sorted by timestamp
+        first, last = rows[0][0], rows[-1][0]
+        self.first_ts = first if self.first_ts is None else min(self.first_ts, first)
+        self.last_ts = last if self.last_ts is None else max(self.last_ts, last)
+        self.count += len(rows)
+
+    def view(self):
+        # All records in time order; the writer must have flushed the journal
+        if self._sorted_count != self.count:
+            self._sorted = memoryview(_sorted_records(self.path, self.count))
+            self._sorted_count = self.count
+        return self._sorted
+
+
+class ReadingLog:
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, segment_seconds=SEGMENT_SECONDS,
+                 fsync_interval=FSYNC_INTERVAL, fsync_batch=FSYNC_BATCH, late_bytes=LATE_BYTES,
+                 max_maps=MAX_MAPS):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.segment_seconds = segment_seconds
+        self.late_bytes = late_bytes
+        self.max_maps = max_maps
+        self.fsync_interval = fsync_interval
+        self.fsync_batch = fsync_batch
+        self.records_written = 0
+        self.fsyncs = 0
+        self._lock = threading.RLock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        self._sites_path = os.path.join(directory, 'sites.json')
+        self.site_ids = {}
+        if os.path.exists(self._sites_path):
+            with open(self._sites_path) as f:
+                self.site_ids = json.load(f)
+        self.site_names = {v: k for k, v in self.site_ids.items()}
+        for name in os.listdir(directory):
+            m = PENDING_RE.match(name)
+            if m:
+                # Interrupted while sorting the journal into a segment
+                pending, path = os.path.join(directory, name), self._segment_path(int(m.group(1)))
+                if os.path.exists(path):
+                    os.unlink(pending)
+                else:
+                    _write_sorted(pending, path)
+        self.segments = [Segment(os.path.join(directory, name), int(m.group(1))).load()
+                         for name in sorted(os.listdir(directory))
+                         for m in [SEGMENT_RE.match(name)] if m]
+        self.backfill = Backfill(os.path.join(directory, BACKFILL_NAME)).load()
+        self._maps = collections.OrderedDict()     # Segment number -> mapped Segment, oldest scan first
+        self._late_file = None
+        self._file = None
+        if self.segments and self.segments[-1].count * RECORD_SIZE < segment_bytes:
+            self._file = open(self.segments[-1].path, 'ab')
+        else:
+            self._new_segment()
+
+    def __len__(self):
+        return sum(seg.count for seg in self.segments) + self.backfill.count
+
+    def site_id(self, name):
+        site = self.site_ids.get(name)
+        if site is None:
+            with self._lock:
+                site = self.site_ids.get(name)
+                if site is None:
+                    site = len(self.site_ids)
+                    self.site_ids = {**self.site_ids, name: site}
+                    self.site_names = {**self.site_names, site: name}
+                    tmp = self._sites_path + '.tmp'
+                    with open(tmp, 'w') as f:
+                        json.dump(self.site_ids, f)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp, self._sites_path)
+        return site
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f'{number:08d}.seg')
+
+    def _new_segment(self):
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+            self._file = None
+        if self.backfill.count:
+            self._compact_backfill()
+        number = self.segments[-1].number + 1 if self.segments else 1
+        path = self._segment_path(number)
+        self._file = open(path, 'ab')
+        self._file.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE, time.time()))
+        self._file.flush()
+        self.segments.append(Segment(path, number))
+
+    def _compact_backfill(self):
+        # Sort the journal into the next segment. It is renamed first, so
+        # a crash part way through is finished on the next open.
+        if self._late_file is not None:
+            self._late_file.close()
+            self._late_file = None
+        number = self.segments[-1].number + 1 if self.segments else 1
+        pending = os.path.join(self.directory, f'{number:08d}.late')
+        os.replace(self.backfill.path, pending)
+        path = self._segment_path(number)
+        _write_sorted(pending, path)
+        self.segments.append(Segment(path, number).load())
+        self.backfill = Backfill(self.backfill.path)
+
+    def _append_late(self, site_id, rows):
+        if self._late_file is None:
+            new = not os.path.exists(self.backfill.path)
+            self._late_file = open(self.backfill.path, 'ab')
+            if new:
+                self._late_file.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE, time.time()))
+        self._late_file.write(b''.join(RECORD.pack(t, site_id, m, v, 1 if s else 0) for t, m, v, s in rows))
+        self.backfill.note_append(rows)
+        if self.backfill.count * RECORD_SIZE >= self.late_bytes:
+            self._new_segment()
+
+    def append(self, timestamp, site, moisture, voltage, earthing_good):
+        self.append_many(site, (timestamp,), (moisture,), (voltage,), (earthing_good,))
+
+    def append_many(self, site, timestamps, moisture, voltage, status):
+        # Appends one site's readings (parallel columns) in a single write
+        if not timestamps:
+            return
+        site_id = self.site_id(site)
+        rows = list(zip(timestamps, moisture, voltage, status))
+        if any(b[0] < a[0] for a, b in zip(rows, rows[1:])):
+            rows.sort(key=itemgetter(0))
+        with self._lock:
+            active = self.segments[-1]
+            late = active.last_ts is not None and active.last_ts - rows[0][0] > LATE_TOLERANCE
+            if late:
+                # Late batch (e.g. a device uploading what it buffered
+                # offline): journal it so every segment stays sorted
+                self._append_late(site_id, rows)
+            else:
+                if active.last_ts is not None and rows[0][0] < active.last_ts:
+                    # Writers race on time.time(); absorb the jitter
+                    last = active.last_ts
+                    rows = [(max(t, last), m, v, s) for t, m, v, s in rows]
+                out = []
+                for t, m, v, s in rows:
+                    if active.count and (active.count * RECORD_SIZE >= self.segment_bytes
+                                         or t - active.first_ts >= self.segment_seconds):
+                        self._file.write(b''.join(out))
+                        out = []
+                        self._new_segment()
+                        active = self.segments[-1]
+                    out.append(RECORD.pack(t, site_id, m, v, 1 if s else 0))
+                    active.note_append(t)
+                self._file.write(b''.join(out))
+            self.records_written += len(rows)
+            self._unsynced += len(rows)
+            if (self._unsynced >= self.fsync_batch
+                    or time.monotonic() - self._last_sync >= self.fsync_interval):
+                self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        if self._late_file is not None:
+            self._late_file.flush()
+        if self._unsynced:
+            os.fsync(self._file.fileno())
+            if self._late_file is not None:
+                os.fsync(self._late_file.fileno())
+            self.fsyncs += 1
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def sync(self):
+        with self._lock:
+            self._sync()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._sync()
+                self._file.close()
+                self._file = None
+            if self._late_file is not None:
+                self._late_file.close()
+                self._late_file = None
+            for seg in self.segments:
+                seg.close()
+            self._maps.clear()
+
+    def _view(self, seg, count):
+        # Maps seg on its first scan; maps beyond max_maps are closed, least
+        # recently scanned first, so open descriptors stay bounded
+        with self._lock:
+            view = seg.view(count)
+            self._maps[seg.number] = seg
+            self._maps.move_to_end(seg.number)
+            while len(self._maps) > self.max_maps:
+                self._maps.popitem(last=False)[1].close()
+        return view
+
+    def scan_blocks(self, start=None, end=None):
+        # Yields memoryviews of raw records with start <= t <= end, one per
+        # segment plus one for the backfill journal. Records are only
+        # parsed for the binary search.
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()      # Make buffered records visible to mmap
+            segments = [(seg, seg.count) for seg in self.segments]
+            late = None
+            if self.backfill.count and not ((start is not None and self.backfill.last_ts < start)
+                                            or (end is not None and self.backfill.first_ts > end)):
+                if self._late_file is not None:
+                    self._late_file.flush()
+                late = self.backfill.view()
+        for seg, count in segments:
+            if not count or (start is not None and seg.last_ts < start) \
+                    or (end is not None and seg.first_ts > end):
+                continue
+            view = self._view(seg, count)
+            lo = seg.bisect(view, count, start) if start is not None else 0
+            hi = seg.bisect(view, count, _after(end)) if end is not None else count
+            if lo < hi:
+                yield view[lo * RECORD_SIZE:hi * RECORD_SIZE]
+        if late is not None:
+            count = len(late) // RECORD_SIZE
+            lo = _bisect(late, 0, count, start) if start is not None else 0
+            hi = _bisect(late, 0, count, _after(end)) if end is not None else count
+            if lo < hi:
+                yield late[lo * RECORD_SIZE:hi * RECORD_SIZE]
+
+    def scan(self, start=None, end=None, site=None, blocks=None):
+        # Yields (timestamp, site_id, moisture, voltage, status) tuples in
+        # time order
+        site_id = None if site is None else self.site_ids.get(site, -1)
+        blocks = list(self.scan_blocks(start, end) if blocks is None else blocks)
+        if _overlapping(blocks):
+            records = heapq.merge(*(RECORD.iter_unpack(b) for b in blocks), key=itemgetter(0))
+        else:
+            records = itertools.chain.from_iterable(RECORD.iter_unpack(b) for b in blocks)
+        if site_id is None:
+            yield from records
+        else:
+            for record in records:
+                if record[1] == site_id:
+                    yield record
+
+    def rows(self, start=None, end=None, site=None, blocks=None):
+        # (timestamp, moisture, voltage, status) rows for history.py helpers
+        for t, _, m, v, s in self.scan(start, end, site, blocks):
+            yield t, m, v, s
+
+    def query(self, start=None, end=None, step=None, site=None, max_points=MAX_POINTS):
+        # Same contract and result shape as ReadingHistory.query
+        blocks = list(self.scan_blocks(start, end))
+        if not blocks:
+            return aggregate_columns((), start, end, step) if step else raw_columns((), start, end)
+        if start is None:
+            start = min(_first_ts(block) for block in blocks)
+        if end is None:
+            end = max(_last_ts(block) for block in blocks)
+        # Upper bound: the range may also hold other sites' records
+        n = sum(len(block) for block in blocks) // RECORD_SIZE
+        if step is None:
+            step = 0 if n <= max_points else (end - start) / max(1, max_points - 1)
+        elif step == 0 and n > max_points:
+            step = (end - start) / max(1, max_points - 1)
+        if step > 0:
+            np = _numpy()
+            if np is not None:
+                site_id = None if site is None else self.site_ids.get(site, -1)
+                return _aggregate_blocks(np, blocks, site_id, start, end, step)
+            return aggregate_columns(self.rows(site=site, blocks=blocks), start, end, step)
+        return raw_columns(self.rows(site=site, blocks=blocks), start, end)
+
+
+_np = None
+
+
+def _numpy():
+    # numpy, imported on the first aggregated query rather than with the
+    # log so starting the server stays cheap; None when not installed
+    global _np
+    if _np is None:
+        try:
+            import numpy
+        except ImportError:  # Optional: pip install numpy
+            numpy = False
+        _np = numpy
+    return _np or None
+
+
+# ufunc per bucket total: count, moisture min/max/sum, voltage min/max/sum, good
+_BUCKET_UFUNCS = ('add', 'minimum', 'maximum', 'add', 'minimum', 'maximum', 'add', 'add')
+
+
+def _aggregate_blocks(np, blocks, site_id, start, end, step):
+    # aggregate_columns() over raw record blocks without building a Python
+    # object per record: every slice of a block is reduced per bucket with
+    # reduceat, then the partial buckets are merged, which also covers
+    # blocks that overlap in time (backfill)
+    ufuncs = [getattr(np, name) for name in _BUCKET_UFUNCS]
+    keys, totals = [], [[] for _ in ufuncs]
+    for block in blocks:
+        records = np.frombuffer(block, dtype=RECORD_DTYPE)
+        for i in range(0, len(records), AGGREGATE_ROWS):
+            chunk = records[i:i + AGGREGATE_ROWS]
+            if site_id is not None:
+                chunk = chunk[chunk['site'] == site_id]
+            if not len(chunk):
+                continue
+            moisture = chunk['moisture'].astype(np.float64)
+            voltage = chunk['voltage'].astype(np.float64)
+            columns = (np.ones(len(chunk), dtype=np.int64), moisture, moisture, moisture,
+                       voltage, voltage, voltage, chunk['status'].astype(np.int64))
+            chunk_keys, reduced = _group(np, np.floor(chunk['t'] / step).astype(np.int64),
+                                         list(zip(columns, ufuncs)))
+            keys.append(chunk_keys)
+            for total, values in zip(totals, reduced):
+                total.append(values)
+    if not keys:
+        return aggregate_columns((), start, end, step)
+    keys, reduced = _group(np, np.concatenate(keys),
+                           [(np.concatenate(total), ufunc) for total, ufunc in zip(totals, ufuncs)])
+    return bucket_columns(start, end, step, [b * step for b in keys.tolist()],
+                          *(values.tolist() for values in reduced))
+
+
+def _group(np, keys, columns):
+    # Reduce each (values, ufunc) column per distinct key with reduceat
+    if np.any(keys[1:] < keys[:-1]):
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        columns = [(values[order], ufunc) for values, ufunc in columns]
+    starts = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+    return keys[starts], [ufunc.reduceat(values, starts) for values, ufunc in columns]
+
+
+def _first_ts(block):
+    return RECORD.unpack_from(block, 0)[0]
+
+
+def _last_ts(block):
+    return RECORD.unpack_from(block, len(block) - RECORD_SIZE)[0]
+
+
+def _overlapping(blocks):
+    # Segments written in order follow each other; backfill overlaps them
+    return any(_first_ts(b) < _last_ts(a) for a, b in zip(blocks, blocks[1:]))
+
+
+def _after(t):
+    # Smallest float greater than t, so bisect(_after(end)) is inclusive
+    return math.nextafter(t, math.inf)
+
+
+def _bisect(view, lo, hi, t):
+    # First record index in [lo, hi) with timestamp >= t
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if RECORD.unpack_from(view, mid * RECORD_SIZE)[0] < t:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+def _record_count(path):
+    # Records in a segment or journal file, dropping any torn trailing record
+    size = os.path.getsize(path)
+    if size < HEADER.size:
+        raise ValueError(f"{path}: truncated header")
+    with open(path, 'rb') as f:
+        magic, version, record_size, _ = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION or record_size != RECORD_SIZE:
+        raise ValueError(f"{path}: not a reading log segment")
+    count = (size - HEADER.size) // RECORD_SIZE
+    if HEADER.size + count * RECORD_SIZE != size:
+        with open(path, 'r+b') as f:
+            f.truncate(HEADER.size + count * RECORD_SIZE)
+    return count
+
+
+def _read_records(path, count):
+    with open(path, 'rb') as f:
+        f.seek(HEADER.size)
+        return f.read(count * RECORD_SIZE)
+
+
+def _sorted_records(path, count):
+    # The first count records of a journal as raw bytes, in time order
+    records = sorted(RECORD.iter_unpack(_read_records(path, count)), key=itemgetter(0))
+    return b''.join(RECORD.pack(*record) for record in records)
+
+
+def _write_sorted(pending, path):
+    # Writes a journal's records, sorted, as a new segment, then removes it
+    data = _sorted_records(pending, _record_count(pending))
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, RECORD_SIZE, time.time()))
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    os.unlink(pending)
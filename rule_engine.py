@@ -0,0 +1,292 @@
+"""
+Streaming earthing fault detector.
+
+Replaces one-shot threshold checks with per-site incremental state that is
+updated in O(1) per sample:
+
+    - EWMA smoothing of moisture and voltage
+    - rolling min/max voltage over the last `window` samples (monotonic deques)
+    - hysteresis: the alarm trips when a smoothed value leaves the
+      earthing_rule band and only clears once it is back inside by a margin
+    - N-of-M debounce: a state change needs `debounce_n` agreeing votes
+      among the last `debounce_m` samples
+
+feed() returns an Event only when a site's state changes, so a single noisy
+sample never flips the alarm. feed_series() only takes samples newer than
+the site's last one, so a store-and-forward upload of old readings is kept
+in the log but cannot rewrite the live alarm state.
+"""
+import collections
+import math
+import threading
+
+from earthing_rule import SOIL_THRESHOLD, VOLT_MAX, VOLT_MIN
+
+UNKNOWN = "UNKNOWN"
+GOOD = "GOOD"
+BAD = "BAD"
+
+MAX_EVENTS = 1000       # Recent state changes kept for /alarms
+
+
+Thresholds = collections.namedtuple("Thresholds", [
+    "soil_threshold",       # Minimum moisture percent
+    "volt_min",
+    "volt_max",
+    "moisture_hysteresis",  # Percent above soil_threshold needed to clear
+    "voltage_hysteresis",   # Volts inside [volt_min, volt_max] needed to clear
+    # EWMA weight of the newest sample. 1 disables smoothing; lower values
+    # calm continuous sensor jitter but stretch a spike over several samples,
+    # which the debounce then counts as several votes
+    "alpha",
+    "debounce_n",
+    "debounce_m",
+    "window",               # Samples in the rolling min/max
+], defaults=[SOIL_THRESHOLD, VOLT_MIN, VOLT_MAX, 2.0, 0.005, 1.0, 3, 5, 60])
+
+DEFAULT_THRESHOLDS = Thresholds()
+
+
+def make_thresholds(values=None, base=DEFAULT_THRESHOLDS):
+    # Validated Thresholds from a (partial) dict, e.g. parsed JSON config
+    fields = base._asdict()
+    for key, value in (values or {}).items():
+        if key not in fields:
+            raise ValueError(f"unknown threshold {key!r}")
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+            raise ValueError(f"{key} must be a number")
+        fields[key] = value
+    t = Thresholds(**fields)
+    if t.volt_min >= t.volt_max:
+        raise ValueError("volt_min must be below volt_max")
+    if t.moisture_hysteresis < 0 or t.voltage_hysteresis < 0:
+        raise ValueError("hysteresis must be >= 0")
+    if 2 * t.voltage_hysteresis >= t.volt_max - t.volt_min:
+        raise ValueError("voltage_hysteresis leaves no clear band")
+    if not 0 < t.alpha <= 1:
+        raise ValueError("alpha must be in (0, 1]")
+    if int(t.debounce_m) != t.debounce_m or not 1 <= t.debounce_m <= 64:
+        raise ValueError("debounce_m must be an integer 1..64")
+    if int(t.debounce_n) != t.debounce_n or not 1 <= t.debounce_n <= t.debounce_m:
+        raise ValueError("debounce_n must be an integer 1..debounce_m")
+    if int(t.window) != t.window or t.window < 1:
+        raise ValueError("window must be a positive integer")
+    return t._replace(debounce_n=int(t.debounce_n), debounce_m=int(t.debounce_m), window=int(t.window))
+
+
+def check(thresholds, moisture, voltage):
+    # Per-sample (soil_good, volt_good) against a site's plain band
+    return (moisture >= thresholds.soil_threshold,
+            thresholds.volt_min <= voltage <= thresholds.volt_max)
+
+
+Event = collections.namedtuple("Event", [
+    "site", "timestamp", "previous", "state", "reason", "moisture", "voltage",
+])
+
+
+class SiteDetector:
+    __slots__ = ("site", "thresholds", "state", "since", "samples", "last", "moisture", "voltage",
+                 "v_min", "v_max", "reason", "_votes", "_vote_count", "_filled",
+                 "_min_q", "_max_q")
+
+    def __init__(self, site, thresholds=DEFAULT_THRESHOLDS):
+        self.site = site
+        self.thresholds = thresholds
+        self.state = UNKNOWN
+        self.since = None
+        self.samples = 0
+        self.last = None            # Timestamp of the newest sample fed
+        self.moisture = None        # EWMA
+        self.voltage = None         # EWMA
+        self.v_min = None           # Rolling raw voltage min/max
+        self.v_max = None
+        self.reason = None
+        self._votes = 0             # Bit i set = sample i back voted BAD
+        self._vote_count = 0        # popcount of _votes
+        self._filled = 0            # Samples in the vote window so far
+        self._min_q = collections.deque()   # (index, value) increasing
+        self._max_q = collections.deque()   # (index, value) decreasing
+
+    def _fault(self, moisture, voltage):
+        # Reason the smoothed sample counts as BAD for the current state, or None
+        th = self.thresholds
+        # Entering BAD uses the plain band; leaving it needs the margin
+        margin_m = th.moisture_hysteresis if self.state == BAD else 0.0
+        margin_v = th.voltage_hysteresis if self.state == BAD else 0.0
+        if moisture < th.soil_threshold + margin_m:
+            return "dry soil"
+        if voltage < th.volt_min + margin_v:
+            return "voltage low"
+        if voltage > th.volt_max - margin_v:
+            return "voltage high"
+        return None
+
+    def _track_extremes(self, voltage):
+        n, window = self.samples, self.thresholds.window
+        min_q, max_q = self._min_q, self._max_q
+        while min_q and min_q[-1][1] >= voltage:
+            min_q.pop()
+        min_q.append((n, voltage))
+        while max_q and max_q[-1][1] <= voltage:
+            max_q.pop()
+        max_q.append((n, voltage))
+        if min_q[0][0] <= n - window:
+            min_q.popleft()
+        if max_q[0][0] <= n - window:
+            max_q.popleft()
+        self.v_min, self.v_max = min_q[0][1], max_q[0][1]
+
+    def feed(self, timestamp, moisture, voltage):
+        if not (math.isfinite(moisture) and math.isfinite(voltage)):
+            # A NaN would stick in the EWMA and fail every comparison in
+            # _fault, leaving the site GOOD for good; drop the sample
+            return None
+        th = self.thresholds
+        if self.moisture is None:
+            self.moisture, self.voltage = moisture, voltage
+        else:
+            self.moisture += th.alpha * (moisture - self.moisture)
+            self.voltage += th.alpha * (voltage - self.voltage)
+        self._track_extremes(voltage)
+        self.samples += 1
+        self.last = timestamp
+
+        fault = self._fault(self.moisture, self.voltage)
+        m = th.debounce_m
+        outgoing = (self._votes >> (m - 1)) & 1 if self._filled == m else 0
+        self._votes = ((self._votes << 1) | (fault is not None)) & ((1 << m) - 1)
+        self._vote_count += (fault is not None) - outgoing
+        self._filled = min(m, self._filled + 1)
+        bad_votes = self._vote_count
+        good_votes = self._filled - bad_votes
+
+        if self.state != BAD and bad_votes >= th.debounce_n:
+            new_state = BAD
+        elif self.state != GOOD and good_votes >= th.debounce_n:
+            new_state = GOOD
+        else:
+            if fault is not None and self.state == BAD:
+                self.reason = fault
+            return None
+        previous = self.state
+        self.state = new_state
+        self.since = timestamp
+        self.reason = fault if new_state == BAD else None
+        # Start the new state with a window that agrees with it, so the next
+        # change needs debounce_n fresh contrary samples
+        self._votes = (1 << m) - 1 if new_state == BAD else 0
+        self._vote_count = m if new_state == BAD else 0
+        self._filled = m
+        return Event(self.site, timestamp, previous, new_state, self.reason,
+                     round(self.moisture, 2), round(self.voltage, 4))
+
+    def snapshot(self):
+        return {
+            "site": self.site,
+            "state": self.state,
+            "since": self.since,
+            "reason": self.reason,
+            "samples": self.samples,
+            "moisture": None if self.moisture is None else round(self.moisture, 2),
+            "voltage": None if self.voltage is None else round(self.voltage, 4),
+            "voltageMin": self.v_min,
+            "voltageMax": self.v_max,
+        }
+
+
+class RuleEngine:
+    def __init__(self, thresholds=DEFAULT_THRESHOLDS, max_events=MAX_EVENTS):
+        self.default_thresholds = thresholds
+        self.site_thresholds = {}
+        self.detectors = {}
+        self.events = collections.deque(maxlen=max_events)
+        self.listeners = []         # callable(event) for every state change
+        self.stale = 0              # feed_series samples older than their site's last one
+        self._lock = threading.Lock()
+
+    def thresholds_for(self, site):
+        return self.site_thresholds.get(site, self.default_thresholds)
+
+    def set_thresholds(self, thresholds, site=None):
+        # Applies to new samples; detector state (EWMA, votes) is kept
+        with self._lock:
+            if site is None:
+                self.default_thresholds = thresholds
+            else:
+                self.site_thresholds = {**self.site_thresholds, site: thresholds}
+            self._refresh()
+
+    def configure(self, default, site_thresholds):
+        # Replace every threshold set in one pass, e.g. from a config snapshot
+        with self._lock:
+            self.default_thresholds = default
+            self.site_thresholds = dict(site_thresholds)
+            self._refresh()
+
+    def _refresh(self):
+        for name, detector in self.detectors.items():
+            detector.thresholds = self.thresholds_for(name)
+            # The vote ring and min/max window are sized by thresholds
+            detector._filled = min(detector._filled, detector.thresholds.debounce_m)
+            detector._votes &= (1 << detector.thresholds.debounce_m) - 1
+            detector._vote_count = bin(detector._votes).count("1")
+
+    def _detector(self, site):
+        detector = self.detectors.get(site)
+        if detector is None:
+            with self._lock:
+                detector = self.detectors.setdefault(site, SiteDetector(site, self.thresholds_for(site)))
+        return detector
+
+    def _emit(self, event):
+        self.events.append(event)
+        for listener in self.listeners:
+            listener(event)
+
+    def feed(self, site, timestamp, moisture, voltage):
+        event = self._detector(site).feed(timestamp, moisture, voltage)
+        if event is not None:
+            self._emit(event)
+        return event
+
+    def feed_series(self, site, timestamps, moisture, voltage):
+        # One site's readings in time order, e.g. a batched upload. Samples
+        # not newer than the site's last one (backfill) are skipped.
+        detector = self._detector(site)
+        feed = detector.feed
+        events = []
+        for t, m, v in zip(timestamps, moisture, voltage):
+            if detector.last is not None and t <= detector.last:
+                self.stale += 1
+                continue
+            event = feed(t, m, v)
+            if event is not None:
+                self._emit(event)
+                events.append(event)
+        return events
+
+    def feed_many(self, samples):
+        # samples: iterable of (site, timestamp, moisture, voltage), e.g. one
+        # gateway round. Returns the state changes it caused.
+        events = []
+        for site, timestamp, moisture, voltage in samples:
+            event = self.feed(site, timestamp, moisture, voltage)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def state(self, site):
+        detector = self.detectors.get(site)
+        return detector.state if detector is not None else UNKNOWN
+
+    def snapshot(self, recent=50):
+        detectors = list(self.detectors.values())
+        return {
+            "sites": [d.snapshot() for d in detectors],
+            "summary": {
+                "total": len(detectors),
+                "bad": sum(1 for d in detectors if d.state == BAD),
+            },
+            "events": [e._asdict() for e in list(self.events)[-recent:]],
+        }
@@ -0,0 +1,280 @@
+"""
+Seeded, vectorized scenario generator for load and fault-injection runs.
+
+Generates readings for many virtual sites at once with NumPy, one time
+chunk at a time, so a day of 1 Hz readings for thousands of sites never
+has to fit in memory. Everything is drawn from one seeded Generator, so
+the same seed and chunk size reproduce a run exactly:
+
+    drift       per-site random walk plus a linear trend on both channels
+    diurnal     daily moisture cycle with a per-site phase
+    spikes      isolated single-sample voltage excursions
+    dropouts    runs of missing samples (device offline)
+    faults      a fraction of sites slowly dries out or sags in voltage
+
+Each chunk also carries the ground truth: the signal without noise and
+spikes, checked against the earthing rule. Alerting can then be scored for
+missed faults, false alarms and detection delay.
+
+stream() posts the chunks to a server's POST /ingest as binary frames,
+paced at `speed` times real time (0 = as fast as the server accepts):
+
+    python scenario.py --url http://localhost:8000 --sites 200 --duration 86400 --speed 1000
+"""
+import argparse
+import http.client
+import math
+import time
+from urllib.parse import urlparse
+
+try:
+    import numpy as np
+except ImportError:  # Optional: pip install numpy
+    np = None
+
+import ingest_protocol
+from earthing_rule import is_earthing_good
+
+DAY = 86400.0
+MAX_POST_BYTES = 4 * 1024 * 1024    # Stay well under the server's MAX_BODY
+
+# Structured record matching ingest_protocol.RECORD ('<dHBB')
+RECORD_DTYPE = [('t', '<f8'), ('voltage_mv', '<u2'), ('moisture', 'u1'), ('flags', 'u1')]
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("the scenario simulator needs numpy (pip install numpy)")
+
+
+class Chunk:
+    # One time slice for every site. Columns are (sites, samples) arrays;
+    # present is False where the device was offline.
+    __slots__ = ("timestamps", "moisture", "voltage", "present", "fault")
+
+    def __init__(self, timestamps, moisture, voltage, present, fault):
+        self.timestamps = timestamps
+        self.moisture = moisture
+        self.voltage = voltage
+        self.present = present
+        self.fault = fault          # Ground truth: clean signal fails the rule
+
+    @property
+    def readings(self):
+        return int(self.present.sum())
+
+
+class Scenario:
+    def __init__(self, sites=100, duration=3600.0, step=1.0, seed=0, start=None, chunk=600,
+                 moisture_drift=0.02, voltage_drift=0.00005, diurnal=8.0,
+                 spike_rate=0.001, dropout_rate=0.0002, dropout_mean=120,
+                 fault_fraction=0.1, fault_ramp=1800.0, site_prefix="sim", thresholds=None):
+        _require_numpy()
+        if sites < 1 or duration <= 0 or step <= 0 or chunk < 1:
+            raise ValueError("sites, duration, step and chunk must be positive")
+        self.sites = sites
+        self.duration = float(duration)
+        self.step = float(step)
+        self.samples = int(math.ceil(self.duration / self.step))
+        self.seed = seed
+        self.start = time.time() - self.duration if start is None else float(start)
+        self.chunk = chunk
+        self.moisture_drift = moisture_drift    # Random-walk sd per sqrt(second)
+        self.voltage_drift = voltage_drift
+        self.diurnal = diurnal                  # Moisture amplitude, percent
+        self.spike_rate = spike_rate            # Per sample
+        self.dropout_rate = dropout_rate        # Outage starts per sample
+        self.dropout_mean = dropout_mean        # Mean outage length, samples
+        self.fault_fraction = fault_fraction
+        self.fault_ramp = fault_ramp            # Seconds from healthy to fully faulted
+        self.site_ids = [f"{site_prefix}{i:04d}" for i in range(sites)]
+        self.thresholds = thresholds            # rule_engine.Thresholds; None = earthing_rule band
+
+        # Per-site constants, drawn once
+        rng = np.random.default_rng(seed)
+        self._base_moisture = rng.uniform(35, 60, sites)
+        self._base_voltage = rng.normal(2.58, 0.004, sites)
+        self._moisture_trend = rng.normal(0, 2.0 / DAY, sites)      # ~2 %/day
+        self._voltage_trend = rng.normal(0, 0.005 / DAY, sites)
+        self._phase = rng.uniform(0, 2 * np.pi, sites)
+        faulty = rng.random(sites) < fault_fraction
+        self.fault_sites = np.flatnonzero(faulty)
+        # Dry soil or voltage sag, starting somewhere in the middle of the run
+        self._fault_kind = rng.integers(0, 2, sites)
+        self._fault_start = np.where(faulty, rng.uniform(0.2, 0.6, sites) * self.duration, np.inf)
+
+    def __len__(self):
+        return self.samples
+
+    def chunks(self):
+        # Restartable: every call replays the same series from the seed
+        rng = np.random.default_rng([self.seed, 1])
+        sites, step = self.sites, self.step
+        walk_m = np.zeros(sites)
+        walk_v = np.zeros(sites)
+        down_left = np.zeros(sites, dtype=np.int64)     # Outage samples carried over
+        for offset in range(0, self.samples, self.chunk):
+            n = min(self.chunk, self.samples - offset)
+            t = (offset + np.arange(n)) * step          # Seconds since start
+
+            # Drift: random walks continue from the previous chunk
+            steps_m = rng.normal(0, self.moisture_drift * math.sqrt(step), (sites, n))
+            steps_v = rng.normal(0, self.voltage_drift * math.sqrt(step), (sites, n))
+            path_m = walk_m[:, None] + np.cumsum(steps_m, axis=1)
+            path_v = walk_v[:, None] + np.cumsum(steps_v, axis=1)
+            walk_m, walk_v = path_m[:, -1], path_v[:, -1]
+
+            moisture = (self._base_moisture[:, None] + self._moisture_trend[:, None] * t + path_m
+                        + self.diurnal * np.sin(2 * np.pi * t / DAY + self._phase[:, None]))
+            voltage = self._base_voltage[:, None] + self._voltage_trend[:, None] * t + path_v
+
+            # Gradual faults: ramp from 0 to 1 over fault_ramp seconds
+            ramp = np.clip((t - self._fault_start[:, None]) / self.fault_ramp, 0.0, 1.0)
+            dry = self._fault_kind[:, None] == 0
+            moisture = np.where(dry, moisture + ramp * (10.0 - moisture), moisture)
+            voltage = np.where(dry, voltage, voltage - ramp * 0.3)
+
+            moisture = np.clip(moisture, 0, 100)
+            fault = ~is_earthing_good(moisture, voltage, self.thresholds)
+
+            # Sensor noise and spikes do not count towards the ground truth
+            moisture = np.clip(moisture + rng.normal(0, 1.0, (sites, n)), 0, 100)
+            voltage = voltage + rng.normal(0, 0.004, (sites, n))
+            rows, cols = np.nonzero(rng.random((sites, n)) < self.spike_rate)
+            voltage[rows, cols] += rng.choice([-1.0, 1.0], len(rows)) * rng.uniform(0.2, 1.0, len(rows))
+            voltage = np.maximum(voltage, 0.0)
+
+            present, down_left = self._dropouts(rng, n, down_left)
+            yield Chunk(self.start + t, moisture.astype(np.float32), voltage.astype(np.float32),
+                        present, fault)
+
+    def _dropouts(self, rng, n, down_left):
+        # Outages as +1/-1 edges in a difference array, so any number of
+        # overlapping runs costs one cumsum
+        sites = self.sites
+        edges = np.zeros((sites, n + 1), dtype=np.int32)
+        carried = np.minimum(down_left, n)
+        edges[:, 0] += carried > 0
+        edges[np.arange(sites), carried] -= carried > 0
+        rows, cols = np.nonzero(rng.random((sites, n)) < self.dropout_rate)
+        lengths = rng.geometric(1.0 / self.dropout_mean, len(rows))
+        ends = cols + lengths
+        np.add.at(edges, (rows, cols), 1)
+        np.add.at(edges, (rows, np.minimum(ends, n)), -1)
+        down_left = np.maximum(down_left - n, 0)
+        np.maximum.at(down_left, rows, ends - n)
+        present = np.cumsum(edges[:, :n], axis=1) == 0
+        return present, down_left
+
+    def frames(self, chunk, max_bytes=MAX_POST_BYTES):
+        # ingest_protocol bodies for one chunk, each at most ~max_bytes
+        records = np.empty(chunk.moisture.shape, dtype=RECORD_DTYPE)
+        records['t'] = chunk.timestamps
+        moisture = np.rint(chunk.moisture)
+        voltage_mv = np.rint(np.minimum(chunk.voltage, 65.535) * 1000)
+        records['moisture'] = moisture
+        records['voltage_mv'] = voltage_mv
+        # The device's own per-sample decision, as the firmware would send it
+        records['flags'] = is_earthing_good(moisture, voltage_mv / 1000, self.thresholds) * ingest_protocol.FLAG_GOOD
+        body, size = [], 0
+        for i, site in enumerate(self.site_ids):
+            rows = records[i][chunk.present[i]]
+            if not len(rows):
+                continue
+            site_bytes = site.encode('ascii')
+            header = ingest_protocol.HEADER.pack(ingest_protocol.MAGIC, ingest_protocol.VERSION,
+                                                 len(site_bytes), 0, len(rows))
+            payload = rows.tobytes()
+            frame_len = len(header) + len(site_bytes) + len(payload)
+            if body and size + frame_len > max_bytes:
+                yield b''.join(body)
+                body, size = [], 0
+            body += [ingest_protocol.LENGTH.pack(frame_len), header, site_bytes, payload]
+            size += ingest_protocol.LENGTH.size + frame_len
+        if body:
+            yield b''.join(body)
+
+
+class StreamStats:
+    __slots__ = ("readings", "bytes", "posts", "chunks", "elapsed", "max_lag")
+
+    def __init__(self):
+        self.readings = 0
+        self.bytes = 0
+        self.posts = 0
+        self.chunks = 0
+        self.elapsed = 0.0
+        self.max_lag = 0.0          # Worst wall-clock lag behind the schedule
+
+
+def stream(scenario, url, speed=0.0, on_chunk=None, max_bytes=MAX_POST_BYTES):
+    # Posts every chunk to url/ingest. A chunk is due once speed * elapsed
+    # wall time reaches its simulated start; speed=0 sends back to back.
+    # on_chunk(chunk) runs before each chunk is sent (e.g. to score alerts).
+    target = urlparse(url)
+    conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=60)
+    path = target.path.rstrip('/') + '/ingest'
+    stats = StreamStats()
+    started = time.monotonic()
+    try:
+        for chunk in scenario.chunks():
+            if speed > 0:
+                due = started + (chunk.timestamps[0] - scenario.start) / speed
+                delay = due - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    stats.max_lag = max(stats.max_lag, -delay)
+            if on_chunk is not None:
+                on_chunk(chunk)
+            for body in scenario.frames(chunk, max_bytes):
+                conn.request('POST', path, body, {'Content-Type': 'application/octet-stream'})
+                response = conn.getresponse()
+                detail = response.read()
+                if response.status != 200:
+                    raise RuntimeError(f"POST {path}: {response.status} {detail[:200]!r}")
+                stats.bytes += len(body)
+                stats.posts += 1
+            stats.readings += chunk.readings
+            stats.chunks += 1
+    finally:
+        conn.close()
+        stats.elapsed = time.monotonic() - started
+    return stats
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000",
+                        help="server to stream into (needs --data-dir for /ingest)")
+    parser.add_argument("--sites", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=3600.0, help="simulated seconds")
+    parser.add_argument("--step", type=float, default=1.0, help="seconds between readings")
+    parser.add_argument("--speed", type=float, default=1000.0,
+                        help="times real time (0 = as fast as possible)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--chunk", type=int, default=600, help="samples per site per chunk")
+    parser.add_argument("--fault-fraction", type=float, default=0.1)
+    parser.add_argument("--spike-rate", type=float, default=0.001)
+    parser.add_argument("--dropout-rate", type=float, default=0.0002)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    # End the series at about "now" when the run finishes, so /ingest's
+    # clock-skew check accepts every chunk at any speed
+    lead = args.duration * (1 - 1 / args.speed) if args.speed > 0 else args.duration
+    scenario = Scenario(args.sites, args.duration, args.step, args.seed, start=time.time() - lead,
+                        chunk=args.chunk, fault_fraction=args.fault_fraction,
+                        spike_rate=args.spike_rate, dropout_rate=args.dropout_rate)
+    print(f"Streaming {args.sites} sites x {len(scenario)} samples "
+          f"({len(scenario.fault_sites)} with faults) to {args.url} at {args.speed or 'max'}x")
+    stats = stream(scenario, args.url, args.speed)
+    print(f"{stats.readings} readings in {stats.posts} posts, {stats.bytes / 1e6:.1f} MB, "
+          f"{stats.elapsed:.1f} s ({stats.readings / max(stats.elapsed, 1e-9):.0f} readings/s), "
+          f"max lag {stats.max_lag:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+Latest-reading table in shared memory for pre-forked workers.
+
+One writer process (the producer / gateway parent) publishes each site's
+pre-serialized /data payload into a fixed-size slot. Worker processes map
+the same segment and read it without locks or IPC round trips. Every slot
+and the config blob is guarded by a seqlock. The writer makes the sequence
+odd, writes, then makes it even again. A reader retries if it saw an odd
+sequence, or if the sequence changed while it copied the payload.
+
+Layout (little-endian):
+
+    header  magic b'ERTB' | version u16 | pad u16 | slots u32 | slot_size u32 |
+            blob_size u32 | allocated u32
+    slot    seq u64 | length u32 | name_len u8 | pad[3] | name[64] | payload[slot_size]
+    blob    seq u64 | length u32 | pad[4] | data[blob_size]
+
+The blob carries the current config payload. A length of 0 means "no
+data"; readers fall back to asking the parent process. They do the same
+for sites that got no slot (the table is full, or the name is longer than
+NAME_SIZE) and for a slot that stayed busy through every read retry.
+"""
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+HEADER = struct.Struct('<4sHHIIII')
+SLOT_HEADER = struct.Struct('<QIB3x64s')
+BLOB_HEADER = struct.Struct('<QI4x')
+SEQ = struct.Struct('<Q')
+MAGIC = b'ERTB'
+VERSION = 1
+NAME_SIZE = 64
+
+DEFAULT_SLOTS = 4096
+DEFAULT_SLOT_SIZE = 1024        # A /data payload is ~130 bytes
+DEFAULT_BLOB_SIZE = 256 * 1024
+READ_RETRIES = 1000
+READ_SPINS = 16                 # Retries before each further one yields the CPU
+
+
+class SharedTable:
+    def __init__(self, name=None, slots=DEFAULT_SLOTS, slot_size=DEFAULT_SLOT_SIZE,
+                 blob_size=DEFAULT_BLOB_SIZE):
+        # name=None creates a new segment; otherwise attaches to an existing one
+        if name is None:
+            self.stride = SLOT_HEADER.size + slot_size
+            size = HEADER.size + slots * self.stride + BLOB_HEADER.size + blob_size
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            HEADER.pack_into(self.shm.buf, 0, MAGIC, VERSION, 0, slots, slot_size, blob_size, 0)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            magic, version, _, slots, slot_size, blob_size, _ = HEADER.unpack_from(self.shm.buf)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{name} is not a version {VERSION} reading table")
+            self.stride = SLOT_HEADER.size + slot_size
+            self.owner = False
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        self.slots = slots
+        self.slot_size = slot_size
+        self.blob_size = blob_size
+        self.blob_offset = HEADER.size + slots * self.stride
+        self.index = {}             # site -> slot; the writer's is authoritative
+        self.writes = 0
+        self.oversize = 0
+        self.unslotted = 0          # Writes dropped for sites without a slot
+        self._lock = threading.Lock()   # Writer threads only; readers never take it
+
+    def _allocated(self):
+        return HEADER.unpack_from(self.buf)[6]
+
+    def _slot(self, site):
+        # Writer side: find or allocate the slot for site, None if it cannot
+        # have one
+        slot = self.index.get(site)
+        if slot is not None:
+            return slot
+        name = site.encode('utf-8')
+        slot = len(self.index)
+        if len(name) > NAME_SIZE or slot >= self.slots:
+            return None
+        SLOT_HEADER.pack_into(self.buf, HEADER.size + slot * self.stride, 0, 0, len(name), name)
+        self.index = {**self.index, site: slot}
+        # Publish the new slot count last, once the name is in place
+        struct.pack_into('<I', self.buf, HEADER.size - 4, slot + 1)
+        return slot
+
+    def _write(self, offset, header_size, capacity, payload):
+        if len(payload) > capacity:
+            self.oversize += 1
+            payload = b''           # Readers fall back to the parent
+        seq = SEQ.unpack_from(self.buf, offset)[0]
+        SEQ.pack_into(self.buf, offset, seq + 1)
+        start = offset + header_size
+        self.buf[start:start + len(payload)] = payload
+        struct.pack_into('<I', self.buf, offset + 8, len(payload))
+        SEQ.pack_into(self.buf, offset, seq + 2)
+        self.writes += 1
+
+    def write(self, site, payload):
+        # Never raises for a site that does not fit: that one site is left
+        # out and readers ask the parent for it
+        with self._lock:
+            slot = self._slot(site)
+            if slot is None:
+                self.unslotted += 1
+                return
+            self._write(HEADER.size + slot * self.stride, SLOT_HEADER.size, self.slot_size, payload)
+
+    def write_blob(self, payload):
+        with self._lock:
+            self._write(self.blob_offset, BLOB_HEADER.size, self.blob_size, payload)
+
+    def _read(self, offset, header_size):
+        # (seq, payload) with a consistent payload, (seq, None) if the slot
+        # is empty, or (0, None) if the writer kept it busy throughout
+        buf = self.buf
+        for attempt in range(READ_RETRIES):
+            if attempt >= READ_SPINS:
+                time.sleep(0)       # Let the writer finish
+            seq = SEQ.unpack_from(buf, offset)[0]
+            if seq & 1:
+                continue
+            length = struct.unpack_from('<I', buf, offset + 8)[0]
+            start = offset + header_size
+            payload = bytes(buf[start:start + length])
+            if SEQ.unpack_from(buf, offset)[0] == seq:
+                return seq, (payload or None)
+        return 0, None
+
+    def lookup(self, site):
+        # Reader side: slot for site, rescanning names the writer added since
+        slot = self.index.get(site)
+        if slot is not None:
+            return slot
+        allocated = self._allocated()
+        if allocated > len(self.index):
+            index = dict(self.index)
+            for slot in range(len(index), allocated):
+                _, _, name_len, name = SLOT_HEADER.unpack_from(self.buf, HEADER.size + slot * self.stride)
+                index[name[:name_len].decode('utf-8')] = slot
+            self.index = index
+        return self.index.get(site)
+
+    def read(self, site):
+        # Latest payload for site as (seq, bytes), or (0, None) if unknown
+        slot = self.lookup(site)
+        if slot is None:
+            return 0, None
+        return self._read(HEADER.size + slot * self.stride, SLOT_HEADER.size)
+
+    def seq(self, site):
+        # Cheap change check: no payload copy
+        slot = self.lookup(site)
+        return 0 if slot is None else SEQ.unpack_from(self.buf, HEADER.size + slot * self.stride)[0]
+
+    def read_blob(self):
+        return self._read(self.blob_offset, BLOB_HEADER.size)
+
+    def blob_seq(self):
+        return SEQ.unpack_from(self.buf, self.blob_offset)[0]
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,148 @@
+"""
+Vectorized signal-quality analysis of raw ZMPT101B sample blocks.
+
+readACVoltage() in the firmware squares and averages 500 raw ADC samples
+into one RMS figure. Devices can instead upload the raw blocks, and this
+module reduces a whole batch at once with NumPy:
+
+    voltage      firmware-compatible RMS (same scaling and VOLTAGE_CAL)
+    acRms        RMS with the measured DC offset removed
+    peak         largest excursion from the DC offset
+    crest        peak / acRms (1.414 for a clean sine)
+    frequency    from interpolated rising zero crossings
+    dcOffset     mean ADC level relative to mid-scale, in volts
+
+Wire format (little-endian), parsed zero-copy with numpy.frombuffer:
+
+    header   magic b'ZMPT' | version u8 | pad u8 | blocks u16 | samples u16 | sample_rate f32 | pad[2]
+    meta     blocks x (timestamp f64 | moisture f32)
+    samples  blocks x samples x u16 raw 12-bit ADC counts
+"""
+import struct
+
+try:
+    import numpy as np
+except ImportError:  # Optional: pip install numpy
+    np = None
+
+from earthing_rule import is_earthing_good
+
+HEADER = struct.Struct('<4sBxHHf2x')
+MAGIC = b'ZMPT'
+VERSION = 1
+META_SIZE = 12
+
+ADC_MIDPOINT = 2048
+ADC_VOLTS = 3.3 / 4095.0
+VOLTAGE_CAL = 0.230             # Matches VOLTAGE_CAL in the firmware
+SCALE = VOLTAGE_CAL * 100       # ADC volts -> reported voltage
+DEFAULT_SAMPLE_RATE = 4800.0    # 500 samples with delayMicroseconds(200) + analogRead
+MAX_BLOCKS = 65535
+
+
+class FormatError(ValueError):
+    pass
+
+
+def _require_numpy():
+    if np is None:
+        raise RuntimeError("signal quality analysis needs numpy (pip install numpy)")
+
+
+def encode_blocks(samples, moisture, timestamps, sample_rate=DEFAULT_SAMPLE_RATE):
+    # samples: (blocks, n) array-like of raw ADC counts
+    _require_numpy()
+    samples = np.ascontiguousarray(samples, dtype='<u2')
+    blocks, n = samples.shape
+    meta = np.empty(blocks, dtype=[('t', '<f8'), ('moisture', '<f4')])
+    meta['t'] = timestamps
+    meta['moisture'] = moisture
+    return HEADER.pack(MAGIC, VERSION, blocks, n, sample_rate) + meta.tobytes() + samples.tobytes()
+
+
+def decode_blocks(buf):
+    # Returns (timestamps, moisture, samples, sample_rate) as views on buf
+    _require_numpy()
+    if len(buf) < HEADER.size:
+        raise FormatError("truncated header")
+    magic, version, blocks, n, sample_rate = HEADER.unpack_from(buf)
+    if magic != MAGIC:
+        raise FormatError("bad magic")
+    if version != VERSION:
+        raise FormatError(f"unsupported version {version}")
+    if n < 2 or not sample_rate > 0:
+        raise FormatError("need at least 2 samples per block and a positive sample rate")
+    expected = HEADER.size + blocks * (META_SIZE + 2 * n)
+    if len(buf) != expected:
+        raise FormatError(f"expected {expected} bytes, got {len(buf)}")
+    meta = np.frombuffer(buf, dtype=[('t', '<f8'), ('moisture', '<f4')], count=blocks, offset=HEADER.size)
+    samples = np.frombuffer(buf, dtype='<u2', count=blocks * n,
+                            offset=HEADER.size + blocks * META_SIZE).reshape(blocks, n)
+    return meta['t'], meta['moisture'], samples, sample_rate
+
+
+def analyze(samples, sample_rate=DEFAULT_SAMPLE_RATE):
+    # samples: (blocks, n) raw ADC counts. Returns a dict of (blocks,) arrays.
+    _require_numpy()
+    x = (np.asarray(samples, dtype=np.float32) - ADC_MIDPOINT) * np.float32(ADC_VOLTS)
+    n = x.shape[1]
+    dc = x.mean(axis=1)
+    mean_sq = np.einsum('ij,ij->i', x, x) / n
+    # Firmware figure: RMS around the fixed mid-scale, no DC removal
+    voltage = np.sqrt(mean_sq) * SCALE
+    ac = x - dc[:, None]
+    ac_rms = np.sqrt(np.maximum(mean_sq - dc * dc, 0.0)) * SCALE
+    peak = np.abs(ac).max(axis=1) * SCALE
+    with np.errstate(divide='ignore', invalid='ignore'):
+        crest = np.where(ac_rms > 0, peak / ac_rms, 0.0)
+    frequency = _frequency(ac, sample_rate)
+    return {
+        "voltage": voltage,
+        "acRms": ac_rms,
+        "peak": peak,
+        "crest": crest,
+        "frequency": frequency,
+        "dcOffset": dc,
+    }
+
+
+def _frequency(ac, sample_rate):
+    # Rising zero crossings located to sub-sample precision by linear
+    # interpolation; frequency = (crossings - 1) / time between first and last
+    below = ac[:, :-1] < 0
+    rising = below & (ac[:, 1:] >= 0)
+    count = rising.sum(axis=1)
+    rows = np.arange(ac.shape[0])
+    first = rising.argmax(axis=1)
+    last = rising.shape[1] - 1 - rising[:, ::-1].argmax(axis=1)
+
+    def position(i):
+        a, b = ac[rows, i], ac[rows, i + 1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return i + np.where(b != a, -a / (b - a), 0.0)
+
+    span = position(last) - position(first)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        freq = np.where((count >= 2) & (span > 0), (count - 1) * sample_rate / span, 0.0)
+    return freq
+
+
+def process(buf, thresholds=None):
+    # Decode an upload and evaluate every block against the earthing rule,
+    # with a site's configured band when thresholds is given
+    timestamps, moisture, samples, sample_rate = decode_blocks(buf)
+    metrics = analyze(samples, sample_rate)
+    metrics["earthingGood"] = is_earthing_good(moisture, metrics["voltage"], thresholds)
+    metrics["moisture"] = moisture
+    metrics["t"] = timestamps
+    return metrics
+
+
+def to_json(metrics):
+    # Columnar, rounded for transport
+    out = {"blocks": int(len(metrics["t"])), "t": metrics["t"].tolist()}
+    for key, digits in (("moisture", 1), ("voltage", 4), ("acRms", 4), ("peak", 4),
+                        ("crest", 3), ("frequency", 2), ("dcOffset", 4)):
+        out[key] = np.round(metrics[key].astype(np.float64), digits).tolist()
+    out["earthingGood"] = metrics["earthingGood"].tolist()
+    return out
@@ -111,8 +111,28 @@ console.error('Fetch failed:',e);
 </body></html>
 )rawliteral";
 
+// ===== Dashboard Cache Validation =====
+// ETag is an FNV-1a hash of index_html, so a reflashed page busts caches
+// while reloads of an unchanged page cost only a 304 on the softAP link.
+String htmlETag;
+
+void computeHtmlETag() {
+  uint32_t hash = 2166136261UL;
+  for (const char* p = index_html; pgm_read_byte(p); p++) {
+    hash ^= (uint8_t)pgm_read_byte(p);
+    hash *= 16777619UL;
+  }
+  htmlETag = "\"" + String(hash, HEX) + "\"";
+}
+
 // ===== Web Server Handlers =====
 void handleRoot() {
+  server.sendHeader("ETag", htmlETag);
+  server.sendHeader("Cache-Control", "no-cache");
+  if (server.header("If-None-Match") == htmlETag) {
+    server.send(304);
+    return;
+  }
   server.send(200, "text/html", index_html);
 }
 
@@ -281,6 +301,9 @@ void setup() {
   }
 
   // Web Server Routes
+  const char* headerKeys[] = {"If-None-Match"};
+  server.collectHeaders(headerKeys, 1);
+  computeHtmlETag();
   server.on("/", handleRoot);
   server.on("/data", handleData);
   server.begin();
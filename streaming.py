@@ -0,0 +1,204 @@
+"""
+Server-Sent Events fan-out for the mock server.
+
+One writer thread owns every subscriber socket. Publishers hand it a single
+pre-encoded event and it is written to all subscribers with non-blocking
+sends, so a slow or stalled browser never holds up the others.
+
+Events are state, not deltas: each subscriber holds the event currently
+being written plus the newest pending event per key (e.g. one reading and
+one config update). A consumer that falls behind simply skips intermediate
+readings, but never loses the latest of each kind.
+"""
+import selectors
+import socket
+import threading
+import time
+
+HEARTBEAT_INTERVAL = 15   # Seconds between keep-alive comments when idle
+STALL_TIMEOUT = 30        # Drop a subscriber whose socket accepts nothing for this long
+MAX_SUBSCRIBERS = 2048
+
+
+def encode_event(data, event_id=None, event=None):
+    # data is a pre-serialized JSON bytes payload (single line)
+    parts = []
+    if event is not None:
+        parts.append(b"event: " + event.encode("ascii") + b"\n")
+    if event_id is not None:
+        parts.append(b"id: " + str(event_id).encode("ascii") + b"\n")
+    parts.append(b"data: " + data + b"\n\n")
+    return b"".join(parts)
+
+
+class _Subscriber:
+    __slots__ = ("sock", "out", "offset", "queued", "last_progress")
+
+    def __init__(self, sock, first):
+        self.sock = sock
+        self.out = first
+        self.offset = 0
+        self.queued = {}            # key -> newest pending event
+        self.last_progress = time.monotonic()
+
+
+class StreamHub:
+    def __init__(self, heartbeat=HEARTBEAT_INTERVAL, stall_timeout=STALL_TIMEOUT,
+                 max_subscribers=MAX_SUBSCRIBERS):
+        self.heartbeat = heartbeat
+        self.stall_timeout = stall_timeout
+        self.max_subscribers = max_subscribers
+        self.latest = {}            # key -> last published event, replayed to new subscribers
+        self.events_published = 0
+        self.disconnects = 0
+        self._lock = threading.Lock()
+        self._incoming = []
+        self._subscribers = {}
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._pending = {}
+        self._running = False
+        self._thread = None
+
+    def __len__(self):
+        return len(self._subscribers) + len(self._incoming)
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._run, name="earthing-stream", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wake()
+        if self._thread is not None:
+            self._thread.join(5)
+
+    def subscribe(self, sock, preamble):
+        # Takes ownership of sock, whose HTTP response head has already been
+        # sent. preamble (e.g. the SSE retry hint) and the latest event follow.
+        if len(self) >= self.max_subscribers:
+            return False
+        sock.setblocking(False)
+        with self._lock:
+            first = preamble + b"".join(self.latest.values())
+            self._incoming.append(_Subscriber(sock, first))
+        self.start()
+        self._wake()
+        return True
+
+    def publish(self, event, key=None):
+        # A newer event with the same key supersedes one not yet sent
+        with self._lock:
+            self.latest[key] = event
+            self.events_published += 1
+            self._pending[key] = event
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass  # Already signalled or closing
+
+    def _run(self):
+        last_heartbeat = time.monotonic()
+        while self._running:
+            for key, mask in self._selector.select(timeout=1.0):
+                if key.fileobj is self._wake_r:
+                    self._drain_wake()
+                    continue
+                sub = key.data
+                if mask & selectors.EVENT_READ and self._client_closed(sub):
+                    self._drop(sub)
+                    continue
+                if mask & selectors.EVENT_WRITE:
+                    self._flush(sub)
+
+            with self._lock:
+                incoming, self._incoming = self._incoming, []
+                pending, self._pending = self._pending, {}
+            for sub in incoming:
+                self._subscribers[sub.sock] = sub
+                self._selector.register(sub.sock, selectors.EVENT_READ, sub)
+                self._flush(sub)
+
+            now = time.monotonic()
+            if not pending and now - last_heartbeat >= self.heartbeat:
+                pending = {"ping": b": ping\n\n"}
+            if pending:
+                last_heartbeat = now
+                for sub in list(self._subscribers.values()):
+                    for key, event in pending.items():
+                        self._enqueue(sub, key, event)
+
+            for sub in list(self._subscribers.values()):
+                if sub.out is not None and now - sub.last_progress > self.stall_timeout:
+                    self._drop(sub)
+
+        for sub in list(self._subscribers.values()):
+            self._drop(sub)
+
+    def _drain_wake(self):
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _enqueue(self, sub, key, event):
+        if sub.out is None:
+            sub.out = event
+            sub.offset = 0
+            sub.last_progress = time.monotonic()
+            self._flush(sub)
+        else:
+            # Still writing an older event: replace whatever was waiting
+            # under the same key
+            sub.queued[key] = event
+
+    def _flush(self, sub):
+        while sub.out is not None:
+            try:
+                sent = sub.sock.send(memoryview(sub.out)[sub.offset:])
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                self._drop(sub)
+                return
+            sub.offset += sent
+            sub.last_progress = time.monotonic()
+            if sub.offset < len(sub.out):
+                break
+            sub.offset = 0
+            sub.out = sub.queued.pop(next(iter(sub.queued))) if sub.queued else None
+        if sub.sock in self._subscribers:
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if sub.out is not None else 0)
+            self._selector.modify(sub.sock, events, sub)
+
+    def _client_closed(self, sub):
+        try:
+            return sub.sock.recv(1024) == b""
+        except (BlockingIOError, InterruptedError):
+            return False
+        except OSError:
+            return True
+
+    def _drop(self, sub):
+        if self._subscribers.pop(sub.sock, None) is None:
+            return
+        self.disconnects += 1
+        try:
+            self._selector.unregister(sub.sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            sub.sock.close()
+        except OSError:
+            pass
@@ -0,0 +1,515 @@
+"""
+Store-and-forward uplink to ThingSpeak-compatible bulk-update endpoints.
+
+Readings are coalesced per site into `resolution`-second buckets. A bucket
+carries the mean moisture and voltage, and is BAD if any of its samples
+was. Closed buckets are appended to an on-disk spool per channel. A
+sender thread drains the spools as bulk updates:
+
+    POST {url}/channels/{channel}/bulk_update.json
+    {"write_api_key": "...", "updates": [{"created_at": "2025-01-01T00:00:15Z",
+        "field1": moisture, "field2": voltage, "field3": 1}, ...]}
+
+The fields match docs/thingspeak_guide.md (field3: 1 = GOOD, 0 = BAD).
+Each channel sends at most once per `min_interval` (the free tier's 15 s),
+so one request carries everything queued since the previous one. Requests
+reuse pooled keep-alive connections. Failures back off exponentially with
+jitter, and a 429 waits for its Retry-After. Entries leave the spool only
+after a 2xx, so outages and restarts lose nothing (delivery is at least
+once). A batch the endpoint rejects (400/413/422) is halved and retried
+until the entry it refuses is alone, so only that entry is discarded.
+Readings with a non-finite moisture or voltage are never spooled, since
+JSON has no NaN. The spool is bounded: past `max_spool_bytes`, the oldest
+segment of the largest channel is deleted and counted in `dropped`.
+
+Spool layout, one directory per site: numbered segment files of 20-byte
+records
+
+    timestamp f64 | moisture f32 | voltage f32 | good u8 | pad[3]
+
+plus a `cursor` file (segment u32, offset u64) that is replaced
+atomically after each acknowledged batch.
+"""
+import http.client
+import json
+import math
+import os
+import random
+import re
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from ingest_protocol import SITE_ID_RE
+
+RECORD = struct.Struct('<dffB3x')
+RECORD_SIZE = RECORD.size
+CURSOR = struct.Struct('<IQ')
+SEGMENT_RE = re.compile(r'^(\d{8})\.spool$')
+
+RESOLUTION = 15.0           # Seconds of readings coalesced into one entry
+MIN_INTERVAL = 15.0         # Seconds between bulk updates per channel (free tier)
+MAX_BATCH = 960             # Entries per bulk update (free tier limit)
+MAX_SPOOL_BYTES = 64 * 1024 * 1024
+SEGMENT_BYTES = 256 * 1024
+SENDERS = 4                 # Concurrent requests, and pooled connections
+TIMEOUT = 10.0
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 300.0
+POLL = 0.5                  # Seconds between sender passes
+REJECTED = (400, 413, 422)  # The endpoint will never take this batch
+
+
+class SpoolTotal:
+    # Bytes held by a group of spools, kept up to date as they grow and
+    # shrink so checking the bound does not walk every channel
+    def __init__(self):
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def add(self, size):
+        with self._lock:
+            self.bytes += size
+
+
+class Spool:
+    def __init__(self, directory, segment_bytes=SEGMENT_BYTES, total=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.total = SpoolTotal() if total is None else total
+        os.makedirs(directory, exist_ok=True)
+        self._cursor_path = os.path.join(directory, 'cursor')
+        self._lock = threading.Lock()
+        self._file = None
+        self._dirty = False
+        self.segments = sorted(int(m.group(1)) for name in os.listdir(directory)
+                               for m in [SEGMENT_RE.match(name)] if m)
+        self.sizes = {}
+        for number in self.segments:
+            size = os.path.getsize(self._path(number))
+            if size % RECORD_SIZE:
+                # Torn tail from a crash mid-append
+                size -= size % RECORD_SIZE
+                os.truncate(self._path(number), size)
+            self.sizes[number] = size
+        self.bytes = sum(self.sizes.values())
+        self.total.add(self.bytes)
+        self.cursor = (self.segments[0], 0) if self.segments else (0, 0)
+        if os.path.exists(self._cursor_path):
+            with open(self._cursor_path, 'rb') as f:
+                segment, offset = CURSOR.unpack(f.read(CURSOR.size))
+            if segment in self.sizes:
+                self.cursor = (segment, min(offset, self.sizes[segment]))
+        # Segments before the cursor were sent; a crash can leave them behind
+        while self.segments and self.segments[0] < self.cursor[0]:
+            self._delete(self.segments[0])
+        self._next = max(self.segments[-1] if self.segments else 0, self.cursor[0]) + 1
+
+    def __len__(self):
+        return (self.bytes - self.cursor[1]) // RECORD_SIZE
+
+    def _path(self, number):
+        return os.path.join(self.directory, f'{number:08d}.spool')
+
+    def _delete(self, number):
+        self.segments.remove(number)
+        size = self.sizes.pop(number)
+        self.bytes -= size
+        self.total.add(-size)
+        os.remove(self._path(number))
+
+    def _save_cursor(self):
+        tmp = self._cursor_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(CURSOR.pack(*self.cursor))
+        os.replace(tmp, self._cursor_path)
+
+    def append(self, records):
+        data = b''.join(RECORD.pack(*r) for r in records)
+        with self._lock:
+            if not self.segments or self.sizes[self.segments[-1]] >= self.segment_bytes:
+                number = self._next
+                self._next += 1
+                if self._file is not None:
+                    self._file.close()
+                if self.cursor[1] == self.sizes.get(self.cursor[0], 0):
+                    # Everything before is sent; start reading the new segment
+                    old = self.cursor[0]
+                    self.cursor = (number, 0)
+                    if old in self.sizes:
+                        self._delete(old)
+                    self._save_cursor()
+                self._file = open(self._path(number), 'ab', buffering=0)
+                self.segments.append(number)
+                self.sizes[number] = 0
+            elif self._file is None:
+                self._file = open(self._path(self.segments[-1]), 'ab', buffering=0)
+            self._file.write(data)
+            self.sizes[self.segments[-1]] += len(data)
+            self.bytes += len(data)
+            self.total.add(len(data))
+            self._dirty = True
+
+    def peek(self, limit):
+        # (position, records): up to limit unsent records, oldest first
+        records = []
+        with self._lock:
+            segment, offset = position = self.cursor
+            for number in self.segments:
+                start = offset if number == segment else 0
+                want = min(self.sizes[number] - start, (limit - len(records)) * RECORD_SIZE)
+                if want > 0:
+                    with open(self._path(number), 'rb') as f:
+                        f.seek(start)
+                        records.extend(RECORD.iter_unpack(f.read(want)))
+                if len(records) >= limit:
+                    break
+        return position, records
+
+    def ack(self, position, count):
+        # count records from a peek() at position were delivered
+        with self._lock:
+            if position[0] not in self.sizes:
+                return  # Trimmed by drop_oldest() meanwhile; rest may go twice
+            segment, offset = position
+            offset += count * RECORD_SIZE
+            while offset >= self.sizes[segment] and segment != self.segments[-1]:
+                offset -= self.sizes[segment]
+                self._delete(segment)
+                segment = self.segments[0]
+            if (segment, offset) > self.cursor:
+                self.cursor = (segment, offset)
+                self._save_cursor()
+
+    def drop_oldest(self):
+        # Frees the oldest segment; returns how many unsent records were lost.
+        # A batch in flight from it may still be delivered.
+        with self._lock:
+            if not self.segments:
+                return 0
+            segment, offset = self.cursor
+            dropped = (self.sizes[segment] - offset) // RECORD_SIZE
+            if len(self.segments) == 1 and self._file is not None:
+                self._file.close()
+                self._file = None
+            self._delete(segment)
+            self.cursor = (self.segments[0], 0) if self.segments else (self._next, 0)
+            self._save_cursor()
+            return dropped
+
+    def sync(self):
+        with self._lock:
+            if self._dirty and self._file is not None:
+                os.fsync(self._file.fileno())
+                self._dirty = False
+
+    def close(self):
+        self.sync()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+class ConnectionPool:
+    # Keep-alive connections to one host. Idle ones are reused newest
+    # first, so surplus connections age out on the server side.
+
+    def __init__(self, url, size=SENDERS, timeout=TIMEOUT):
+        target = urlparse(url)
+        if target.scheme not in ('http', 'https'):
+            raise ValueError(f"uplink url must be http(s), got {url!r}")
+        self.factory = http.client.HTTPSConnection if target.scheme == 'https' else http.client.HTTPConnection
+        self.host = target.hostname
+        self.port = target.port
+        self.size = size
+        self.timeout = timeout
+        self.opened = 0
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def request(self, method, path, body=None, headers=None):
+        # Returns (status, response, data). A reused connection the server
+        # has already closed is retried once on a fresh one.
+        for attempt in range(2):
+            with self._lock:
+                conn = self._idle.pop() if self._idle and not attempt else None
+                if conn is None:
+                    self.opened += 1
+            reused = conn is not None
+            if conn is None:
+                conn = self.factory(self.host, self.port, timeout=self.timeout)
+            try:
+                conn.request(method, path, body, headers or {})
+                response = conn.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                if reused:
+                    continue
+                raise
+            if response.will_close:
+                conn.close()
+            else:
+                with self._lock:
+                    if len(self._idle) < self.size:
+                        self._idle.append(conn)
+                        conn = None
+                if conn is not None:
+                    conn.close()
+            return response.status, response, data
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class Channel:
+    def __init__(self, site, channel, key, spool):
+        self.site = site
+        self.channel = channel
+        self.key = key
+        self.spool = spool
+        self.next_attempt = 0.0     # time.monotonic() of the next allowed request
+        self.failures = 0           # Consecutive, drives the backoff
+        self.error = None
+        self.sent = 0
+        self.requests = 0
+        self.errors = 0
+        self.rate_limited = 0
+        self.rejected = 0
+        self.batch_limit = None     # Entries per request while isolating a rejected entry
+        self.last_sent = None       # Wall time of the last accepted batch
+
+
+def created_at(timestamp):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
+
+
+class Uplink:
+    def __init__(self, url, channels, directory, resolution=RESOLUTION, min_interval=MIN_INTERVAL,
+                 max_batch=MAX_BATCH, max_spool_bytes=MAX_SPOOL_BYTES, segment_bytes=None,
+                 senders=SENDERS, timeout=TIMEOUT, backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX,
+                 poll=POLL):
+        # channels: {site: {"channel": id, "key": write API key}}
+        self.path = urlparse(url).path.rstrip('/') + '/channels/{}/bulk_update.json'
+        self.pool = ConnectionPool(url, senders, timeout)
+        self.resolution = resolution
+        self.min_interval = min_interval
+        self.max_batch = max_batch
+        self.max_spool_bytes = max_spool_bytes
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll = poll
+        if segment_bytes is None:
+            # Small enough that dropping one segment trims a little, not a
+            # whole channel's backlog
+            share = max_spool_bytes // (4 * max(1, len(channels)))
+            segment_bytes = max(64 * RECORD_SIZE, min(SEGMENT_BYTES, share - share % RECORD_SIZE))
+        self.channels = {}
+        self._spool_total = SpoolTotal()
+        for site, spec in channels.items():
+            if not SITE_ID_RE.match(site) or site in ('.', '..'):
+                raise ValueError(f"invalid site id {site!r}")
+            try:
+                channel, key = spec["channel"], spec["key"]
+            except (KeyError, TypeError):
+                raise ValueError(f"uplink channel for {site!r} needs 'channel' and 'key'") from None
+            spool = Spool(os.path.join(directory, site), segment_bytes, self._spool_total)
+            self.channels[site] = Channel(site, channel, key, spool)
+        self.readings = 0
+        self.invalid = 0            # Non-finite readings, never spooled
+        self.spooled = 0
+        self.dropped = 0
+        # site -> [start, count, moisture sum, voltage sum, good, last add (monotonic)]
+        self._buckets = {}
+        # Buckets still open at the last close() continue where they were
+        self._buckets_path = os.path.join(directory, 'buckets.json')
+        if os.path.exists(self._buckets_path):
+            with open(self._buckets_path) as f:
+                saved = json.load(f)
+            os.remove(self._buckets_path)
+            now = time.monotonic()
+            self._buckets = {site: bucket + [now] for site, bucket in saved.items() if site in self.channels}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._senders = ThreadPoolExecutor(max_workers=senders, thread_name_prefix="earthing-uplink")
+
+    def depth(self):
+        # Entries waiting: spooled and not yet acknowledged, plus open buckets
+        return sum(len(c.spool) for c in self.channels.values()) + len(self._buckets)
+
+    def spool_bytes(self):
+        return self._spool_total.bytes
+
+    def add(self, site, timestamp, moisture, voltage, good):
+        channel = self.channels.get(site)
+        if channel is None:
+            return
+        if not (math.isfinite(moisture) and math.isfinite(voltage)):
+            # A NaN mean would make the endpoint reject a whole batch
+            self.invalid += 1
+            return
+        start = timestamp - timestamp % self.resolution if self.resolution else timestamp
+        with self._lock:
+            self.readings += 1
+            bucket = self._buckets.get(site)
+            if bucket is not None and bucket[0] == start:
+                bucket[1] += 1
+                bucket[2] += moisture
+                bucket[3] += voltage
+                bucket[4] = bucket[4] and good
+                bucket[5] = time.monotonic()
+                return
+            self._buckets[site] = [start, 1, moisture, voltage, good, time.monotonic()]
+            if bucket is not None:
+                self._spool(channel, [bucket])
+
+    def flush(self, idle=None):
+        # A site's bucket closes when its next one starts. This spools the
+        # buckets of sites that went quiet for idle seconds (all if None).
+        now = time.monotonic()
+        with self._lock:
+            closed = [site for site, bucket in self._buckets.items()
+                      if idle is None or bucket[5] + idle <= now]
+            for site in closed:
+                self._spool(self.channels[site], [self._buckets.pop(site)])
+
+    def _spool(self, channel, buckets):
+        # Under self._lock
+        channel.spool.append([(b[0], b[2] / b[1], b[3] / b[1], b[4]) for b in buckets])
+        self.spooled += len(buckets)
+        while self.spool_bytes() > self.max_spool_bytes:
+            largest = max(self.channels.values(), key=lambda c: c.spool.bytes)
+            before = largest.spool.bytes
+            self.dropped += largest.spool.drop_oldest()
+            if largest.spool.bytes == before:
+                break
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="earthing-uplink", daemon=True)
+            self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._senders.shutdown()
+        # Open buckets are saved rather than sent, so readings after a
+        # restart extend them instead of adding a second entry
+        with self._lock:
+            if self._buckets:
+                with open(self._buckets_path, 'w') as f:
+                    json.dump({site: bucket[:5] for site, bucket in self._buckets.items()}, f)
+            self._buckets = {}
+        for channel in self.channels.values():
+            channel.spool.close()
+        self.pool.close()
+
+    def _run(self):
+        while not self._stop.wait(self.poll):
+            self.flush(max(self.resolution, self.poll))
+            now = time.monotonic()
+            due = [c for c in self.channels.values() if c.next_attempt <= now and len(c.spool)]
+            if due:
+                list(self._senders.map(self._send, due))
+            for channel in self.channels.values():
+                channel.spool.sync()
+
+    def _send(self, channel):
+        position, records = channel.spool.peek(channel.batch_limit or self.max_batch)
+        if not records:
+            return
+        updates = [{"created_at": created_at(t), "field1": round(m, 2), "field2": round(v, 4), "field3": int(good)}
+                   for t, m, v, good in records]
+        body = json.dumps({"write_api_key": channel.key, "updates": updates},
+                          separators=(',', ':')).encode('utf-8')
+        channel.requests += 1
+        try:
+            status, response, _ = self.pool.request("POST", self.path.format(channel.channel), body,
+                                                    {"Content-Type": "application/json"})
+        except (OSError, http.client.HTTPException) as e:
+            self._failed(channel, str(e) or type(e).__name__)
+            return
+        now = time.monotonic()
+        if 200 <= status < 300:
+            channel.spool.ack(position, len(records))
+            channel.sent += len(records)
+            channel.failures = 0
+            channel.error = None
+            channel.last_sent = time.time()
+            channel.next_attempt = now + self.min_interval
+            if channel.batch_limit is not None:
+                # Past the rejected entry: grow back to full batches
+                channel.batch_limit *= 2
+                if channel.batch_limit >= self.max_batch:
+                    channel.batch_limit = None
+        elif status == 429:
+            channel.rate_limited += 1
+            channel.error = "rate limited"
+            try:
+                retry_after = float(response.getheader('Retry-After'))
+            except (TypeError, ValueError):
+                retry_after = self.min_interval
+            channel.next_attempt = now + max(retry_after, self.min_interval)
+        elif status in REJECTED and len(records) > 1:
+            # Some entry is refused; halve the batch until it is alone
+            channel.batch_limit = len(records) // 2
+            channel.error = f"HTTP {status}, retrying {len(records)} entries in smaller batches"
+            channel.next_attempt = now + self.min_interval
+        elif status in REJECTED:
+            # Retrying this one entry would block the channel forever
+            channel.spool.ack(position, len(records))
+            channel.rejected += len(records)
+            channel.error = f"HTTP {status}, entry at {created_at(records[0][0])} rejected"
+            channel.next_attempt = now + self.min_interval
+        else:
+            self._failed(channel, f"HTTP {status}")
+
+    def _failed(self, channel, error):
+        # Same jittered exponential backoff as the gateway's device polls
+        channel.errors += 1
+        channel.failures += 1
+        channel.error = error
+        delay = min(self.backoff_max, self.backoff_base * 2 ** (channel.failures - 1))
+        channel.next_attempt = time.monotonic() + delay * random.uniform(0.5, 1.0)
+
+    def totals(self):
+        channels = list(self.channels.values())
+        return {
+            "depth": self.depth(),
+            "spool_bytes": self.spool_bytes(),
+            "readings": self.readings,
+            "invalid": self.invalid,
+            "spooled": self.spooled,
+            "sent": sum(c.sent for c in channels),
+            "requests": sum(c.requests for c in channels),
+            "errors": sum(c.errors for c in channels),
+            "rate_limited": sum(c.rate_limited for c in channels),
+            "rejected": sum(c.rejected for c in channels),
+            "dropped": self.dropped,
+            "connections": self.pool.opened,
+        }
+
+    def status(self):
+        now = time.monotonic()
+        result = self.totals()
+        result["channels"] = {
+            c.site: {
+                "channel": c.channel,
+                "depth": len(c.spool),
+                "sent": c.sent,
+                "error": c.error,
+                "retry_in": round(max(0.0, c.next_attempt - now), 1) if len(c.spool) else None,
+                "last_sent": c.last_sent,
+            }
+            for c in self.channels.values()
+        }
+        return result
@@ -0,0 +1,102 @@
+/* Local stand-in for the part of the Chart.js API the dashboards use, so
+   the chart works on the offline softAP network: new Chart(ctx, config)
+   with one line dataset (borderColor, backgroundColor, borderWidth, fill,
+   tension), y-axis suggestedMin/Max, grid and tick colours, and update().
+   Redraws on update() and when its container is resized. */
+(function (global) {
+    'use strict';
+
+    function niceStep(range) {
+        const raw = range / 5;
+        const mag = Math.pow(10, Math.floor(Math.log10(raw)));
+        const norm = raw / mag;
+        return (norm < 1.5 ? 1 : norm < 3 ? 2 : norm < 7 ? 5 : 10) * mag;
+    }
+
+    function Chart(ctx, config) {
+        this.ctx = ctx;
+        this.canvas = ctx.canvas;
+        this.data = config.data;
+        this.options = config.options || {};
+        if (this.options.responsive !== false && global.ResizeObserver) {
+            new ResizeObserver(() => this.update()).observe(this.canvas.parentNode);
+        }
+        this.update();
+    }
+
+    Chart.prototype.update = function () {
+        const canvas = this.canvas;
+        const ctx = this.ctx;
+        const dpr = global.devicePixelRatio || 1;
+        const width = canvas.parentNode.clientWidth || canvas.clientWidth || 300;
+        const height = canvas.parentNode.clientHeight || canvas.clientHeight || 150;
+        if (canvas.width !== Math.round(width * dpr) || canvas.height !== Math.round(height * dpr)) {
+            canvas.width = Math.round(width * dpr);
+            canvas.height = Math.round(height * dpr);
+            canvas.style.width = width + 'px';
+            canvas.style.height = height + 'px';
+        }
+        ctx.setTransform(dpr, 0, 0, dpr, 0, 0);
+        ctx.clearRect(0, 0, width, height);
+
+        const dataset = this.data.datasets[0];
+        const values = dataset.data;
+        const y = (this.options.scales && this.options.scales.y) || {};
+        let min = Math.min(...values, y.suggestedMin ?? Infinity);
+        let max = Math.max(...values, y.suggestedMax ?? -Infinity);
+        if (y.beginAtZero) min = Math.min(min, 0);
+        if (!(max > min)) { min -= 1; max += 1; }
+        const step = niceStep(max - min);
+        min = Math.floor(min / step) * step;
+        max = Math.ceil(max / step) * step;
+        const decimals = Math.max(0, -Math.floor(Math.log10(step)));
+
+        ctx.font = '12px system-ui, sans-serif';
+        ctx.textBaseline = 'middle';
+        const labels = [];
+        for (let v = min; v <= max + step / 2; v += step) labels.push(v);
+        const left = 8 + Math.max(...labels.map(v => ctx.measureText(v.toFixed(decimals)).width));
+        const top = 6, bottom = height - 6, right = width - 4;
+        const px = i => left + (right - left) * (values.length > 1 ? i / (values.length - 1) : 0);
+        const py = v => bottom - (bottom - top) * (v - min) / (max - min);
+
+        // Grid and tick labels
+        ctx.lineWidth = 1;
+        ctx.strokeStyle = (y.grid && y.grid.color) || 'rgba(0,0,0,0.1)';
+        ctx.fillStyle = (y.ticks && y.ticks.color) || '#666';
+        ctx.textAlign = 'right';
+        for (const v of labels) {
+            const yy = Math.round(py(v)) + 0.5;
+            ctx.beginPath();
+            ctx.moveTo(left, yy);
+            ctx.lineTo(right, yy);
+            ctx.stroke();
+            ctx.fillText(v.toFixed(decimals), left - 6, yy);
+        }
+        if (!values.length) return;
+
+        // Line through the points as a cardinal spline, like Chart.js tension
+        const t = (dataset.tension || 0) / 2;
+        const pts = values.map((v, i) => [px(i), py(v)]);
+        ctx.beginPath();
+        ctx.moveTo(pts[0][0], pts[0][1]);
+        for (let i = 0; i < pts.length - 1; i++) {
+            const p0 = pts[Math.max(i - 1, 0)], p1 = pts[i], p2 = pts[i + 1], p3 = pts[Math.min(i + 2, pts.length - 1)];
+            ctx.bezierCurveTo(p1[0] + (p2[0] - p0[0]) * t / 2, p1[1] + (p2[1] - p0[1]) * t / 2,
+                              p2[0] - (p3[0] - p1[0]) * t / 2, p2[1] - (p3[1] - p1[1]) * t / 2,
+                              p2[0], p2[1]);
+        }
+        ctx.lineWidth = dataset.borderWidth || 2;
+        ctx.strokeStyle = dataset.borderColor || '#3b82f6';
+        ctx.stroke();
+        if (dataset.fill) {
+            ctx.lineTo(pts[pts.length - 1][0], bottom);
+            ctx.lineTo(pts[0][0], bottom);
+            ctx.closePath();
+            ctx.fillStyle = dataset.backgroundColor || 'rgba(59,130,246,0.1)';
+            ctx.fill();
+        }
+    };
+
+    global.Chart = Chart;
+})(window);
@@ -91,31 +91,68 @@ document.addEventListener('DOMContentLoaded', () => {
         return { earthingGood, soilGood, voltGood };
     }
 
+    function showReading(data) {
+        // Expected JSON: { "moisture": 45, "voltage": 2.58 }, optionally with
+        // the server's debounced "state" and per-sample soilGood/voltGood.
+        // Only fall back to the local check when the server sends none.
+        const local = checkEarthingStatus(data.moisture, data.voltage);
+        const earthingGood = data.state ? data.state !== 'BAD' : local.earthingGood;
+        const soilGood = data.soilGood ?? local.soilGood;
+        const voltGood = data.voltGood ?? local.voltGood;
+
+        updateDashboard(data.moisture, data.voltage, earthingGood, soilGood, voltGood);
+
+        // Update connection status
+        statusBadgeText.textContent = 'CONNECTED';
+        statusBadgeText.style.color = 'var(--accent-success)';
+        statusDot.style.backgroundColor = 'var(--accent-success)';
+    }
+
+    function showDisconnected() {
+        statusBadgeText.textContent = 'DISCONNECTED';
+        statusBadgeText.style.color = 'var(--text-secondary)';
+        statusDot.style.backgroundColor = 'var(--text-secondary)';
+    }
+
     async function fetchData() {
         try {
             const response = await fetch('/data');
             if (!response.ok) throw new Error('Network response was not ok');
-            const data = await response.json();
-
-            // Expected JSON: { "moisture": 45, "voltage": 2.58 }
-            const { earthingGood, soilGood, voltGood } = checkEarthingStatus(data.moisture, data.voltage);
-            
-            updateDashboard(data.moisture, data.voltage, earthingGood, soilGood, voltGood);
-
-            // Update connection status
-            statusBadgeText.textContent = 'CONNECTED';
-            statusBadgeText.style.color = 'var(--accent-success)';
-            statusDot.style.backgroundColor = 'var(--accent-success)';
-
+            showReading(await response.json());
         } catch (error) {
             console.error('Fetch error:', error);
             // Show disconnected status
-            statusBadgeText.textContent = 'DISCONNECTED';
-            statusBadgeText.style.color = 'var(--text-secondary)';
-            statusDot.style.backgroundColor = 'var(--text-secondary)';
+            showDisconnected();
         }
     }
 
+    let pollTimer = null;
+
+    function startPolling() {
+        if (pollTimer) return;
+        fetchData();
+        pollTimer = setInterval(fetchData, 1000); // Poll every second
+    }
+
+    // Prefer server push over /stream (SSE). Servers without the route
+    // (e.g. older firmware) close the EventSource and we fall back to polling.
+    function startStream() {
+        if (!window.EventSource) {
+            startPolling();
+            return;
+        }
+        const source = new EventSource('/stream');
+        source.onmessage = (event) => showReading(JSON.parse(event.data));
+        source.onerror = () => {
+            if (source.readyState === EventSource.CLOSED) {
+                startPolling();
+            } else {
+                // Browser is reconnecting on its own
+                showDisconnected();
+            }
+        };
+    }
+
     function updateDashboard(moistureVal, voltageVal, earthingGood, isSoilGood, isVoltGood) {
         // Round values
         const dispMoisture = Math.round(moistureVal);
@@ -201,11 +238,26 @@ document.addEventListener('DOMContentLoaded', () => {
         voltageChart.update();
     }
 
+    // Restore the chart's trend after a reload. Servers without /history
+    // (e.g. the ESP32 firmware) just leave the chart empty.
+    async function backfillChart() {
+        try {
+            const response = await fetch('/history?from=-20&step=1');
+            if (!response.ok) return;
+            const history = await response.json();
+            const points = history.voltage.avg.slice(-20);
+            const data = voltageChart.data.datasets[0].data;
+            data.splice(0, data.length, ...Array(20 - points.length).fill(0), ...points);
+            voltageChart.update();
+        } catch (error) {
+            console.error('History error:', error);
+        }
+    }
+
     // Start Loops
     setInterval(updateClock, 1000);
-    setInterval(fetchData, 1000); // Poll every second
 
     // Initial call
     updateClock();
-    fetchData();
+    backfillChart().then(startStream);
 });